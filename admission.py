@@ -0,0 +1,205 @@
+# admission.py
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import jsonify, make_response, request
+
+# Commands parsed/applied at the same time per worker process. spaCy parsing is CPU-bound and
+# holds the GIL, so more concurrency only makes every parse slower.
+MAX_CONCURRENT_COMMANDS = int(os.environ.get('NLP_MAX_CONCURRENCY', 2))
+# Requests allowed to wait for a slot; beyond this, new requests are rejected right away.
+# Each waiting request holds a gunicorn thread (see 'threads' in gunicorn.conf.py).
+MAX_QUEUED_COMMANDS = int(os.environ.get('NLP_MAX_QUEUE', 4))
+# A command must be finished this long after it arrived, or the client has likely given up already
+REQUEST_DEADLINE_SECONDS = float(os.environ.get('NLP_REQUEST_DEADLINE_SECONDS', 4.0))
+# Starting estimate of how long one command holds a slot, refined as commands complete
+INITIAL_SERVICE_SECONDS = 0.1
+SERVICE_TIME_SMOOTHING = 0.2 # Weight of the newest sample in the moving average
+
+# Per-client token bucket: a sustained rate plus a burst for quick successive commands
+CLIENT_RATE_PER_SECOND = float(os.environ.get('NLP_CLIENT_RATE_PER_SECOND', 2.0))
+CLIENT_BURST = int(os.environ.get('NLP_CLIENT_BURST', 10))
+MAX_TRACKED_CLIENTS = 10000 # Least recently seen clients are forgotten (their bucket starts full again)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is not admitted; carries the HTTP status and Retry-After seconds."""
+
+    def __init__(self, status_code, message, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class ClientRateLimiter:
+    """Token buckets keyed by client (user ID or address), refilled continuously."""
+
+    def __init__(self, rate_per_second=CLIENT_RATE_PER_SECOND, burst=CLIENT_BURST, max_clients=MAX_TRACKED_CLIENTS):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = OrderedDict() # client key -> (tokens, last refill time)
+        self.lock = threading.Lock()
+
+    def try_acquire(self, client_key, cost=1):
+        """
+        Takes tokens from the client's bucket.
+
+        Returns:
+            float: 0 if the request may proceed, otherwise the seconds until enough tokens are back.
+        """
+        now = time.monotonic()
+        with self.lock:
+            tokens, last_refill = self.buckets.pop(client_key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last_refill) * self.rate_per_second)
+            wait_seconds = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait_seconds = (cost - tokens) / self.rate_per_second
+            self.buckets[client_key] = (tokens, now) # Re-inserted as most recently seen
+            while len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+            return wait_seconds
+
+
+class AdmissionController:
+    """
+    Bounded concurrency limiter with queue-time deadlines.
+
+    At most max_concurrent commands run at once; others wait in a bounded queue. A waiting
+    request gives up (503) as soon as it could no longer finish within its deadline, judged by a
+    moving average of how long commands take, and a request that clearly can't make it is
+    rejected before it starts waiting. Overload therefore turns into fast rejections with a
+    Retry-After hint instead of ever-growing latency.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_COMMANDS, max_queued=MAX_QUEUED_COMMANDS,
+                 deadline_seconds=REQUEST_DEADLINE_SECONDS):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.deadline_seconds = deadline_seconds
+        self.service_seconds = INITIAL_SERVICE_SECONDS
+        self.in_flight = 0
+        self.queued = 0
+        self.condition = threading.Condition()
+        self.counters = {'admitted': 0, 'rate_limited': 0, 'shed_optional': 0, 'rejected_queue_full': 0,
+                         'rejected_deadline': 0, 'max_queue_depth': 0}
+
+    def estimated_wait(self, position):
+        """Estimated seconds until the request at this queue position gets a slot (call with the lock held)."""
+        return position / self.max_concurrent * self.service_seconds
+
+    def acquire(self, wait=True):
+        """
+        Waits for a slot. With wait=False the request is only admitted if a slot is free now
+        (used for optional work, which is shed first under load).
+
+        Raises:
+            AdmissionRejected: 503 if the queue is full or the deadline can't be met.
+        """
+        arrived_at = time.monotonic()
+        with self.condition:
+            if self.in_flight < self.max_concurrent and self.queued == 0:
+                self.in_flight += 1
+                self.counters['admitted'] += 1
+                return
+
+            # Latest moment the command can start and still finish before its deadline
+            latest_start = arrived_at + self.deadline_seconds - self.service_seconds
+            retry_after = self.estimated_wait(self.queued + 1)
+            if not wait:
+                self.counters['shed_optional'] += 1
+                raise AdmissionRejected(503, "Skipped while the assistant is busy.", retry_after)
+            if self.queued >= self.max_queued:
+                self.counters['rejected_queue_full'] += 1
+                raise AdmissionRejected(503, "The assistant is busy right now. Please try again shortly.", retry_after)
+            if arrived_at + retry_after > latest_start:
+                self.counters['rejected_deadline'] += 1
+                raise AdmissionRejected(503, "The assistant is busy right now. Please try again shortly.", retry_after)
+
+            self.queued += 1
+            self.counters['max_queue_depth'] = max(self.counters['max_queue_depth'], self.queued)
+            try:
+                while self.in_flight >= self.max_concurrent:
+                    remaining = latest_start - time.monotonic()
+                    if remaining <= 0:
+                        self.counters['rejected_deadline'] += 1
+                        raise AdmissionRejected(503, "The assistant is busy right now. Please try again shortly.",
+                                                self.estimated_wait(self.queued))
+                    self.condition.wait(remaining)
+                self.in_flight += 1
+                self.counters['admitted'] += 1
+            finally:
+                self.queued -= 1
+
+    def record_rate_limited(self):
+        with self.condition:
+            self.counters['rate_limited'] += 1
+
+    def release(self, service_seconds):
+        """Frees the slot and folds the command's duration into the service time estimate."""
+        with self.condition:
+            self.in_flight -= 1
+            self.service_seconds += SERVICE_TIME_SMOOTHING * (service_seconds - self.service_seconds)
+            self.condition.notify()
+
+    def as_dict(self):
+        """Current queue depth and counters of this worker process, for the metrics endpoint."""
+        with self.condition:
+            return dict(self.counters, pid=os.getpid(), in_flight=self.in_flight, queue_depth=self.queued,
+                        max_concurrent=self.max_concurrent, max_queued=self.max_queued,
+                        deadline_ms=round(self.deadline_seconds * 1000),
+                        avg_service_ms=round(self.service_seconds * 1000, 1))
+
+
+# Shared by all request threads of a worker process
+admission_controller = AdmissionController()
+client_rate_limiter = ClientRateLimiter()
+
+
+def get_client_key():
+    """
+    Identifies the caller for rate limiting by its address. Client-supplied values (headers, tokens)
+    are not used, since a client could change them on every request to get a fresh bucket.
+    Behind a reverse proxy, set TRUSTED_PROXY_COUNT so remote_addr is the client's (see app.py).
+    """
+    return (request.remote_addr or 'unknown')[:64]
+
+
+def admission_controlled(wait=True, rate_limited=True):
+    """
+    Decorator for the NLP endpoints: applies the caller's rate limit, then runs the view inside a
+    concurrency slot. Rejections are returned as 429/503 JSON errors with a Retry-After header.
+
+    Args:
+        wait: False for optional work (e.g. speculation) that should only run on an idle slot.
+        rate_limited: False for requests that must not use up the client's tokens, so that
+                      optional work never causes the real command to be rate limited.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                rate_limit_wait = client_rate_limiter.try_acquire(get_client_key()) if rate_limited else 0
+                if rate_limit_wait > 0:
+                    admission_controller.record_rate_limited()
+                    raise AdmissionRejected(429, "Too many commands. Please slow down a little.", rate_limit_wait)
+                admission_controller.acquire(wait=wait)
+            except AdmissionRejected as e:
+                response = make_response(jsonify({"status": "error", "message": e.message}), e.status_code)
+                response.headers['Retry-After'] = str(e.retry_after)
+                return response
+
+            started_at = time.monotonic()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                admission_controller.release(time.monotonic() - started_at)
+        return wrapper
+    return decorator
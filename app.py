@@ -1,164 +1,429 @@
+# Imported first, so PROCESS_START marks when the worker started loading the app
+from startup import startup_report
+
 import os
 import json
 from datetime import datetime
+import click
 import firebase_admin
 from firebase_admin import credentials, firestore
-
-from flask import Flask, render_template, request, jsonify
+from google.api_core.exceptions import Conflict
+
+from flask import Flask, Response, render_template, request, jsonify, abort, make_response, send_file, stream_with_context
+from markupsafe import Markup
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from admission import admission_controlled, admission_controller
+from assets import AssetManifest, add_static_cache_headers
+from history_buffer import history_buffer
+from history_compaction import DEFAULT_HORIZON_DAYS, compact_user_history, compact_all_history
+from item_model import COMPACT_ITEM_FIELDS, ListItem, get_display_name, get_item_id, serialize_item
+from list_session import execute_commands, run_list_session
+from profiling import (
+    PROFILE_TOKEN_HEADER, DEFAULT_TOKEN_TTL_SECONDS, start_request_profile, finish_request_profile,
+    abandon_request_profile, tag_profile, make_profile_token, is_valid_profile_token, list_profiles, get_profile_path
+)
+from purchases import to_purchase_document, to_item_document, find_latest_purchase, migrate_bought_items
+from response_utils import compress_response, dumps_compact, json_response
+from speculation import MAX_TRANSCRIPT_LENGTH, speculation_cache
+from tenancy import (
+    DEFAULT_USER_ID, DEFAULT_LIST_ID, is_valid_tenant_id, ensure_list_exists, make_user_token,
+    get_user_id_from_token, create_user, create_list, get_user_ref, get_lists_ref, get_list_ref, get_list_items_ref, get_purchases_ref
+)
+from recipe_manager import RECIPES_DATA
+
+# The heavy modules are imported (and the spaCy model loaded) here, before the worker accepts
+# traffic, rather than inside the first request that needs them.
+with startup_report.phase('import_recommender'):
+    from rec_cache import get_cached_recommendations, bump_list_version # Pulls in the recommender and pandas
+    from fragment_cache import get_cached_fragment
+with startup_report.phase('load_nlp_model'):
+    from nlp_model import process_command, process_compound_command # Loads spaCy and the en_core_web_sm model
+    process_command("add milk") # Warm-up parse, so the first real command doesn't pay for lazy initialization
 
 # 1. Initialize Flask app IMMEDIATELY after imports
 app = Flask(__name__)
+# Legacy routes (e.g. '/api/get_list_items') default to the user's main list; don't redirect
+# the equivalent '/api/lists/my_shopping_list/...' URLs to them.
+app.url_map.redirect_defaults = False
+
+# Behind a reverse proxy (e.g. on Render), take the client address from the X-Forwarded-For entries
+# added by this many trusted proxies; the rate limiter keys on it (see admission.get_client_key)
+TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
+if TRUSTED_PROXY_COUNT:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT, x_proto=TRUSTED_PROXY_COUNT)
+
+# Opt-in cProfile of single requests (signed X-Profile-Token header or PROFILE_SAMPLE_RATE, see
+# profiling.py). Registered first, so its after_request hook runs last and covers the other hooks too.
+app.before_request(start_request_profile)
+app.after_request(finish_request_profile)
+app.teardown_request(abandon_request_profile)
+
+# Compress larger JSON/HTML responses (gzip, or Brotli when installed) if the client accepts it
+app.after_request(compress_response)
+
+# Fingerprinted static assets produced by build_assets.py (falls back to the source files without a build)
+asset_manifest = AssetManifest(app.static_folder)
+app.jinja_env.globals.update(asset_url=asset_manifest.url, has_built_asset=asset_manifest.has,
+                             assets_built=asset_manifest.is_built)
+app.after_request(add_static_cache_headers)
+
+# Upper bound on queued offline commands accepted by a single /api/sync request
+MAX_SYNC_COMMANDS = 50
+# Upper bound on operations in one /api/items/bulk request (each needs at most 2 of a WriteBatch's 500 writes)
+MAX_BULK_OPERATIONS = 100
+BULK_OPERATION_TYPES = ('toggle', 'delete', 'edit')
+# /api/clear_list deletes this many items per WriteBatch (Firestore allows at most 500 operations)
+CLEAR_BATCH_SIZE = 500
+# The summarized 'cleared' history event keeps at most this many item names
+MAX_SUMMARY_ITEM_NAMES = 100
+# Opt-in: parse interim speech results ahead of the final command (see speculation.py)
+SPECULATIVE_PARSING_ENABLED = os.environ.get('SPECULATIVE_PARSING') == '1'
+# Opt-in: send the index page right away when its list fragments aren't cached, and let the
+# page load the list and recommendations itself (instead of rendering them on the server first)
+ASYNC_LIST_HYDRATION = os.environ.get('ASYNC_LIST_HYDRATION') == '1'
+# Cursor pagination of list items: items rendered into the initial page, default and maximum page sizes
+INITIAL_PAGE_SIZE = 50
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
 
 # 2. Initialize Firebase Admin SDK and Firestore client (db)
 SERVICE_ACCOUNT_KEY_PATH_LOCAL = 'firebase-service-account.json'
 db = None
 
-cred = None
-if 'GOOGLE_APPLICATION_CREDENTIALS_JSON' in os.environ:
-    try:
-        cred_json_str = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS_JSON')
-        cred_json = json.loads(cred_json_str)
-        cred = credentials.Certificate(cred_json)
-        print("Firebase credentials loaded from environment variable.")
-    except json.JSONDecodeError as e:
-        print(f"Error decoding GOOGLE_APPLICATION_CREDENTIALS_JSON: {e}")
-        print("Ensure the environment variable contains valid JSON.")
-    except Exception as e:
-        print(f"Error creating Firebase credentials from environment variable: {e}")
-elif os.path.exists(SERVICE_ACCOUNT_KEY_PATH_LOCAL):
-    cred = credentials.Certificate(SERVICE_ACCOUNT_KEY_PATH_LOCAL)
-    print(f"Firebase credentials loaded from local file: {SERVICE_ACCOUNT_KEY_PATH_LOCAL}")
-else:
-    print("Warning: Firebase service account credentials JSON file not found locally, and GOOGLE_APPLICATION_CREDENTIALS_JSON environment variable is not set or invalid.")
-    print("App may not function correctly without Firebase credentials.")
-
-if cred:
-    try:
-        if not firebase_admin._apps:
-            firebase_admin.initialize_app(cred)
-        db = firestore.client()
-        print("Firebase Admin SDK initialized successfully.")
-    except ValueError as e:
-        print(f"Firebase Admin SDK already initialized or invalid options: {e}")
-        db = firestore.client()
-else:
-    print("Firebase Admin SDK could not be initialized. `db` client will be None.")
+def init_firestore():
+    """Loads the Firebase credentials and creates the Firestore client (the module-level 'db')."""
+    global db
+    cred = None
+    if 'GOOGLE_APPLICATION_CREDENTIALS_JSON' in os.environ:
+        try:
+            cred_json_str = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS_JSON')
+            cred_json = json.loads(cred_json_str)
+            cred = credentials.Certificate(cred_json)
+            print("Firebase credentials loaded from environment variable.")
+        except json.JSONDecodeError as e:
+            print(f"Error decoding GOOGLE_APPLICATION_CREDENTIALS_JSON: {e}")
+            print("Ensure the environment variable contains valid JSON.")
+        except Exception as e:
+            print(f"Error creating Firebase credentials from environment variable: {e}")
+    elif os.path.exists(SERVICE_ACCOUNT_KEY_PATH_LOCAL):
+        cred = credentials.Certificate(SERVICE_ACCOUNT_KEY_PATH_LOCAL)
+        print(f"Firebase credentials loaded from local file: {SERVICE_ACCOUNT_KEY_PATH_LOCAL}")
+    else:
+        print("Warning: Firebase service account credentials JSON file not found locally, and GOOGLE_APPLICATION_CREDENTIALS_JSON environment variable is not set or invalid.")
+        print("App may not function correctly without Firebase credentials.")
+
+    if cred:
+        try:
+            if not firebase_admin._apps:
+                firebase_admin.initialize_app(cred)
+            db = firestore.client()
+            print("Firebase Admin SDK initialized successfully.")
+        except ValueError as e:
+            print(f"Firebase Admin SDK already initialized or invalid options: {e}")
+            db = firestore.client()
+    else:
+        print("Firebase Admin SDK could not be initialized. `db` client will be None.")
+
 
 # 3. Database Initialization and Recipe Population (uses app_context and 'db')
-with app.app_context():
-    if db:
-        setup_doc_ref = db.collection('app_meta').document('setup')
-        setup_doc = setup_doc_ref.get()
-
-        # --- TEMPORARY CHANGE: FORCE RE-POPULATION ---
-        # Set this to True for ONE deployment to force your Firestore recipes to sync
-        # with your local recipe_manager.py.
-        # After one successful deploy, set this back to False and redeploy.
-        force_repopulation = True # <<< CRITICAL: Change this back to False AFTER THIS DEPLOYMENT!
-
-        if force_repopulation or not setup_doc.exists or not setup_doc.to_dict().get('recipes_populated'):
-            print("Populating recipe database for Firestore (forced re-population)...")
-            from recipe_manager import RECIPES_DATA
-            
-            default_list_doc_ref = db.collection('shopping_lists').document('my_shopping_list')
-            if not default_list_doc_ref.get().exists:
-                default_list_doc_ref.set({"name": "My Shopping List"})
-                print("Created default shopping list document in Firestore.")
-
-            # IMPORTANT: Delete existing recipes and their ingredients to avoid duplicates during re-population
-            print("Deleting existing recipes and their ingredients before re-population...")
-            
-            # Fetch all recipe documents
-            existing_recipes_stream = db.collection('recipes').stream()
-            
-            # Use a batch to perform deletions efficiently
-            batch = db.batch()
-            recipes_deleted_count = 0
-            
-            for recipe_doc in existing_recipes_stream:
-                # Delete ingredients subcollection for each recipe
-                ingredients_stream = recipe_doc.reference.collection('ingredients').stream()
-                for ing_doc in ingredients_stream:
-                    batch.delete(ing_doc.reference) # Add ingredient doc to batch for deletion
-                
-                batch.delete(recipe_doc.reference) # Add recipe doc to batch for deletion
-                recipes_deleted_count += 1
-            
-            if recipes_deleted_count > 0:
-                batch.commit() # Execute all deletions in one go
-                print(f"Successfully deleted {recipes_deleted_count} existing recipes and their ingredients.")
-            else:
-                print("No existing recipes found to delete.")
-
-
-            # Now, add all recipes from RECIPES_DATA
-            for dish_name, ingredients_list in RECIPES_DATA.items():
-                recipe_doc_ref = db.collection('recipes').document(dish_name.lower())
-                
-                # Double-check existence (unlikely after batch delete, but robust)
-                if not recipe_doc_ref.get().exists:
-                    recipe_doc_ref.set({"name": dish_name})
-                    
-                    # Add ingredients to a subcollection for this recipe
-                    for ingredient_name in ingredients_list:
-                        recipe_doc_ref.collection('ingredients').add({"name": ingredient_name})
-                    print(f"Added recipe: {dish_name} and its ingredients to Firestore.")
+def sync_recipes():
+    """Populates the shared recipe catalogue in Firestore from recipe_manager.RECIPES_DATA."""
+    with app.app_context():
+        if db:
+            setup_doc_ref = db.collection('app_meta').document('setup')
+            setup_doc = setup_doc_ref.get()
+
+            # --- TEMPORARY CHANGE: FORCE RE-POPULATION ---
+            # Set this to True for ONE deployment to force your Firestore recipes to sync
+            # with your local recipe_manager.py.
+            # After one successful deploy, set this back to False and redeploy.
+            force_repopulation = True # <<< CRITICAL: Change this back to False AFTER THIS DEPLOYMENT!
+
+            if force_repopulation or not setup_doc.exists or not setup_doc.to_dict().get('recipes_populated'):
+                print("Populating recipe database for Firestore (forced re-population)...")
+                # Shopping lists are created per user on first use (see tenancy.ensure_list_exists),
+                # only the shared recipe catalogue is populated here. Lists and history written before
+                # the per-user partitions are moved once with 'flask migrate-legacy-collections'.
+
+                # IMPORTANT: Delete existing recipes and their ingredients to avoid duplicates during re-population
+                print("Deleting existing recipes and their ingredients before re-population...")
+
+                # Fetch all recipe documents
+                existing_recipes_stream = db.collection('recipes').stream()
+
+                # Use a batch to perform deletions efficiently
+                batch = db.batch()
+                recipes_deleted_count = 0
+
+                for recipe_doc in existing_recipes_stream:
+                    # Delete ingredients subcollection for each recipe
+                    ingredients_stream = recipe_doc.reference.collection('ingredients').stream()
+                    for ing_doc in ingredients_stream:
+                        batch.delete(ing_doc.reference) # Add ingredient doc to batch for deletion
+
+                    batch.delete(recipe_doc.reference) # Add recipe doc to batch for deletion
+                    recipes_deleted_count += 1
+
+                if recipes_deleted_count > 0:
+                    batch.commit() # Execute all deletions in one go
+                    print(f"Successfully deleted {recipes_deleted_count} existing recipes and their ingredients.")
                 else:
-                    print(f"Recipe '{dish_name}' unexpectedly exists after re-check. Skipping population.")
-            
-            # Update the setup document to mark population as complete
-            setup_doc_ref.set({'recipes_populated': True, 'last_populated': firestore.SERVER_TIMESTAMP})
-            print("Recipe database population complete for Firestore.")
+                    print("No existing recipes found to delete.")
+
+
+                # Now, add all recipes from RECIPES_DATA
+                for dish_name, ingredients_list in RECIPES_DATA.items():
+                    recipe_doc_ref = db.collection('recipes').document(dish_name.lower())
+
+                    # Double-check existence (unlikely after batch delete, but robust)
+                    if not recipe_doc_ref.get().exists:
+                        recipe_doc_ref.set({"name": dish_name})
+
+                        # Add ingredients to a subcollection for this recipe
+                        for ingredient_name in ingredients_list:
+                            recipe_doc_ref.collection('ingredients').add({"name": ingredient_name})
+                        print(f"Added recipe: {dish_name} and its ingredients to Firestore.")
+                    else:
+                        print(f"Recipe '{dish_name}' unexpectedly exists after re-check. Skipping population.")
+
+                # Update the setup document to mark population as complete
+                setup_doc_ref.set({'recipes_populated': True, 'last_populated': firestore.SERVER_TIMESTAMP})
+                print("Recipe database population complete for Firestore.")
+            else:
+                print("Firestore recipes already populated. Skipping initial recipe population.")
         else:
-            print("Firestore recipes already populated. Skipping initial recipe population.")
-    else:
-        print("Skipping Firestore database population due to uninitialized Firebase Admin SDK.")
+            print("Skipping Firestore database population due to uninitialized Firebase Admin SDK.")
+
+
+def initialize_backend():
+    """
+    Creates the Firestore client and syncs the recipes, then marks this worker ready.
+    Normally runs when the app is imported. Under gunicorn's preload_app (see gunicorn.conf.py)
+    it runs in each worker right after the fork instead, because gRPC channels (which the
+    Firestore client holds) must not be shared across a fork.
+    """
+    with startup_report.phase('firestore_client_init'):
+        init_firestore()
+    with startup_report.phase('recipe_sync'):
+        sync_recipes()
+    startup_report.mark_ready()
+
+# gunicorn.conf.py sets DEFER_BACKEND_INIT when preloading and calls initialize_backend() in post_fork
+if os.environ.get('DEFER_BACKEND_INIT') != '1':
+    initialize_backend()
+
+
+# --- Tenant Resolution ---
+# Signed user tokens (see tenancy.make_user_token) are sent by API clients in this header; browsers
+# open the link printed by 'flask user-token' once ('?user_token=...'), and the page keeps the token in a cookie.
+USER_TOKEN_HEADER = 'X-User-Token'
+USER_TOKEN_COOKIE = 'aura_user_token'
+USER_TOKEN_COOKIE_MAX_AGE = 365 * 24 * 3600
+
+def get_request_user_token():
+    return request.headers.get(USER_TOKEN_HEADER) or request.args.get('user_token') \
+        or request.cookies.get(USER_TOKEN_COOKIE)
+
+def get_request_user_id():
+    """
+    Resolves which user (household) the current request belongs to: the user of a valid
+    signed token, or the default user when the request carries no token.
+    """
+    token = get_request_user_token()
+    if not token:
+        return DEFAULT_USER_ID
+    user_id = get_user_id_from_token(token)
+    if user_id is None:
+        abort(make_response(jsonify({"status": "error", "message": "Invalid user token."}), 403))
+    return user_id
+
+def get_request_tenant(list_id):
+    """Returns the validated (user_id, list_id) pair the current request operates on."""
+    if not is_valid_tenant_id(list_id):
+        abort(make_response(jsonify({"status": "error", "message": "Invalid list ID."}), 400))
+    return get_request_user_id(), list_id
+
+
+def has_valid_edit_fields(data):
+    """
+    Checks the fields of an item edit: a non-empty 'item_name' string, and strings (or nothing)
+    for 'quantity', 'unit' and 'note'. The name and unit are normalized into the item's ID.
+    """
+    if not isinstance(data.get('item_name'), str) or not data['item_name'].strip():
+        return False
+    return all(data.get(field) is None or isinstance(data[field], str) for field in ('quantity', 'unit', 'note'))
+
+
+def get_open_items_query(user_id, list_id):
+    """Returns the query for a list's open items, newest first (bought items live in 'purchases')."""
+    return get_list_items_ref(db, user_id, list_id).order_by('added_timestamp', direction=firestore.Query.DESCENDING)
+
+
+def apply_cursor(items_query, items_ref, start_after_id):
+    """
+    Continues an ordered items query right after the given item (the pagination cursor).
+    Raises ValueError if the cursor item no longer exists.
+    """
+    cursor_doc = items_ref.document(start_after_id).get()
+    if not cursor_doc.exists:
+        raise ValueError(f"Unknown cursor '{start_after_id}'.")
+    return items_query.start_after(cursor_doc)
+
+
+def get_items_page(items_query, limit):
+    """
+    Fetches one page of an ordered items query.
+    One extra document is requested to find out whether another page follows.
+
+    Returns:
+        (item_docs, next_cursor), where next_cursor is the ID of the last returned item
+        if more items follow, or None on the last page.
+    """
+    item_docs = list(items_query.limit(limit + 1).stream())
+    if len(item_docs) > limit:
+        return item_docs[:limit], item_docs[limit - 1].id
+    return item_docs, None
+
+
+# --- Health Checks ---
+@app.route('/healthz')
+def liveness_check():
+    """Liveness probe: the process is up and serving requests."""
+    return jsonify({"status": "success", "message": "alive"}), 200
+
+@app.route('/healthz/ready')
+def readiness_check():
+    """
+    Readiness probe: 200 once every startup phase (imports, NLP model, Firestore client, recipe sync)
+    has finished in this worker, 503 before that or when Firestore could not be initialized.
+    The per-phase startup timings are included in the response.
+    """
+    report = startup_report.as_dict()
+    if not startup_report.ready or db is None:
+        return jsonify({"status": "error", "message": "not ready", "startup": report}), 503
+    return jsonify({"status": "success", "message": "ready", "startup": report}), 200
+
+
+@app.route('/healthz/admission')
+def admission_metrics():
+    """
+    Admission control metrics of this worker (see admission.py): commands in flight, current
+    queue depth, rejection counters and the average time a command holds its slot.
+    """
+    return jsonify({"status": "success", "admission": admission_controller.as_dict()}), 200
+
+
+# --- Admin: Request Profiles ---
+
+def require_profile_token():
+    """Admin routes need a valid signed X-Profile-Token; without one they don't exist."""
+    if not is_valid_profile_token(request.headers.get(PROFILE_TOKEN_HEADER)):
+        abort(404)
+
+@app.route('/admin/profiles')
+def list_profiles_api():
+    """Lists the saved request profiles of this instance (route, intents, duration), newest first."""
+    require_profile_token()
+    return jsonify({"status": "success", "profiles": list_profiles()}), 200
+
+@app.route('/admin/profiles/<profile_id>')
+def download_profile_api(profile_id):
+    """Downloads one saved profile, for pstats or snakeviz."""
+    require_profile_token()
+    profile_path = get_profile_path(profile_id)
+    if profile_path is None:
+        return jsonify({"status": "error", "message": "Profile not found."}), 404
+    return send_file(os.path.abspath(profile_path), mimetype='application/octet-stream',
+                     as_attachment=True, download_name=f"{profile_id}.prof")
 
 
 # --- Frontend Route ---
-@app.route('/')
-def index():
-    current_list_doc_ref = db.collection('shopping_lists').document('my_shopping_list')
-    current_list_doc = current_list_doc_ref.get()
-    items = []
-    recommendations = []
-
-    if current_list_doc.exists:
-        items_query = db.collection('list_items').where('list_id', '==', current_list_doc.id).where('is_bought', '==', False).order_by('added_timestamp', direction=firestore.Query.DESCENDING).stream()
-        
-        for item_doc in items_query:
-            item_data = item_doc.to_dict()
-            item_data['id'] = item_doc.id # Add document ID for frontend use
-            
-            display_name = item_data.get('item_name', '')
-            quantity = item_data.get('quantity', '1')
-            unit = item_data.get('unit', '')
-
-            # Format item name for display with quantity and unit
-            if quantity and quantity != '1':
-                display_name = f"{quantity} {unit} {display_name}".strip()
-            elif unit: # If unit exists but quantity is 1 or empty
-                 display_name = f"{unit} {display_name}".strip()
-            
-            item_data['name'] = display_name # Update 'name' key for display purposes
-
-            items.append(item_data)
-
-        from recommender import get_smart_recommendations
-        # Pass the Firestore 'db' instance to the recommender function
-        recommendations = get_smart_recommendations(db, current_list_doc.id) 
-
-    return render_template('index.html', items=items, recommendations=recommendations)
+@app.route('/', defaults={'list_id': DEFAULT_LIST_ID})
+@app.route('/lists/<list_id>')
+def index(list_id):
+    """
+    Renders the page with the list's first page of items and its recommendations.
+    Both are rendered as HTML fragments cached per list (and history) version, so repeated page
+    loads skip Firestore, the recommender and Jinja for them until the list changes (the list
+    fragment only with a shared cache backend, see fragment_cache.py). With ASYNC_LIST_HYDRATION,
+    uncached fragments are left out (app.js loads them after the page) and are rendered into the
+    cache once the response has been sent.
+    """
+    user_id, list_id = get_request_tenant(list_id)
+
+    def render_list_fragment():
+        # Only the first page is rendered on the server; the frontend loads the rest on demand
+        item_docs, next_cursor = get_items_page(get_open_items_query(user_id, list_id), INITIAL_PAGE_SIZE)
+        items = [serialize_item(item_doc.id, item_doc.to_dict()) for item_doc in item_docs]
+        return {"html": render_template('_list_items.html', items=items), "next_cursor": next_cursor}
+
+    def render_recommendations_fragment():
+        # Pass the Firestore 'db' instance to the recommender function (cached per list/history version)
+        recommendations = get_cached_recommendations(db, user_id, list_id)
+        return {"html": render_template('_recommendations.html', recommendations=recommendations)}
+
+    deferred_renders = [] # With ASYNC_LIST_HYDRATION: fragments to render and cache after the response
+    if ensure_list_exists(db, user_id, list_id):
+        defer_render = deferred_renders.append if ASYNC_LIST_HYDRATION else None
+        list_fragment = get_cached_fragment('list', user_id, list_id, render_list_fragment, defer_render)
+        recommendations_fragment = get_cached_fragment('recommendations', user_id, list_id,
+                                                       render_recommendations_fragment, defer_render)
+    else:
+        list_fragment = {"html": render_template('_list_items.html', items=[]), "next_cursor": None}
+        recommendations_fragment = {"html": render_template('_recommendations.html', recommendations=[])}
+
+    # A missing fragment (None) is rendered as a loading placeholder and hydrated by app.js
+    response = make_response(render_template('index.html',
+                           list_html=Markup(list_fragment['html']) if list_fragment else None,
+                           recommendations_html=Markup(recommendations_fragment['html']) if recommendations_fragment else None,
+                           user_id=user_id, list_id=list_id,
+                           next_cursor=list_fragment['next_cursor'] if list_fragment else None,
+                           page_size=INITIAL_PAGE_SIZE, speculative_parsing=SPECULATIVE_PARSING_ENABLED))
+
+    if deferred_renders:
+        # Fill the cache once the page has been sent, so the next load is a hit. This runs after
+        # the request context is gone; rendering the partials only needs the app context.
+        def render_deferred_fragments():
+            with app.app_context():
+                for render_and_store in deferred_renders:
+                    try:
+                        render_and_store()
+                    except Exception as e:
+                        print(f"Error rendering a page fragment after the response: {e}")
+        response.call_on_close(render_deferred_fragments)
+
+    # Opened through a 'flask user-token' link: remember the (already validated) token for the page's API calls
+    user_token = request.args.get('user_token')
+    if user_token and user_token != request.cookies.get(USER_TOKEN_COOKIE):
+        response.set_cookie(USER_TOKEN_COOKIE, user_token, max_age=USER_TOKEN_COOKIE_MAX_AGE,
+                            httponly=True, samesite='Lax', secure=request.is_secure)
+    return response
+
+@app.route('/sw.js')
+def service_worker():
+    """
+    Serves the app-shell service worker from the site root, so its scope covers every page.
+    It must never be cached for long: browsers compare it byte-for-byte to detect a new build.
+    """
+    response = send_file(asset_manifest.service_worker_path(), mimetype='application/javascript', max_age=0)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 # --- API Endpoints for Voice Commands and List Management ---
 
-@app.route('/api/process_voice_command', methods=['POST'])
-def process_voice_command_api():
+@app.route('/api/process_voice_command', methods=['POST'], defaults={'list_id': DEFAULT_LIST_ID})
+@app.route('/api/lists/<list_id>/process_voice_command', methods=['POST'])
+@admission_controlled()
+def process_voice_command_api(list_id):
     """
     API endpoint to receive transcribed voice commands from the frontend.
     It uses the NLP model to interpret the command and performs Firestore actions.
+    Compound commands ("mark eggs bought and add butter") are applied clause by clause with one
+    list read and one batched commit, and answered with a combined message.
     """
     print("--- process_voice_command_api route hit! ---") # Debugging print
+    user_id, list_id = get_request_tenant(list_id)
     data = request.json
     command_text = data.get('command')
 
@@ -166,318 +431,306 @@ def process_voice_command_api():
         return jsonify({"status": "error", "message": "No command provided."}), 400
 
     print(f"\n--- Received Command Text: '{command_text}' ---")
-    # Import process_command locally within this function to avoid circular imports if nlp_model depends on app
-    from nlp_model import process_command 
-    nlp_output = process_command(command_text)
-    intent = nlp_output['intent']
-    print(f"--- NLP Output: {nlp_output} ---\n")
+    # Work done on this utterance's interim results (speculative parsing mode), if any
+    speculation = None
+    session_id = data.get('session_id')
+    if SPECULATIVE_PARSING_ENABLED and is_valid_tenant_id(session_id):
+        speculation = speculation_cache.take(user_id, list_id, session_id)
+
+    # One utterance may hold several commands ("add milk and remove bread"), parsed clause by clause
+    nlp_outputs = speculation.get_parse(command_text) if speculation else None
+    if nlp_outputs is None:
+        nlp_outputs = process_compound_command(command_text)
+    else:
+        print("--- Reusing speculative parse of the interim transcript ---")
+    print(f"--- NLP Output: {nlp_outputs} ---\n")
+    tag_profile(intents=[nlp_output['intent'] for nlp_output in nlp_outputs])
     
-    current_list_doc_ref = db.collection('shopping_lists').document('my_shopping_list')
-    current_list_doc = current_list_doc_ref.get()
-
-    if not current_list_doc.exists:
+    if not ensure_list_exists(db, user_id, list_id):
         return jsonify({"status": "error", "message": "Shopping list not found."}), 404
 
-    current_list_id = current_list_doc.id
-
-    response_message = "I'm not sure how to handle that. Can you try rephrasing?"
-    status_type = "info"
-    
-    # --- Handle Different Intents ---
-    if intent == 'add_item':
-        added_count = 0
-        added_item_names = [] # To store names of actually added items for the response message
-
-        # nlp_output['items'] is now a list of dictionaries: [{'name': 'milk', 'quantity': '2', 'unit': 'liters'}]
-        for item_obj in nlp_output['items']:
-            item_name = item_obj['name']
-            quantity = item_obj.get('quantity', '1') # Default to '1' if not provided by NLP
-            unit = item_obj.get('unit', '')           # Default to '' if not provided by NLP
-
-            # When checking for existing items, query Firestore for precise duplicates
-            existing_items_query = db.collection('list_items').where('list_id', '==', current_list_id)\
-                                    .where('item_name', '==', item_name)\
-                                    .where('quantity', '==', quantity)\
-                                    .where('unit', '==', unit)\
-                                    .where('is_bought', '==', False).limit(1).stream()
-            existing_item_doc = next(existing_items_query, None) # Get the first matching document or None
-
-            if not existing_item_doc:
-                new_item_data = {
-                    "list_id": current_list_id,
-                    "item_name": item_name,
-                    "quantity": quantity, # Save quantity
-                    "unit": unit,         # Save unit
-                    "added_timestamp": firestore.SERVER_TIMESTAMP, # Use server timestamp
-                    "is_bought": False,
-                    "note": nlp_output['note'] # Use the extracted general note
-                }
-                new_item_ref = db.collection('list_items').add(new_item_data)[1] # Add document to Firestore
-                
-                # Log to user history
-                user_history_data = {
-                    "item_name": item_name,
-                    "timestamp": firestore.SERVER_TIMESTAMP,
-                    "action_type": 'added',
-                    "list_item_id": new_item_ref.id # Store the ID of the newly added list item
-                }
-                db.collection('user_history').add(user_history_data)
-                
-                added_count += 1
-                # Format for response message: "2 liters milk" or "milk"
-                display_name = f"{quantity} {unit} {item_name}".strip()
-                if quantity == "1" and not unit: # For items like "milk" (quantity 1, no unit)
-                    display_name = item_name
-                added_item_names.append(display_name)
-            
-            if added_count > 0:
-                response_message = f"Added {', '.join(added_item_names)} to your list."
-                status_type = "success"
-            else:
-                response_message = "Those items are already on your list or no new items detected."
-                status_type = "info"
-
-    elif intent == 'remove_item':
-        removed_count = 0
-        deleted_item_names = [] # To collect names of items actually removed
-        items_to_delete_refs = [] # Collect document references to delete
-
-        if nlp_output['dish_name']: # If a dish name is provided (e.g., "delete biryani items")
-            dish_name_lower = nlp_output['dish_name'].lower()
-            
-            # Find items with a note referring to the dish
-            dish_note_items_query = db.collection('list_items').where('list_id', '==', current_list_id)\
-                                    .where('is_bought', '==', False).stream()
-            for doc in dish_note_items_query:
-                item_data = doc.to_dict()
-                # Check if 'note' field exists and if dish_name_lower is in the note
-                if item_data.get('note') and dish_name_lower in item_data['note'].lower():
-                    items_to_delete_refs.append(doc.reference)
-                    # Format for response message
-                    deleted_item_names.append(f"{item_data.get('quantity', '')} {item_data.get('unit', '')} {item_data.get('item_name', '')}".strip())
-
-            # Import RECIPES_DATA from recipe_manager for recipe-based removal
-            from recipe_manager import RECIPES_DATA
-            recipe_ingredients = RECIPES_DATA.get(dish_name_lower, [])
-            
-            if recipe_ingredients:
-                for ingredient_name in recipe_ingredients:
-                    matching_items_by_name_query = db.collection('list_items').where('list_id', '==', current_list_id)\
-                                                    .where('item_name', '==', ingredient_name).where('is_bought', '==', False).stream()
-                    for doc in matching_items_by_name_query:
-                        if doc.reference not in items_to_delete_refs: # Avoid adding duplicates
-                            items_to_delete_refs.append(doc.reference)
-                            item_data = doc.to_dict()
-                            deleted_item_names.append(f"{item_data.get('quantity', '')} {item_data.get('unit', '')} {item_data.get('item_name', '')}".strip())
-            
-            if not items_to_delete_refs:
-                response_message = f"No items related to '{nlp_output['dish_name']}' found on your list to remove."
-                status_type = "info"
-
-        else: # Regular item removal (e.g., "remove bread" - items array populated by NLP)
-            # Iterate through the structured item objects from NLP
-            for item_obj in nlp_output['items']:
-                item_name_nlp = item_obj['name']
-                quantity_nlp = item_obj.get('quantity', '1')
-                unit_nlp = item_obj.get('unit', '')
-
-                # Query for a specific item, matching quantity and unit if provided by NLP
-                query = db.collection('list_items').where('list_id', '==', current_list_id)\
-                          .where('item_name', '==', item_name_nlp).where('is_bought', '==', False)
-                if quantity_nlp and quantity_nlp != '1':
-                    query = query.where('quantity', '==', quantity_nlp)
-                if unit_nlp:
-                    query = query.where('unit', '==', unit_nlp)
-                
-                item_to_remove_doc = next(query.limit(1).stream(), None)
-
-                if item_to_remove_doc:
-                    items_to_delete_refs.append(item_to_remove_doc.reference)
-                    item_data = item_to_remove_doc.to_dict()
-                    deleted_item_names.append(f"{item_data.get('quantity', '')} {item_data.get('unit', '')} {item_data.get('item_name', '')}".strip())
-            
-            if not items_to_delete_refs: 
-                response_message = "Could not find those items on your list to remove."
-                status_type = "info"
-
-        # Perform deletion for all collected item references
-        for item_ref in items_to_delete_refs:
-            item_data = item_ref.get().to_dict() # Re-fetch to log correct item_name before deletion
-            item_ref.delete() # Delete from Firestore
-            user_history_data = {
-                "item_name": item_data.get('item_name', 'Unknown Item'),
-                "timestamp": firestore.SERVER_TIMESTAMP,
-                "action_type": 'removed',
-                "list_item_id": item_ref.id # Store the ID of the removed item
-            }
-            db.collection('user_history').add(user_history_data)
-            removed_count += 1
-
-        if removed_count > 0:
-            response_message = f"Removed {', '.join(deleted_item_names)} from your list."
-            status_type = "success"
-        elif status_type != "info": 
-            pass # Keep previous info message if set
-        else: 
-            response_message = "No items found to remove."
-            status_type = "info"
-
-    elif intent == 'mark_bought':
-        bought_count = 0
-        bought_item_names = [] # To collect names of items actually marked
-
-        # Iterate through structured item objects from NLP
-        for item_obj in nlp_output['items']:
-            item_name_nlp = item_obj['name']
-            quantity_nlp = item_obj.get('quantity', '1')
-            unit_nlp = item_obj.get('unit', '')
-
-            # When searching to mark bought, match by name, quantity, and unit if provided by NLP
-            query = db.collection('list_items').where('list_id', '==', current_list_id)\
-                      .where('item_name', '==', item_name_nlp).where('is_bought', '==', False)
-            if quantity_nlp and quantity_nlp != '1':
-                query = query.where('quantity', '==', quantity_nlp)
-            if unit_nlp:
-                query = query.where('unit', '==', unit_nlp)
-            
-            item_to_mark_doc = next(query.limit(1).stream(), None)
-
-            if item_to_mark_doc:
-                item_to_mark_doc.reference.update({'is_bought': True}) # Update Firestore document
-                item_data = item_to_mark_doc.to_dict() # Get updated data for history logging
-                
-                user_history_data = {
-                    "item_name": item_data.get('item_name', 'Unknown Item'),
-                    "timestamp": firestore.SERVER_TIMESTAMP,
-                    "action_type": 'bought',
-                    "list_item_id": item_to_mark_doc.id
-                }
-                db.collection('user_history').add(user_history_data)
-                
-                bought_count += 1
-                # Format the name for the response message
-                display_name = f"{item_data.get('quantity', '')} {item_data.get('unit', '')} {item_data.get('item_name', '')}".strip()
-                if item_data.get('quantity', '1') == "1" and not item_data.get('unit'):
-                    display_name = item_data.get('item_name', '')
-                bought_item_names.append(display_name)
-        
-        if bought_count > 0:
-            response_message = f"Marked {', '.join(bought_item_names)} as bought."
-            status_type = "success"
-        else:
-            response_message = "Could not find those items on your list to mark as bought."
-            status_type = "info"
-
-    elif intent == 'get_recipe_ingredients':
-        dish_name = nlp_output.get('dish_name')
-        if dish_name:
-            # Import get_ingredients_for_dish locally
-            from recipe_manager import get_ingredients_for_dish
-            ingredients = get_ingredients_for_dish(dish_name)
-            if ingredients:
-                added_recipe_items = []
-                for ingredient_name in ingredients:
-                    # For recipe ingredients, we assume quantity '1' and no unit unless specified in recipe_manager's data
-                    # Check if item (case-insensitive) already exists and is not bought
-                    existing_item_query = db.collection('list_items').where('list_id', '==', current_list_id)\
-                                        .where('item_name', '==', ingredient_name).where('is_bought', '==', False).limit(1).stream()
-                    existing_item_doc = next(existing_item_query, None)
-                    
-                    if not existing_item_doc:
-                        item_note_text = f"for {dish_name}"
-                        if nlp_output['note']:
-                            item_note_text += f" ({nlp_output['note']})"
-
-                        new_item_data = {
-                            "list_id": current_list_id,
-                            "item_name": ingredient_name,
-                            "quantity": "1", # Default quantity for recipe items
-                            "unit": "",      # Default unit for recipe items
-                            "added_timestamp": firestore.SERVER_TIMESTAMP,
-                            "is_bought": False,
-                            "note": item_note_text
-                        }
-                        new_item_ref = db.collection('list_items').add(new_item_data)[1]
-                        
-                        user_history_data = {
-                            "item_name": ingredient_name,
-                            "timestamp": firestore.SERVER_TIMESTAMP,
-                            "action_type": f'added_for_recipe_{dish_name}',
-                            "list_item_id": new_item_ref.id
-                        }
-                        db.collection('user_history').add(user_history_data)
-                        added_recipe_items.append(ingredient_name)
-                
-                if added_recipe_items:
-                    response_message = f"Added ingredients for {dish_name}: {', '.join(added_recipe_items)}."
-                    status_type = "success"
-                else:
-                    response_message = f"All ingredients for {dish_name} are already on your list."
-                    status_type = "info"
-            else:
-                response_message = f"Sorry, I don't have ingredients for '{dish_name}' in my recipe book."
-                status_type = "warning"
-        else:
-            response_message = "Please tell me which dish you want ingredients for."
-            status_type = "warning"
-        
-        # This return handles 'get_recipe_ingredients' specific responses, so it should stay inside
-        return jsonify({"status": status_type, "message": response_message})
+    # Apply every clause to one in-memory view of the list and commit all their writes at once.
+    # A still-valid snapshot prefetched during speculation saves the list read.
+    prefetched_items = speculation.get_items(user_id, list_id) if speculation else None
+    session, (status_type, response_message) = run_list_session(
+        db, user_id, list_id, lambda session: execute_commands(session, nlp_outputs), items=prefetched_items)
+    if session.has_changes:
+        bump_list_version(user_id, list_id)
 
-    # --- DEFAULT RETURN FOR UNHANDLED INTENTS ---
-    # This ensures a response is always returned if none of the above intents are matched.
     return jsonify({"status": status_type, "message": response_message})
 
 
-@app.route('/api/get_list_items', methods=['GET'])
-def get_list_items_api():
-    """Returns all unbought items for the default shopping list as JSON from Firestore."""
-    current_list_doc_ref = db.collection('shopping_lists').document('my_shopping_list')
-    current_list_doc = current_list_doc_ref.get()
-    
-    if not current_list_doc.exists:
-        return jsonify([]), 200
+@app.route('/api/speculate', methods=['POST'], defaults={'list_id': DEFAULT_LIST_ID})
+@app.route('/api/lists/<list_id>/speculate', methods=['POST'])
+@admission_controlled(wait=False, rate_limited=False) # Only on an idle slot; shed first under load
+def speculate_command_api(list_id):
+    """
+    API endpoint for interim speech results (speculative parsing mode).
+    Parses the partial transcript and prefetches the list's open items for the speech session,
+    so the final /api/process_voice_command of the same 'session_id' can skip both.
+    Nothing is written; the response only tells the client what the command looks like so far.
+    """
+    if not SPECULATIVE_PARSING_ENABLED:
+        abort(404)
+    user_id, list_id = get_request_tenant(list_id)
+    data = request.json or {}
+    session_id = data.get('session_id')
+    transcript = data.get('transcript')
+
+    if not is_valid_tenant_id(session_id) or not isinstance(transcript, str) or not transcript.strip():
+        return jsonify({"status": "error", "message": "A valid 'session_id' and a 'transcript' are required."}), 400
+    if len(transcript) > MAX_TRANSCRIPT_LENGTH:
+        return jsonify({"status": "error", "message": "Transcript is too long to speculate on."}), 400
+    if not ensure_list_exists(db, user_id, list_id):
+        return jsonify({"status": "error", "message": "Shopping list not found."}), 404
 
-    items_for_display = []
-    items_query = db.collection('list_items').where('list_id', '==', current_list_doc.id).where('is_bought', '==', False).order_by('added_timestamp', direction=firestore.Query.DESCENDING).stream()
-    
-    for item_doc in items_query:
-        item_data = item_doc.to_dict()
-        item_data['id'] = item_doc.id # Add document ID for frontend use
-        
-        display_name = item_data.get('item_name', '')
-        quantity = item_data.get('quantity', '1')
-        unit = item_data.get('unit', '')
-
-        # Format item name for display with quantity and unit
-        if quantity and quantity != '1':
-            display_name = f"{quantity} {unit} {display_name}".strip()
-        elif unit: # If unit exists but quantity is 1 or empty
-             display_name = f"{unit} {display_name}".strip()
-        
-        item_data['name'] = display_name # Update 'name' key for display purposes
-        items_for_display.append(item_data)
+    try:
+        nlp_outputs = speculation_cache.speculate(db, user_id, list_id, session_id, transcript, process_compound_command)
+    except Exception as e:
+        # Speculation is only an optimization; the final command still works without it
+        print(f"Error speculating on transcript for list '{list_id}': {e}")
+        return jsonify({"status": "error", "message": "Speculation failed."}), 500
+    return jsonify({"status": "success", "intents": [nlp_output['intent'] for nlp_output in nlp_outputs]})
 
+
+@app.route('/api/sync', methods=['POST'], defaults={'list_id': DEFAULT_LIST_ID})
+@app.route('/api/lists/<list_id>/sync', methods=['POST'])
+@admission_controlled()
+def sync_commands_api(list_id):
+    """
+    API endpoint for clients that queued voice commands while offline.
+    Accepts an ordered batch of commands, each tagged with a client-generated 'client_id',
+    applies them in order with a single list read and a single batched commit, and returns
+    the per-command results together with the merged list state.
+    Commands whose client_id was already applied are skipped, so retrying a sync is safe; the
+    markers are created in the same batch as the changes, so a concurrent sync of the same
+    commands fails with a conflict (and is retried, skipping them) instead of applying them twice.
+    """
+    user_id, list_id = get_request_tenant(list_id)
+    commands = (request.json or {}).get('commands') or []
+
+    if not isinstance(commands, list) or not commands:
+        return jsonify({"status": "error", "message": "No commands provided."}), 400
+    if len(commands) > MAX_SYNC_COMMANDS:
+        return jsonify({"status": "error", "message": f"At most {MAX_SYNC_COMMANDS} commands can be synced at once."}), 400
+    for command in commands:
+        if not isinstance(command, dict) or not is_valid_tenant_id(command.get('client_id')) or not command.get('command'):
+            return jsonify({"status": "error", "message": "Every command needs a valid 'client_id' and a 'command'."}), 400
+
+    if not ensure_list_exists(db, user_id, list_id):
+        return jsonify({"status": "error", "message": "Shopping list not found."}), 404
+
+    applied_commands_ref = get_list_ref(db, user_id, list_id).collection('applied_commands')
+    applied_refs = [applied_commands_ref.document(command['client_id']) for command in commands]
+    parsed_commands = {} # client_id -> parse, kept if the session has to be retried
+
+    def apply_commands(session):
+        # Look up which of these commands were applied by an earlier (possibly interrupted or
+        # concurrent) sync. Read again on every attempt: when run_list_session retries after a
+        # conflict, batches committed early by the first attempt, or by a concurrent sync of the
+        # same commands, already hold their markers.
+        already_applied = {snap.id: snap.to_dict() for snap in db.get_all(applied_refs) if snap.exists}
+        results = []
+        for command in commands:
+            client_id = command['client_id']
+            if client_id in already_applied:
+                previous = already_applied[client_id]
+                results.append({"client_id": client_id, "status": previous.get('status'),
+                                "message": previous.get('message'), "duplicate": True})
+                continue
+
+            if client_id not in parsed_commands:
+                parsed_commands[client_id] = process_compound_command(command['command'])
+            status_type, response_message = execute_commands(session, parsed_commands[client_id])
+            session.record_applied_command(client_id, status_type, response_message)
+            already_applied[client_id] = {"status": status_type, "message": response_message} # Guards against repeats within this batch
+            results.append({"client_id": client_id, "status": status_type, "message": response_message})
+        return results
+
+    session, results = run_list_session(db, user_id, list_id, apply_commands)
+    tag_profile(intents=[nlp_output['intent'] for nlp_outputs in parsed_commands.values() for nlp_output in nlp_outputs])
+    if session.has_changes:
+        bump_list_version(user_id, list_id)
+
+    items = [serialize_item(item_id, item_data) for item_id, item_data in session.items.items()]
+    return jsonify({"status": "success", "results": results, "items": items}), 200
+
+
+@app.route('/api/get_list_items', methods=['GET'], defaults={'list_id': DEFAULT_LIST_ID})
+@app.route('/api/lists/<list_id>/get_list_items', methods=['GET'])
+def get_list_items_api(list_id):
+    """
+    Returns the open items of one of the user's shopping lists as JSON from Firestore.
+
+    Query parameters:
+        compact=1: only the fields the display needs are fetched (via a Firestore projection)
+            and each item is sent as {"id", "name"[, "note"]}, serialized without whitespace.
+        limit=N, start_after=<item id>: cursor pagination over the newest-first ordering.
+            The response becomes {"items": [...], "next_cursor": <item id or null>}.
+        stream=1: items are sent as NDJSON (one item per line) while Firestore streams them,
+            so neither side has to hold the whole list in memory.
+    """
+    user_id, list_id = get_request_tenant(list_id)
+    compact = request.args.get('compact') == '1'
+    stream = request.args.get('stream') == '1'
+    limit = request.args.get('limit', type=int)
+    start_after_id = request.args.get('start_after')
+    paginated = limit is not None or bool(start_after_id)
+
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({"status": "error", "message": f"'limit' must be between 1 and {MAX_PAGE_SIZE}."}), 400
+    if start_after_id and not is_valid_tenant_id(start_after_id):
+        return jsonify({"status": "error", "message": "Invalid cursor."}), 400
+
+    if not ensure_list_exists(db, user_id, list_id):
+        return jsonify({"items": [], "next_cursor": None} if paginated and not stream else []), 200
+
+    items_query = get_open_items_query(user_id, list_id)
+    if compact:
+        items_query = items_query.select(COMPACT_ITEM_FIELDS)
+
+    if start_after_id:
+        try:
+            items_query = apply_cursor(items_query, get_list_items_ref(db, user_id, list_id), start_after_id)
+        except ValueError:
+            return jsonify({"status": "error", "message": "Invalid cursor."}), 400
+
+    if stream:
+        if limit is not None:
+            items_query = items_query.limit(limit)
+
+        def generate_ndjson():
+            for item_doc in items_query.stream():
+                yield dumps_compact(serialize_item(item_doc.id, item_doc.to_dict(), compact)) + b'\n'
+
+        return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson',
+                        headers={'X-Accel-Buffering': 'no'}) # Ask proxies not to buffer the stream
+
+    if paginated:
+        item_docs, next_cursor = get_items_page(items_query, limit or DEFAULT_PAGE_SIZE)
+        page = {"items": [serialize_item(item_doc.id, item_doc.to_dict(), compact) for item_doc in item_docs],
+                "next_cursor": next_cursor}
+        return json_response(page) if compact else (jsonify(page), 200)
+
+    items_for_display = [serialize_item(item_doc.id, item_doc.to_dict(), compact) for item_doc in items_query.stream()]
+    if compact:
+        return json_response(items_for_display)
     return jsonify(items_for_display), 200
 
-@app.route('/api/get_recommendations', methods=['GET'])
-def get_recommendations_api():
-    """Returns smart recommendations as JSON from Firestore."""
-    current_list_doc_ref = db.collection('shopping_lists').document('my_shopping_list')
-    current_list_doc = current_list_doc_ref.get()
+@app.route('/api/get_recommendations', methods=['GET'], defaults={'list_id': DEFAULT_LIST_ID})
+@app.route('/api/lists/<list_id>/get_recommendations', methods=['GET'])
+def get_recommendations_api(list_id):
+    """Returns smart recommendations for one of the user's lists as JSON from Firestore."""
+    user_id, list_id = get_request_tenant(list_id)
 
-    if not current_list_doc.exists:
+    if not ensure_list_exists(db, user_id, list_id):
         return jsonify(["Milk", "Eggs", "Bread", "Coffee"]), 200 # Default recommendations if no list exists
 
-    from recommender import get_smart_recommendations
-    recommendations = get_smart_recommendations(db, current_list_doc.id) 
+    recommendations = get_cached_recommendations(db, user_id, list_id)
     return jsonify(recommendations), 200
 
-@app.route('/api/edit_item', methods=['POST'])
-def edit_item():
+@app.route('/api/lists', methods=['GET'])
+def get_lists_api():
+    """Returns all shopping lists of the current user as JSON from Firestore."""
+    user_id = get_request_user_id()
+    ensure_list_exists(db, user_id, DEFAULT_LIST_ID) # Make sure the default list always shows up
+
+    lists = []
+    for list_doc in get_lists_ref(db, user_id).stream():
+        list_data = list_doc.to_dict()
+        lists.append({"id": list_doc.id, "name": list_data.get('name', '')})
+    return jsonify(lists), 200
+
+@app.route('/api/lists', methods=['POST'])
+def create_list_api():
+    """Creates a new shopping list for the current user."""
+    user_id = get_request_user_id()
+    list_name = (request.json or {}).get('name', '').strip()
+
+    if not list_name:
+        return jsonify({"status": "error", "message": "Missing list name."}), 400
+
+    list_id = create_list(db, user_id, list_name)
+    return jsonify({"status": "success", "message": f"List '{list_name}' created.", "list_id": list_id}), 201
+
+@app.route('/api/clear_list', methods=['POST'], defaults={'list_id': DEFAULT_LIST_ID})
+@app.route('/api/lists/<list_id>/clear_list', methods=['POST'])
+def clear_list_api(list_id):
+    """
+    Deletes every item of one of the user's shopping lists.
+    Items are paged through with a cursor and deleted in WriteBatches of up to 500 operations,
+    and a single summarized history event is logged instead of one per item.
+    With '?stream=1' the progress of each batch is reported as NDJSON lines, which also keeps
+    the connection busy so clearing very large lists doesn't run into request timeouts.
+    """
+    user_id, list_id = get_request_tenant(list_id)
+    stream = request.args.get('stream') == '1'
+
+    if not ensure_list_exists(db, user_id, list_id):
+        return jsonify({"status": "error", "message": "Shopping list not found."}), 404
+
+    def clear_in_batches():
+        items_ref = get_list_items_ref(db, user_id, list_id)
+        # Only the name is needed (for the history summary), and '__name__' ordering lets us use a cursor
+        page_query = items_ref.order_by('__name__').select(['item_name']).limit(CLEAR_BATCH_SIZE)
+        deleted_count = 0
+        batch_count = 0
+        cleared_item_names = []
+
+        while True:
+            item_docs = list(page_query.stream())
+            if not item_docs:
+                break
+
+            batch = db.batch()
+            for item_doc in item_docs:
+                batch.delete(item_doc.reference)
+                if len(cleared_item_names) < MAX_SUMMARY_ITEM_NAMES:
+                    cleared_item_names.append(item_doc.to_dict().get('item_name', 'Unknown Item'))
+            batch.commit()
+            bump_list_version(user_id, list_id)
+
+            deleted_count += len(item_docs)
+            batch_count += 1
+            print(f"Clearing list '{list_id}' of user '{user_id}': {deleted_count} items deleted in {batch_count} batches.")
+            yield {"status": "progress", "deleted": deleted_count, "batches": batch_count}
+
+            if len(item_docs) < CLEAR_BATCH_SIZE:
+                break
+            page_query = page_query.start_after(item_docs[-1]) # Continue after the last deleted document
+
+        if deleted_count > 0:
+            history_buffer.log_event(db, user_id, {
+                "item_names": cleared_item_names,
+                "item_count": deleted_count,
+                "timestamp": firestore.SERVER_TIMESTAMP,
+                "action_type": 'cleared',
+                "list_id": list_id
+            })
+            message = f"Cleared {deleted_count} item{'' if deleted_count == 1 else 's'} from your list."
+        else:
+            message = "Your list is already empty."
+        yield {"status": "success", "message": message, "deleted": deleted_count, "batches": batch_count}
+
+    if stream:
+        def generate_ndjson():
+            for progress in clear_in_batches():
+                yield dumps_compact(progress) + b'\n'
+
+        return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson',
+                        headers={'X-Accel-Buffering': 'no'})
+
+    for progress in clear_in_batches():
+        pass # Only the final summary is returned without streaming
+    return jsonify(progress), 200
+
+@app.route('/api/edit_item', methods=['POST'], defaults={'list_id': DEFAULT_LIST_ID})
+@app.route('/api/lists/<list_id>/edit_item', methods=['POST'])
+def edit_item(list_id):
     """
     API endpoint to edit an existing list item's name, quantity, unit, and note in Firestore.
     """
+    user_id, list_id = get_request_tenant(list_id)
     data = request.json
     item_id = data.get('item_id')
     new_item_name = data.get('item_name')
@@ -485,72 +738,105 @@ def edit_item():
     new_unit = data.get('unit')
     new_note = data.get('note')
 
-    if not item_id or not new_item_name:
+    if not is_valid_tenant_id(item_id) or not new_item_name:
         return jsonify({"status": "error", "message": "Missing item ID or new item name."}), 400
+    if not has_valid_edit_fields(data):
+        return jsonify({"status": "error", "message": "Invalid item name, quantity, unit or note."}), 400
 
-    item_doc_ref = db.collection('list_items').document(item_id)
+    items_ref = get_list_items_ref(db, user_id, list_id)
+    item_doc_ref = items_ref.document(item_id)
     item_doc = item_doc_ref.get()
 
     if item_doc.exists:
-        # Update specific fields in the Firestore document
-        item_doc_ref.update({
-            'item_name': new_item_name,
-            'quantity': new_quantity,
-            'unit': new_unit,
-            'note': new_note
-        })
-        
-        # Format for response message
-        display_name = f"{new_quantity or ''} {new_unit or ''} {new_item_name}".strip()
-        if new_quantity == "1" and not new_unit:
-            display_name = new_item_name
-
-        return jsonify({"status": "success", "message": f"Item '{display_name}' updated."}), 200
+        edited_item = ListItem(new_item_name, new_quantity or '1', new_unit or '', new_note)
+        new_item_id = get_item_id(list_id, edited_item.item_name, edited_item.unit)
+        if new_item_id == item_id:
+            # Update the editable fields (and the display name derived from them) in the Firestore document
+            item_doc_ref.update(edited_item.to_document())
+        else:
+            # The item's ID is derived from its name and unit, so a renamed item moves to its new ID;
+            # the create fails if an item with that name and unit is already on the list
+            batch = db.batch()
+            batch.create(items_ref.document(new_item_id), {**item_doc.to_dict(), **edited_item.to_document()})
+            batch.delete(item_doc_ref)
+            try:
+                batch.commit()
+            except Conflict:
+                return jsonify({"status": "error", "message": f"'{edited_item.display_name}' is already on your list."}), 409
+        bump_list_version(user_id, list_id)
+
+        return jsonify({"status": "success", "message": f"Item '{edited_item.display_name}' updated.",
+                        "item_id": new_item_id}), 200
     return jsonify({"status": "error", "message": "Item not found."}), 404
 
 
-@app.route('/api/toggle_item_bought', methods=['POST'])
-def toggle_item_bought():
-    """Toggles the 'is_bought' status of a list item in Firestore."""
-    item_id = request.json.get('item_id')
-    
-    item_doc_ref = db.collection('list_items').document(item_id)
+@app.route('/api/toggle_item_bought', methods=['POST'], defaults={'list_id': DEFAULT_LIST_ID})
+@app.route('/api/lists/<list_id>/toggle_item_bought', methods=['POST'])
+def toggle_item_bought(list_id):
+    """
+    Toggles the bought status of a list item.
+    An open item is moved into the list's 'purchases' archive; an item ID that is no longer
+    open is restored (under the same ID) from its most recent purchase.
+    """
+    user_id, list_id = get_request_tenant(list_id)
+    item_id = (request.json or {}).get('item_id')
+    if not item_id:
+        return jsonify({"status": "error", "message": "Missing item ID."}), 400
+    if not is_valid_tenant_id(item_id): # IDs are used as document paths; e.g. a '/' would make Firestore raise
+        return jsonify({"status": "error", "message": "Invalid item ID."}), 400
+
+    item_doc_ref = get_list_items_ref(db, user_id, list_id).document(item_id)
     item_doc = item_doc_ref.get()
 
+    batch = db.batch()
     if item_doc.exists:
-        current_is_bought = item_doc.to_dict().get('is_bought', False)
-        new_is_bought = not current_is_bought
-        item_doc_ref.update({'is_bought': new_is_bought}) # Update Firestore document
-        
-        action = 'bought' if new_is_bought else 'unmarked_bought'
-        item_data = item_doc.to_dict() # Get data for history logging
-
-        user_history_data = {
-            "item_name": item_data.get('item_name', 'Unknown Item'),
-            "timestamp": firestore.SERVER_TIMESTAMP,
-            "action_type": action,
-            "list_item_id": item_id
-        }
-        db.collection('user_history').add(user_history_data) # Add to history collection
-        
-        display_name = f"{item_data.get('quantity', '')} {item_data.get('unit', '')} {item_data.get('item_name', '')}".strip()
-        if item_data.get('quantity', '1') == "1" and not item_data.get('unit'):
-            display_name = item_data.get('item_name', '')
-
-        return jsonify({"status": "success", "message": f"Item '{display_name}' status toggled."}), 200
-    return jsonify({"status": "error", "message": "Item not found."}), 404
-
-@app.route('/api/delete_item', methods=['POST'])
-def delete_item_api():
+        item_data = item_doc.to_dict()
+        # Archive the bought item and take it out of the open list in one atomic write
+        batch.set(get_purchases_ref(db, user_id, list_id).document(), to_purchase_document(item_id, item_data))
+        batch.delete(item_doc_ref)
+        new_is_bought = True
+    else:
+        purchase_doc = find_latest_purchase(db, user_id, list_id, item_id)
+        if purchase_doc is None:
+            return jsonify({"status": "error", "message": "Item not found."}), 404
+        item_data = to_item_document(purchase_doc.to_dict())
+        # Put the item back on the open list and drop the purchase record
+        batch.set(item_doc_ref, item_data)
+        batch.delete(purchase_doc.reference)
+        new_is_bought = False
+    batch.commit()
+    bump_list_version(user_id, list_id)
+
+    action = 'bought' if new_is_bought else 'unmarked_bought'
+    user_history_data = {
+        "item_name": item_data.get('item_name', 'Unknown Item'),
+        "timestamp": firestore.SERVER_TIMESTAMP,
+        "action_type": action,
+        "list_item_id": item_id
+    }
+    history_buffer.log_event(db, user_id, user_history_data) # Written to history in the background
+
+    return jsonify({"status": "success", "message": f"Item '{get_display_name(item_data)}' status toggled.",
+                    "is_bought": new_is_bought}), 200
+
+@app.route('/api/delete_item', methods=['POST'], defaults={'list_id': DEFAULT_LIST_ID})
+@app.route('/api/lists/<list_id>/delete_item', methods=['POST'])
+def delete_item_api(list_id):
     """Deletes a list item permanently from Firestore."""
-    item_id = request.json.get('item_id')
-
-    item_doc_ref = db.collection('list_items').document(item_id)
+    user_id, list_id = get_request_tenant(list_id)
+    item_id = (request.json or {}).get('item_id')
+    if not item_id:
+        return jsonify({"status": "error", "message": "Missing item ID."}), 400
+    if not is_valid_tenant_id(item_id): # IDs are used as document paths; e.g. a '/' would make Firestore raise
+        return jsonify({"status": "error", "message": "Invalid item ID."}), 400
+
+    item_doc_ref = get_list_items_ref(db, user_id, list_id).document(item_id)
     item_doc = item_doc_ref.get()
 
     if item_doc.exists:
         item_data = item_doc.to_dict()
         item_doc_ref.delete() # Delete from Firestore
+        bump_list_version(user_id, list_id)
         
         user_history_data = {
             "item_name": item_data.get('item_name', 'Unknown Item'),
@@ -558,15 +844,248 @@ def delete_item_api():
             "action_type": 'deleted',
             "list_item_id": item_id
         }
-        db.collection('user_history').add(user_history_data) # Add to history collection
-
-        display_name = f"{item_data.get('quantity', '')} {item_data.get('unit', '')} {item_data.get('item_name', '')}".strip()
-        if item_data.get('quantity', '1') == "1" and not item_data.get('unit'):
-            display_name = item_data.get('item_name', '')
+        history_buffer.log_event(db, user_id, user_history_data) # Written to history in the background
 
-        return jsonify({"status": "success", "message": f"Item '{display_name}' deleted."}), 200
+        return jsonify({"status": "success", "message": f"Item '{get_display_name(item_data)}' deleted."}), 200
     return jsonify({"status": "error", "message": "Item not found."}), 404
 
+@app.route('/api/items/bulk', methods=['POST'], defaults={'list_id': DEFAULT_LIST_ID})
+@app.route('/api/lists/<list_id>/items/bulk', methods=['POST'])
+def bulk_items_api(list_id):
+    """
+    Applies several item operations at once, e.g. checking off a whole cart at the store.
+
+    Request body:
+        {"operations": [{"op": "toggle" | "delete" | "edit", "item_id": "...",
+                         ...for "edit": "item_name", "quantity", "unit", "note"}]}
+
+    All target items are read with one db.get_all call and every write goes into a single
+    WriteBatch, so the whole request costs two round trips (plus one lookup per restored purchase).
+
+    Returns:
+        {"status": "success", "results": [{"item_id", "op", "status", "message"}, ...]}
+        with one result per operation, in request order. Toggles also return "is_bought"; edits
+        return "new_item_id", which differs from "item_id" when the name or unit changed.
+    """
+    user_id, list_id = get_request_tenant(list_id)
+    operations = (request.json or {}).get('operations') or []
+
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"status": "error", "message": "No operations provided."}), 400
+    if len(operations) > MAX_BULK_OPERATIONS:
+        return jsonify({"status": "error", "message": f"At most {MAX_BULK_OPERATIONS} operations can be applied at once."}), 400
+
+    if not ensure_list_exists(db, user_id, list_id):
+        return jsonify({"status": "error", "message": "Shopping list not found."}), 404
+
+    items_ref = get_list_items_ref(db, user_id, list_id)
+    purchases_ref = get_purchases_ref(db, user_id, list_id)
+
+    # Read every targeted item in a single round trip, together with the IDs renamed items would
+    # move to (an item's ID is derived from its name and unit), to catch duplicates up front
+    target_ids = {operation.get('item_id') for operation in operations
+                  if isinstance(operation, dict) and is_valid_tenant_id(operation.get('item_id'))}
+    target_ids.update(get_item_id(list_id, operation['item_name'], operation.get('unit') or '')
+                      for operation in operations
+                      if isinstance(operation, dict) and operation.get('op') == 'edit' and has_valid_edit_fields(operation))
+    item_docs = {snap.id: snap for snap in db.get_all([items_ref.document(item_id) for item_id in target_ids])} if target_ids else {}
+
+    batch = db.batch()
+    history_events = []
+    results = []
+    seen_item_ids = set()
+
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('op') not in BULK_OPERATION_TYPES \
+                or not is_valid_tenant_id(operation.get('item_id')):
+            results.append({"item_id": operation.get('item_id') if isinstance(operation, dict) else None,
+                            "op": operation.get('op') if isinstance(operation, dict) else None,
+                            "status": "error", "message": "Every operation needs a valid 'op' and 'item_id'."})
+            continue
+
+        op = operation['op']
+        item_id = operation['item_id']
+        result = {"item_id": item_id, "op": op}
+        results.append(result)
+
+        if op == 'edit' and not has_valid_edit_fields(operation):
+            result.update(status="error", message="Missing or invalid new item name, quantity, unit or note.")
+            continue
+
+        # Each item can be changed once per request; the reads above don't reflect earlier operations
+        if item_id in seen_item_ids:
+            result.update(status="error", message="Only one operation per item is allowed in a bulk request.")
+            continue
+        seen_item_ids.add(item_id)
+
+        item_doc = item_docs.get(item_id)
+        item_doc_ref = items_ref.document(item_id)
+
+        if op == 'toggle':
+            if item_doc is not None and item_doc.exists:
+                item_data = item_doc.to_dict()
+                batch.set(purchases_ref.document(), to_purchase_document(item_id, item_data))
+                batch.delete(item_doc_ref)
+                action = 'bought'
+            else:
+                purchase_doc = find_latest_purchase(db, user_id, list_id, item_id)
+                if purchase_doc is None:
+                    result.update(status="error", message="Item not found.")
+                    continue
+                item_data = to_item_document(purchase_doc.to_dict())
+                batch.set(item_doc_ref, item_data)
+                batch.delete(purchase_doc.reference)
+                action = 'unmarked_bought'
+            history_events.append({"item_name": item_data.get('item_name', 'Unknown Item'), "action_type": action, "list_item_id": item_id})
+            result.update(status="success", message=f"Item '{get_display_name(item_data)}' status toggled.",
+                          is_bought=(action == 'bought'))
+            continue
+
+        if item_doc is None or not item_doc.exists:
+            result.update(status="error", message="Item not found.")
+            continue
+        item_data = item_doc.to_dict()
+
+        if op == 'delete':
+            batch.delete(item_doc_ref)
+            history_events.append({"item_name": item_data.get('item_name', 'Unknown Item'), "action_type": 'deleted', "list_item_id": item_id})
+            result.update(status="success", message=f"Item '{get_display_name(item_data)}' deleted.")
+        else: # edit
+            edited_item = ListItem(operation['item_name'], operation.get('quantity') or '1',
+                                   operation.get('unit') or '', operation.get('note'))
+            new_item_id = get_item_id(list_id, edited_item.item_name, edited_item.unit)
+            if new_item_id == item_id:
+                batch.update(item_doc_ref, edited_item.to_document())
+            else:
+                # Renamed: the item moves to the ID of its new name and unit, unless that item exists
+                new_item_doc = item_docs.get(new_item_id)
+                if new_item_id in seen_item_ids or (new_item_doc is not None and new_item_doc.exists):
+                    result.update(status="error", message=f"'{edited_item.display_name}' is already on your list.")
+                    continue
+                seen_item_ids.add(new_item_id)
+                batch.create(items_ref.document(new_item_id), {**item_data, **edited_item.to_document()})
+                batch.delete(item_doc_ref)
+            result.update(status="success", message=f"Item '{edited_item.display_name}' updated.", new_item_id=new_item_id)
+
+    if len(batch):
+        try:
+            batch.commit() # All successful operations are applied atomically
+        except Conflict:
+            # Another device added an item a rename moves to; nothing of this request was applied
+            return jsonify({"status": "error", "message": "The list changed while applying the operations. Please try again."}), 409
+        bump_list_version(user_id, list_id)
+
+    for history_event in history_events:
+        history_event['timestamp'] = firestore.SERVER_TIMESTAMP
+        history_buffer.log_event(db, user_id, history_event) # Written to history in the background
+
+    return jsonify({"status": "success", "results": results}), 200
+
+
+# --- Maintenance Commands ---
+
+@app.cli.command('compact-history')
+@click.option('--user-id', default=None, help="Only compact this user's history (default: every user).")
+@click.option('--horizon-days', type=click.IntRange(min=1),
+              default=lambda: int(os.environ.get('HISTORY_RETENTION_DAYS', DEFAULT_HORIZON_DAYS)),
+              help="Raw events older than this many days are rolled up into daily aggregates.")
+@click.option('--archive', is_flag=True, help="Copy raw events to 'user_history_archive' instead of dropping them.")
+def compact_history_command(user_id, horizon_days, archive):
+    """Rolls old raw user_history events into per-item daily rollups."""
+    if not db:
+        raise click.ClickException("Firestore is not initialized; check the Firebase credentials.")
+
+    if user_id:
+        all_stats = {user_id: compact_user_history(db, user_id, horizon_days, archive)}
+    else:
+        all_stats = compact_all_history(db, horizon_days, archive)
+
+    for stats_user_id, stats in all_stats.items():
+        print(f"User '{stats_user_id}': {stats['events']} events compacted into {stats['rollups']} "
+              f"rollup increments ({stats['batches']} batches).")
+
+@app.cli.command('migrate-bought-items')
+@click.option('--user-id', default=None, help="Only migrate this user's lists (default: every user).")
+def migrate_bought_items_command(user_id):
+    """Moves bought items still kept in list_items (is_bought: True) into the purchases archive."""
+    if not db:
+        raise click.ClickException("Firestore is not initialized; check the Firebase credentials.")
+
+    user_ids = [user_id] if user_id else [user_ref.id for user_ref in db.collection('users').list_documents()]
+    for migrate_user_id in user_ids:
+        for list_ref in get_lists_ref(db, migrate_user_id).list_documents():
+            migrated_count = migrate_bought_items(db, migrate_user_id, list_ref.id)
+            print(f"User '{migrate_user_id}', list '{list_ref.id}': {migrated_count} bought items archived.")
+
+@app.cli.command('migrate-legacy-collections')
+@click.option('--user-id', default=DEFAULT_USER_ID, show_default=True,
+              help="The household that receives the data of the global collections.")
+@click.option('--force', is_flag=True, help="Run again even though an earlier run was recorded.")
+def migrate_legacy_collections_command(user_id, force):
+    """Moves the global shopping_lists, list_items and user_history collections into a user's partition."""
+    # Imported here: only needed once, never by the web workers
+    from legacy_migration import get_migration_marker, migrate_legacy_collections
+
+    if not db:
+        raise click.ClickException("Firestore is not initialized; check the Firebase credentials.")
+    if not is_valid_tenant_id(user_id):
+        raise click.BadParameter("Not a valid user ID.", param_hint='--user-id')
+
+    marker = get_migration_marker(db)
+    if marker and not force:
+        raise click.ClickException(f"The legacy collections were already migrated into user '{marker.get('user_id')}'. "
+                                   "Use --force to run again (this re-opens items bought since then).")
+    stats = migrate_legacy_collections(db, user_id, DEFAULT_LIST_ID)
+    print(f"Migrated {stats['lists']} lists, {stats['open_items']} open items, {stats['purchases']} purchases and "
+          f"{stats['history_events']} history events into user '{user_id}' ({stats['merged_items']} duplicate items merged).")
+
+@app.cli.command('export-columnar')
+@click.option('--format', 'export_format', type=click.Choice(['parquet', 'arrow']), default='parquet',
+              help="Parquet (compact) or Arrow IPC (fastest to memory-map).")
+@click.option('--export-dir', default=None, help="Where the files and the watermark are kept (default: EXPORT_DIR or 'exports').")
+@click.option('--full', is_flag=True, help="Drop earlier exports and the watermark, then export everything.")
+def export_columnar_command(export_format, export_dir, full):
+    """Exports history events and list items newer than the last run into columnar files."""
+    # Imported here so the web workers don't load pyarrow
+    from columnar_export import EXPORT_DIR, export_columnar
+
+    if not db:
+        raise click.ClickException("Firestore is not initialized; check the Firebase credentials.")
+    try:
+        stats = export_columnar(db, export_dir or EXPORT_DIR, export_format, full)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    print(f"Export complete: {stats['user_history']} history events, {stats['list_items']} list items.")
+
+@app.cli.command('user-token')
+@click.option('--user-id', default=None, help="Issue a token for this existing user (default: create a new user).")
+def user_token_command(user_id):
+    """Creates a user (household) and prints its token and the link that signs a browser in as it."""
+    if not db:
+        raise click.ClickException("Firestore is not initialized; check the Firebase credentials.")
+    if user_id is None:
+        user_id = create_user(db)
+        print(f"Created user '{user_id}'.")
+    elif not is_valid_tenant_id(user_id) or not get_user_ref(db, user_id).get().exists:
+        raise click.BadParameter("Unknown user ID.", param_hint='--user-id')
+    try:
+        token = make_user_token(user_id)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f"{USER_TOKEN_HEADER}: {token}")
+    print(f"Browser link: /?user_token={token}")
+
+@app.cli.command('profile-token')
+@click.option('--minutes', type=click.IntRange(min=1), default=DEFAULT_TOKEN_TTL_SECONDS // 60,
+              help="How long the token stays valid.")
+def profile_token_command(minutes):
+    """Prints a signed X-Profile-Token header value that turns on profiling for requests carrying it."""
+    try:
+        token = make_profile_token(minutes * 60)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f"{PROFILE_TOKEN_HEADER}: {token}")
+
 if __name__ == '__main__':
     # Get the port from the environment variable (e.g., set by Render) or default to 5000
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,56 @@
+# assets.py
+import json
+import os
+
+from flask import request, url_for
+
+# Written by build_assets.py: maps source paths under static/ (e.g. 'js/app.js') to their
+# minified, content-hashed copies under static/dist/ (e.g. 'dist/js/app.3f2a1b9c0d4e.js').
+ASSET_MANIFEST_PATH = os.path.join('dist', 'manifest.json')
+# Fingerprinted files never change under the same name, so browsers may keep them for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class AssetManifest:
+    """
+    Resolves static asset paths to their fingerprinted build output.
+    Without a build (local development) every path resolves to the unprocessed source file.
+    """
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self.assets = {}
+        manifest_path = os.path.join(static_folder, ASSET_MANIFEST_PATH)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as manifest_file:
+                self.assets = json.load(manifest_file)
+            print(f"Loaded asset manifest with {len(self.assets)} fingerprinted assets.")
+        else:
+            print("No asset manifest found (run build_assets.py); serving unprocessed static files.")
+
+    @property
+    def is_built(self):
+        """True if build_assets.py has been run, i.e. fingerprinted assets and the service worker exist."""
+        return bool(self.assets)
+
+    def has(self, path):
+        """Returns True if the build produced the given asset (e.g. the Tailwind bundle 'css/app.css')."""
+        return path in self.assets
+
+    def url(self, path):
+        """Jinja helper: the URL of the fingerprinted asset, or of the source file without a build."""
+        return url_for('static', filename=self.assets.get(path, path))
+
+    def service_worker_path(self):
+        """Returns the file path of the service worker script to serve at '/sw.js'."""
+        built_path = os.path.join(self.static_folder, 'dist', 'sw.js')
+        if os.path.exists(built_path):
+            return built_path
+        return os.path.join(self.static_folder, 'sw.js')
+
+
+def add_static_cache_headers(response):
+    """after_request hook: lets browsers cache fingerprinted build output indefinitely."""
+    if request.path.startswith('/static/dist/') and response.status_code == 200:
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
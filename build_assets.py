@@ -0,0 +1,137 @@
+# build_assets.py
+#
+# Builds the production static assets into static/dist/:
+#   - css/app.<hash>.css : Tailwind compiled (and purged) for the classes used in templates/ and
+#                          static/js/, followed by static/css/style.css, minified
+#   - js/app.<hash>.js   : static/js/app.js, minified
+#   - sw.js              : the service worker with the fingerprinted asset URLs to precache
+#   - manifest.json      : source path -> fingerprinted path, read by assets.py at startup
+#
+# Run it as part of the deploy build, e.g.:  pip install -r requirements.txt && python build_assets.py
+#
+# Tailwind is compiled with its standalone CLI (a single binary, no Node.js needed), found on the
+# PATH as 'tailwindcss' or through TAILWINDCSS_BIN. Without it, only style.css and app.js are built
+# and the page keeps using the Tailwind CDN script.
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Optional minifiers (pure Python); without them assets are only fingerprinted
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+STATIC_URL_PATH = '/static' # Flask's default static_url_path
+TAILWIND_CONFIG = os.path.join(BASE_DIR, 'tailwind.config.js')
+TAILWIND_INPUT = os.path.join(STATIC_DIR, 'css', 'tailwind.input.css')
+SERVICE_WORKER_SOURCE = os.path.join(STATIC_DIR, 'sw.js')
+HASH_LENGTH = 12
+
+# Placeholders in static/sw.js replaced with the build's values
+SW_VERSION_PLACEHOLDER = "const CACHE_VERSION = 'dev';"
+SW_PRECACHE_PLACEHOLDER = "const PRECACHE_URLS = [];"
+
+
+def read_source(relative_path):
+    with open(os.path.join(STATIC_DIR, relative_path), encoding='utf-8') as source_file:
+        return source_file.read()
+
+
+def compile_tailwind():
+    """Runs the Tailwind CLI and returns the generated (minified) CSS, or None if it isn't installed."""
+    tailwind_bin = os.environ.get('TAILWINDCSS_BIN') or shutil.which('tailwindcss')
+    if not tailwind_bin:
+        print("Warning: Tailwind CLI not found (set TAILWINDCSS_BIN or put 'tailwindcss' on the PATH); "
+              "the page will keep loading Tailwind from its CDN.")
+        return None
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_path = os.path.join(temp_dir, 'tailwind.css')
+        subprocess.run([tailwind_bin, '--config', TAILWIND_CONFIG, '--input', TAILWIND_INPUT,
+                        '--output', output_path, '--minify'], check=True, cwd=BASE_DIR)
+        with open(output_path, encoding='utf-8') as output_file:
+            return output_file.read()
+
+
+def minify(content, extension):
+    """Minifies CSS or JS with rcssmin/rjsmin when they are installed."""
+    if extension == '.css' and rcssmin is not None:
+        return rcssmin.cssmin(content)
+    if extension == '.js' and rjsmin is not None:
+        return rjsmin.jsmin(content)
+    return content
+
+
+def write_fingerprinted(relative_path, content):
+    """Writes content to dist/ under a content-hashed name and returns its path relative to static/."""
+    content_bytes = content.encode('utf-8')
+    content_hash = hashlib.sha256(content_bytes).hexdigest()[:HASH_LENGTH]
+    directory, filename = os.path.split(relative_path)
+    name, extension = os.path.splitext(filename)
+    dist_relative_path = '/'.join(part for part in ('dist', directory, f"{name}.{content_hash}{extension}") if part)
+
+    output_path = os.path.join(STATIC_DIR, *dist_relative_path.split('/'))
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'wb') as output_file:
+        output_file.write(content_bytes)
+    print(f"  {relative_path} -> {dist_relative_path} ({len(content_bytes)} bytes)")
+    return dist_relative_path
+
+
+def build_service_worker(manifest):
+    """Writes dist/sw.js with the build's cache version and the fingerprinted URLs to precache."""
+    service_worker = read_source('sw.js')
+    if SW_VERSION_PLACEHOLDER not in service_worker or SW_PRECACHE_PLACEHOLDER not in service_worker:
+        raise ValueError("static/sw.js is missing the CACHE_VERSION / PRECACHE_URLS placeholders.")
+
+    cache_version = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode('utf-8')).hexdigest()[:HASH_LENGTH]
+    precache_urls = [f"{STATIC_URL_PATH}/{dist_path}" for dist_path in sorted(manifest.values())]
+    service_worker = service_worker.replace(SW_VERSION_PLACEHOLDER, f"const CACHE_VERSION = '{cache_version}';")
+    service_worker = service_worker.replace(SW_PRECACHE_PLACEHOLDER, f"const PRECACHE_URLS = {json.dumps(precache_urls)};")
+
+    with open(os.path.join(DIST_DIR, 'sw.js'), 'w', encoding='utf-8') as output_file:
+        output_file.write(minify(service_worker, '.js'))
+    print(f"  sw.js -> dist/sw.js (cache version {cache_version}, {len(precache_urls)} precached assets)")
+
+
+def build():
+    """Builds every asset into a fresh static/dist/ directory."""
+    shutil.rmtree(DIST_DIR, ignore_errors=True) # Old fingerprinted files are never referenced again
+    os.makedirs(DIST_DIR)
+    print("Building static assets into static/dist/ ...")
+    manifest = {}
+
+    tailwind_css = compile_tailwind()
+    if tailwind_css is not None:
+        # One stylesheet for the whole page: Tailwind's output followed by the custom overrides
+        manifest['css/app.css'] = write_fingerprinted('css/app.css', tailwind_css + minify(read_source('css/style.css'), '.css'))
+    else:
+        manifest['css/style.css'] = write_fingerprinted('css/style.css', minify(read_source('css/style.css'), '.css'))
+
+    manifest['js/app.js'] = write_fingerprinted('js/app.js', minify(read_source('js/app.js'), '.js'))
+
+    build_service_worker(manifest)
+    with open(os.path.join(DIST_DIR, 'manifest.json'), 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    print("Static asset build complete.")
+
+
+if __name__ == '__main__':
+    try:
+        build()
+    except (subprocess.CalledProcessError, ValueError) as e:
+        print(f"Static asset build failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,321 @@
+# columnar_export.py
+#
+# Exports 'user_history' and 'list_items' into columnar files for offline recommender training
+# and benchmarks, so heavier models don't have to stream Firestore documents through to_dict().
+#
+# Layout of the export directory:
+#   user_history/part-<run>.parquet|.arrow : one file per table per run
+#   list_items/part-<run>.parquet|.arrow
+#   watermark.json                          : per table, the newest timestamp exported so far
+#
+# Item names, action types and IDs shared by many rows are dictionary-encoded; timestamps are
+# int64 microseconds since the Unix epoch (UTC). Each run only fetches documents newer than the
+# previous run's watermark, so exports are incremental and append-only.
+import json
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+
+from tenancy import get_history_ref, get_lists_ref, get_list_items_ref
+
+# Optional dependency: pyarrow writes (and memory-maps) the Parquet/Arrow files
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+EXPORT_DIR = os.environ.get('EXPORT_DIR', 'exports')
+EXPORT_FORMATS = ('parquet', 'arrow') # 'arrow' is the Arrow IPC file format (zero-copy when memory-mapped)
+EXPORT_PAGE_SIZE = 500
+WATERMARK_FILE = 'watermark.json'
+# Only documents at least this old are exported. History events can reach Firestore a few seconds
+# after their timestamp (see history_buffer.py), so the newest ones may still be missing; a
+# watermark past them would skip them forever.
+EXPORT_SAFETY_LAG = timedelta(minutes=5)
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Table name -> (timestamp field the watermark follows, columns as (name, is_dictionary_encoded, kind))
+EXPORT_TABLES = {
+    'user_history': ('timestamp', [
+        ('user_id', True, 'string'),
+        ('action_type', True, 'string'),
+        ('item_name', True, 'string'), # Missing for 'cleared' events, which summarize many items
+        ('list_id', True, 'string'),
+        ('list_item_id', False, 'string'),
+        ('item_count', False, 'int64'),
+        ('timestamp', False, 'int64'),
+    ]),
+    'list_items': ('added_timestamp', [
+        ('user_id', True, 'string'),
+        ('list_id', True, 'string'),
+        ('item_id', False, 'string'),
+        ('item_name', True, 'string'),
+        ('quantity', True, 'string'),
+        ('unit', True, 'string'),
+        ('note', False, 'string'),
+        ('added_timestamp', False, 'int64'),
+    ]),
+}
+
+
+def to_epoch_micros(value):
+    """Converts a Firestore timestamp (an aware datetime) to int64 microseconds since the epoch."""
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_epoch_micros(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError("The columnar export needs the 'pyarrow' package (pip install pyarrow).")
+
+
+def read_watermarks(export_dir):
+    """Returns {table name: newest exported timestamp in epoch microseconds} of earlier runs."""
+    watermark_path = os.path.join(export_dir, WATERMARK_FILE)
+    if not os.path.exists(watermark_path):
+        return {}
+    with open(watermark_path) as watermark_file:
+        return json.load(watermark_file)
+
+
+def write_watermarks(export_dir, watermarks):
+    """Replaces the watermark file atomically, so an interrupted run never leaves a partial one."""
+    watermark_path = os.path.join(export_dir, WATERMARK_FILE)
+    with open(watermark_path + '.tmp', 'w') as watermark_file:
+        json.dump(watermarks, watermark_file, indent=2, sort_keys=True)
+    os.replace(watermark_path + '.tmp', watermark_path)
+
+
+def iter_new_document_pages(collection_ref, timestamp_field, after, until):
+    """
+    Pages through the documents with after < timestamp_field <= until, oldest first, yielding
+    one list of up to EXPORT_PAGE_SIZE documents per page.
+    The query uses only the automatic single-field index on the timestamp field.
+    """
+    query = collection_ref.where(timestamp_field, '<=', until)
+    if after is not None:
+        query = query.where(timestamp_field, '>', after)
+    query = query.order_by(timestamp_field).limit(EXPORT_PAGE_SIZE)
+
+    page_query = query
+    while True:
+        docs = list(page_query.stream())
+        if docs:
+            yield docs
+        if len(docs) < EXPORT_PAGE_SIZE:
+            break
+        page_query = query.start_after(docs[-1])
+
+
+def history_row_pages(db_client, user_ids, after, until):
+    """Yields the history events of the users in (after, until] as rows, one page at a time."""
+    for user_id in user_ids:
+        for docs in iter_new_document_pages(get_history_ref(db_client, user_id), 'timestamp', after, until):
+            rows = []
+            for doc in docs:
+                event = doc.to_dict()
+                rows.append({
+                    "user_id": user_id,
+                    "action_type": event.get('action_type'),
+                    "item_name": event.get('item_name'),
+                    "list_id": event.get('list_id'),
+                    "list_item_id": event.get('list_item_id'),
+                    "item_count": event.get('item_count'),
+                    "timestamp": to_epoch_micros(event['timestamp']),
+                })
+            yield rows
+
+
+def list_item_row_pages(db_client, user_ids, after, until):
+    """Yields the list items added in (after, until], across all lists of the users, one page at a time."""
+    for user_id in user_ids:
+        for list_ref in get_lists_ref(db_client, user_id).list_documents():
+            items_ref = get_list_items_ref(db_client, user_id, list_ref.id)
+            for docs in iter_new_document_pages(items_ref, 'added_timestamp', after, until):
+                rows = []
+                for doc in docs:
+                    item = doc.to_dict()
+                    rows.append({
+                        "user_id": user_id,
+                        "list_id": list_ref.id,
+                        "item_id": doc.id,
+                        "item_name": item.get('item_name'),
+                        "quantity": item.get('quantity'),
+                        "unit": item.get('unit'),
+                        "note": item.get('note'),
+                        "added_timestamp": to_epoch_micros(item['added_timestamp']),
+                    })
+                yield rows
+
+
+def get_table_schema(table_name):
+    """Returns the Arrow schema of an exported table; repetitive string columns are dictionary-encoded."""
+    _, columns = EXPORT_TABLES[table_name]
+    fields = []
+    for column_name, is_dictionary, kind in columns:
+        value_type = pa.int64() if kind == 'int64' else pa.string()
+        fields.append(pa.field(column_name, pa.dictionary(pa.int32(), value_type) if is_dictionary else value_type))
+    return pa.schema(fields)
+
+
+def build_record_batch(table_name, rows, schema, vocabularies):
+    """
+    Builds one record batch from a page of row dicts.
+
+    Dictionary-encoded columns share one growing vocabulary per column (value -> index) across
+    the batches of a file: each batch's dictionary extends the previous one, so the Arrow IPC
+    file only needs to store the new entries (dictionary deltas) and indices stay comparable.
+    Every vocabulary starts with '' (the usual value of optional fields like 'unit'): an Arrow IPC
+    file can't start a column with an empty dictionary and extend it later, which an all-null
+    first page would otherwise produce.
+    """
+    _, columns = EXPORT_TABLES[table_name]
+    arrays = []
+    for (column_name, is_dictionary, _), field in zip(columns, schema):
+        values = [row[column_name] for row in rows]
+        if is_dictionary:
+            vocabulary = vocabularies.setdefault(column_name, {'': 0})
+            indices = [None if value is None else vocabulary.setdefault(value, len(vocabulary)) for value in values]
+            arrays.append(pa.DictionaryArray.from_arrays(pa.array(indices, type=pa.int32()),
+                                                         pa.array(list(vocabulary), type=field.type.value_type)))
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class PartWriter:
+    """
+    Writes one part file batch by batch, so an export only ever holds one Firestore page in memory.
+    The file is written under a temporary name and only renamed into place by close(), so an
+    interrupted run (whose watermark isn't saved either) never leaves a partial part behind.
+    """
+
+    def __init__(self, path, schema, export_format):
+        self.path = path
+        self.temp_path = path + '.tmp'
+        if export_format == 'parquet':
+            self.writer = pq.ParquetWriter(self.temp_path, schema, compression='zstd')
+            self.sink = None
+        else:
+            self.sink = pa.OSFile(self.temp_path, 'wb')
+            self.writer = pa.ipc.new_file(self.sink, schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+
+    def write_batch(self, record_batch):
+        self.writer.write_batch(record_batch) # In Parquet, one row group per Firestore page
+
+    def close(self):
+        self.writer.close()
+        if self.sink is not None:
+            self.sink.close()
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        """Closes and deletes the unfinished file."""
+        self.writer.close()
+        if self.sink is not None:
+            self.sink.close()
+        os.remove(self.temp_path)
+
+
+def export_table(db_client, table_name, user_ids, after, until, path, export_format):
+    """
+    Streams a table's new rows into a part file, one record batch per Firestore page.
+    The file is only created once the first row arrives.
+
+    Returns:
+        The number of rows written.
+    """
+    row_pages = {'user_history': history_row_pages, 'list_items': list_item_row_pages}[table_name]
+    schema = get_table_schema(table_name)
+    vocabularies = {}
+    part_writer = None
+    row_count = 0
+    try:
+        for rows in row_pages(db_client, user_ids, after, until):
+            if part_writer is None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                part_writer = PartWriter(path, schema, export_format)
+            part_writer.write_batch(build_record_batch(table_name, rows, schema, vocabularies))
+            row_count += len(rows)
+    except BaseException:
+        if part_writer is not None:
+            part_writer.abort()
+        raise
+    if part_writer is not None:
+        part_writer.close()
+    return row_count
+
+
+def export_columnar(db_client, export_dir=EXPORT_DIR, export_format='parquet', full=False):
+    """
+    Exports new history events and list items of every user into the export directory.
+    Rows are written page by page as they are read, so memory use doesn't grow with the export.
+
+    Args:
+        export_format: 'parquet' (compact, for storage) or 'arrow' (fastest to memory-map).
+        full: Start over: drop earlier exports and the watermarks, then export everything.
+
+    Returns:
+        dict: Rows written per table in this run.
+    """
+    require_pyarrow()
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{export_format}'.")
+    if full:
+        for table_name in EXPORT_TABLES:
+            shutil.rmtree(os.path.join(export_dir, table_name), ignore_errors=True)
+        if os.path.exists(os.path.join(export_dir, WATERMARK_FILE)):
+            os.remove(os.path.join(export_dir, WATERMARK_FILE))
+    os.makedirs(export_dir, exist_ok=True)
+
+    watermarks = read_watermarks(export_dir)
+    until = datetime.now(timezone.utc) - EXPORT_SAFETY_LAG
+    run_name = until.strftime('%Y%m%dT%H%M%S%fZ')
+    user_ids = [user_ref.id for user_ref in db_client.collection('users').list_documents()]
+
+    stats = {}
+    for table_name in EXPORT_TABLES:
+        after_micros = watermarks.get(table_name)
+        after = from_epoch_micros(after_micros) if after_micros is not None else None
+        path = os.path.join(export_dir, table_name, f"part-{run_name}.{export_format}")
+        stats[table_name] = export_table(db_client, table_name, user_ids, after, until, path, export_format)
+        # Everything up to 'until' is exported now, even if nothing new was found
+        watermarks[table_name] = to_epoch_micros(until)
+        print(f"Exported {stats[table_name]} new rows of '{table_name}' (up to {until.isoformat()}).")
+
+    write_watermarks(export_dir, watermarks)
+    return stats
+
+
+def read_export_table(table_name, export_dir=EXPORT_DIR, columns=None):
+    """
+    Loads every exported part of a table into one pyarrow Table, memory-mapped: Arrow files are
+    read zero-copy, and Parquet pages are decoded straight from the mapped file.
+
+    Args:
+        columns: Only read these columns (both formats are columnar, so the rest is never touched).
+
+    Returns:
+        pyarrow.Table: The table, or None if nothing was exported yet.
+    """
+    require_pyarrow()
+    table_dir = os.path.join(export_dir, table_name)
+    if not os.path.isdir(table_dir):
+        return None
+
+    tables = []
+    for name in sorted(os.listdir(table_dir)):
+        path = os.path.join(table_dir, name)
+        if name.endswith('.parquet'):
+            tables.append(pq.read_table(path, columns=columns, memory_map=True))
+        elif name.endswith('.arrow'):
+            table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+            tables.append(table.select(columns) if columns else table)
+    if not tables:
+        return None
+    return pa.concat_tables(tables)
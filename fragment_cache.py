@@ -0,0 +1,68 @@
+# fragment_cache.py
+from rec_cache import get_cache_backend, get_list_versions
+
+# Which version counters each fragment depends on (see rec_cache.get_version_names): the list
+# rows only change with the list, the recommendations also with the user's history.
+FRAGMENT_KINDS = ('list', 'recommendations')
+# Fragments only cached in a shared backend. A worker's local cache doesn't see the version bumps
+# of other workers, so it could serve a list that's up to LOCAL_CACHE_TTL_SECONDS old, and the page
+# keeps server-rendered rows without refetching them. Slightly old recommendations are fine.
+SHARED_ONLY_FRAGMENTS = ('list',)
+
+
+def get_fragment_cache_key(kind, user_id, list_id):
+    """Returns the cache key of a fragment at the list's current versions."""
+    if kind not in FRAGMENT_KINDS:
+        raise ValueError(f"Unknown fragment kind '{kind}'.")
+    list_version, history_version = get_list_versions(user_id, list_id)
+    versions = f"{list_version}" if kind == 'list' else f"{list_version}:{history_version}"
+    return f"fragment:{kind}:{user_id}:{list_id}:{versions}"
+
+
+def store_fragment(backend, kind, cache_key, render):
+    """Renders a fragment and stores it under the given key; returns the fragment."""
+    fragment = render()
+    try:
+        backend.set(cache_key, fragment)
+    except Exception as e:
+        print(f"Error storing the '{kind}' fragment in the cache: {e}")
+    return fragment
+
+
+def get_cached_fragment(kind, user_id, list_id, render, defer_render=None):
+    """
+    Returns a rendered HTML fragment of the index page from the shared cache backend (rec_cache.py).
+
+    Fragments are keyed by the list's version counters, so every mutation endpoint (which calls
+    bump_list_version) and every history flush (bump_history_version) invalidates them without
+    any explicit cache deletes. Cache errors fall back to rendering.
+
+    Args:
+        kind: 'list' or 'recommendations'.
+        render: Function returning the fragment as a JSON-serializable dict (e.g. {"html": ...}).
+        defer_render: If given, a cache miss returns None instead of rendering (the page is then
+                      sent without the fragment and the client loads the data itself), and the
+                      function that renders and stores the fragment is passed to defer_render,
+                      to be run once the response is sent, so the next page load gets a hit.
+
+    Returns:
+        dict: The fragment, or None on a deferred miss.
+    """
+    backend = get_cache_backend()
+    if kind in SHARED_ONLY_FRAGMENTS and not backend.is_shared:
+        return None if defer_render else render()
+    try:
+        # The key is read before rendering: if the list changes meanwhile, the fragment is
+        # stored under the old version, where it's never read
+        cache_key = get_fragment_cache_key(kind, user_id, list_id)
+        fragment = backend.get(cache_key)
+    except Exception as e:
+        print(f"Fragment cache unavailable, rendering directly: {e}")
+        return None if defer_render else render()
+
+    if fragment is None:
+        if defer_render:
+            defer_render(lambda: store_fragment(backend, kind, cache_key, render))
+        else:
+            fragment = store_fragment(backend, kind, cache_key, render)
+    return fragment
@@ -0,0 +1,30 @@
+# gunicorn.conf.py
+# Picked up automatically by gunicorn when it is started from the project directory (see Procfile).
+import os
+
+# Import the app (pandas, spaCy and its model included) once in the master process; workers are
+# forked from it already initialized and share those pages copy-on-write, so a new worker starts
+# serving without any import or model-load stall.
+preload_app = True
+
+# Threaded workers: a request waiting in admission control (see admission.py) only blocks its own
+# thread. Keep threads above NLP_MAX_CONCURRENCY + NLP_MAX_QUEUE (2 + 4 by default), so that
+# commands queue where their deadlines are enforced and health checks and list reads are still
+# served while they do.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# The Firestore client (gRPC) is not fork-safe, so app.py leaves it to post_fork below when preloading
+os.environ['DEFER_BACKEND_INIT'] = '1'
+
+
+def post_fork(server, worker):
+    """Creates this worker's Firestore client and syncs recipes before it accepts traffic."""
+    import app
+    app.initialize_backend()
+
+
+def worker_exit(server, worker):
+    """Writes any history events still buffered in the exiting worker (see history_buffer.py)."""
+    from history_buffer import history_buffer
+    history_buffer.close()
@@ -0,0 +1,142 @@
+# history_buffer.py
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+from tenancy import get_history_ref
+
+# Events waiting to be written; when the queue is full, events are written synchronously instead
+MAX_QUEUED_EVENTS = 2000
+# The flusher commits as soon as this many events are waiting (Firestore allows 500 operations per batch)...
+FLUSH_BATCH_SIZE = 200
+# ...or once the oldest waiting event is this many seconds old
+FLUSH_INTERVAL_SECONDS = 1.0
+# How long shutdown waits for the flusher thread before writing the rest itself
+SHUTDOWN_TIMEOUT_SECONDS = 5.0
+
+
+class HistoryBuffer:
+    """
+    Write-behind buffer for user history events.
+
+    Request handlers only enqueue an event; a background thread commits queued events in
+    WriteBatches, so no Firestore round trip for history is on the request path. Queued events
+    are written on worker shutdown (atexit, and gunicorn's worker_exit hook in gunicorn.conf.py).
+    """
+
+    def __init__(self, max_queued_events=MAX_QUEUED_EVENTS, flush_batch_size=FLUSH_BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL_SECONDS):
+        self.events = queue.Queue(maxsize=max_queued_events)
+        self.flush_batch_size = flush_batch_size
+        self.flush_interval = flush_interval
+        self.db = None
+        self.stopping = threading.Event()
+        self.flusher_thread = None
+        self.flusher_pid = None # The thread doesn't survive a fork, so it is (re)started per process
+        self.start_lock = threading.Lock()
+        atexit.register(self.close)
+
+    def log_event(self, db_client, user_id, event_data):
+        """
+        Queues a history event for the user.
+        A SERVER_TIMESTAMP 'timestamp' is resolved now, so the event keeps the time it happened
+        rather than the time it was flushed.
+        """
+        event_data = dict(event_data)
+        if event_data.get('timestamp') is firestore.SERVER_TIMESTAMP:
+            event_data['timestamp'] = datetime.now(timezone.utc)
+        event_ref = get_history_ref(db_client, user_id).document()
+
+        self.db = db_client
+        self.ensure_flusher()
+        try:
+            self.events.put_nowait((user_id, event_ref, event_data))
+        except queue.Full:
+            # Backpressure: rather than dropping the event, pay for the write on this request
+            print("History buffer is full; writing event synchronously.")
+            from rec_cache import bump_history_version # See write_events
+            event_ref.set(event_data)
+            bump_history_version(user_id)
+
+    def ensure_flusher(self):
+        """Starts the background flusher thread in this process if it isn't running."""
+        if self.flusher_pid == os.getpid() and self.flusher_thread.is_alive():
+            return
+        with self.start_lock:
+            if self.flusher_pid == os.getpid() and self.flusher_thread.is_alive():
+                return
+            self.stopping.clear()
+            self.flusher_thread = threading.Thread(target=self.run_flusher, name='history-flusher', daemon=True)
+            self.flusher_thread.start()
+            self.flusher_pid = os.getpid()
+
+    def run_flusher(self):
+        """Flusher loop: collects events until the batch is full or the interval is over, then commits."""
+        while not self.stopping.is_set():
+            try:
+                pending_events = [self.events.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+
+            deadline = time.monotonic() + self.flush_interval
+            while len(pending_events) < self.flush_batch_size and not self.stopping.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending_events.append(self.events.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self.write_events(pending_events)
+
+    def write_events(self, pending_events):
+        """Commits the events in one WriteBatch, retrying once before giving up on them."""
+        # Imported here: rec_cache pulls in the recommender and pandas, which app.py loads (and
+        # times) in its own startup phase, after this module is imported
+        from rec_cache import bump_history_version
+
+        for attempt in (1, 2):
+            try:
+                batch = self.db.batch()
+                for _, event_ref, event_data in pending_events:
+                    batch.set(event_ref, event_data)
+                batch.commit()
+                # Recommendations computed before the events landed must not be served any longer
+                for user_id in {user_id for user_id, _, _ in pending_events}:
+                    bump_history_version(user_id)
+                return
+            except Exception as e:
+                print(f"Error flushing {len(pending_events)} history events (attempt {attempt}): {e}")
+        print(f"Dropped {len(pending_events)} history events after repeated flush errors.")
+
+    def flush(self):
+        """Writes every queued event now, on the calling thread."""
+        pending_events = []
+        while True:
+            try:
+                pending_events.append(self.events.get_nowait())
+            except queue.Empty:
+                break
+            if len(pending_events) >= self.flush_batch_size:
+                self.write_events(pending_events)
+                pending_events = []
+        if pending_events:
+            self.write_events(pending_events)
+
+    def close(self):
+        """Stops the flusher and drains the queue (called on worker shutdown)."""
+        self.stopping.set()
+        if self.flusher_thread is not None and self.flusher_pid == os.getpid():
+            self.flusher_thread.join(SHUTDOWN_TIMEOUT_SECONDS)
+        if self.db is not None:
+            self.flush()
+
+
+# Shared by all request handlers of a worker process
+history_buffer = HistoryBuffer()
@@ -0,0 +1,139 @@
+# history_compaction.py
+import hashlib
+import re
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+
+from tenancy import get_history_ref, get_history_rollups_ref, get_history_archive_ref
+
+# Raw history events older than this many days are rolled up (overridable from the CLI)
+DEFAULT_HORIZON_DAYS = 30
+# Firestore rejects WriteBatches with more than 500 operations.
+MAX_BATCH_OPS = 500
+# Raw events fetched per page while compacting
+COMPACTION_PAGE_SIZE = 200
+
+
+def get_rollup_id(day, action_type, item_name):
+    """
+    Builds the document ID of a daily rollup, e.g. '2024-05-01__bought__milk-6b1a2b3c'.
+    The slug keeps IDs readable; the hash suffix keeps names that slug alike ("Milk", "milk!") apart.
+    """
+    item_slug = re.sub(r'[^a-z0-9]+', '-', item_name.lower()).strip('-')[:80]
+    item_hash = hashlib.sha1(item_name.encode('utf-8')).hexdigest()[:8]
+    return f"{day.strftime('%Y-%m-%d')}__{action_type}__{item_slug}-{item_hash}"
+
+
+def get_event_item_names(event_data):
+    """Returns the item names an event counts towards (summarized 'cleared' events list several)."""
+    if event_data.get('item_name'):
+        return [event_data['item_name']]
+    return list(event_data.get('item_names') or [])
+
+
+def compact_user_history(db_client, user_id, horizon_days=DEFAULT_HORIZON_DAYS, archive=False):
+    """
+    Rolls one user's raw history events older than the horizon into per-item daily rollups.
+
+    Each rollup document holds {day, action_type, item_name, count}. The count is applied with
+    a Firestore Increment in the same WriteBatch that deletes (or archives) the raw events it
+    covers, so a page is either fully compacted or not at all, and an interrupted run can simply
+    be restarted.
+
+    Args:
+        db_client: The Firestore client instance.
+        user_id: The ID of the user (tenant) whose history should be compacted.
+        horizon_days: Raw events newer than this many days are left untouched.
+        archive: If True, raw events are copied to 'user_history_archive' instead of being dropped.
+
+    Returns:
+        A dict with the number of compacted events and written rollup increments.
+    """
+    history_ref = get_history_ref(db_client, user_id)
+    rollups_ref = get_history_rollups_ref(db_client, user_id)
+    archive_ref = get_history_archive_ref(db_client, user_id)
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=horizon_days)
+    # Processed events are removed from 'user_history', so the same query always returns the next page
+    page_query = history_ref.where('timestamp', '<', cutoff).order_by('timestamp').limit(COMPACTION_PAGE_SIZE)
+    ops_per_event = 2 if archive else 1
+
+    stats = {"events": 0, "rollups": 0, "batches": 0}
+    pending_counts = {} # rollup ID -> (day, action_type, item_name, count)
+    pending_events = []
+
+    def flush():
+        if not pending_events:
+            return
+        batch = db_client.batch()
+        for rollup_id, (day, action_type, item_name, count) in pending_counts.items():
+            batch.set(rollups_ref.document(rollup_id), {
+                "day": day,
+                "action_type": action_type,
+                "item_name": item_name,
+                "count": firestore.Increment(count)
+            }, merge=True)
+        for event_doc in pending_events:
+            if archive:
+                batch.set(archive_ref.document(event_doc.id), event_doc.to_dict())
+            batch.delete(event_doc.reference)
+        batch.commit()
+
+        stats["events"] += len(pending_events)
+        stats["rollups"] += len(pending_counts)
+        stats["batches"] += 1
+        pending_counts.clear()
+        pending_events.clear()
+
+    while True:
+        event_docs = list(page_query.stream())
+        if not event_docs:
+            break
+
+        for event_doc in event_docs:
+            event_data = event_doc.to_dict()
+            timestamp = event_data['timestamp']
+            day = datetime(timestamp.year, timestamp.month, timestamp.day, tzinfo=timezone.utc)
+            action_type = event_data.get('action_type', 'unknown')
+            item_names = get_event_item_names(event_data)
+
+            # Commit first if this event's increments and deletes would overflow the batch
+            new_rollup_ids = {get_rollup_id(day, action_type, name) for name in item_names} - pending_counts.keys()
+            pending_ops = len(pending_counts) + len(pending_events) * ops_per_event
+            if pending_ops + len(new_rollup_ids) + ops_per_event > MAX_BATCH_OPS:
+                flush()
+
+            for item_name in item_names:
+                rollup_id = get_rollup_id(day, action_type, item_name)
+                _, _, _, count = pending_counts.get(rollup_id, (day, action_type, item_name, 0))
+                pending_counts[rollup_id] = (day, action_type, item_name, count + 1)
+            pending_events.append(event_doc)
+
+        flush()
+        print(f"Compacting history of user '{user_id}': {stats['events']} events rolled up so far.")
+
+        if len(event_docs) < COMPACTION_PAGE_SIZE:
+            break
+
+    return stats
+
+
+def compact_all_history(db_client, horizon_days=DEFAULT_HORIZON_DAYS, archive=False):
+    """
+    Runs compact_user_history for every user partition.
+
+    Returns:
+        A dict mapping user IDs to their compaction stats.
+    """
+    all_stats = {}
+    # list_documents also returns user documents that only exist as a parent of subcollections
+    for user_ref in db_client.collection('users').list_documents():
+        all_stats[user_ref.id] = compact_user_history(db_client, user_ref.id, horizon_days, archive)
+    return all_stats
+
+
+# Example Usage: run through the Flask CLI, which has an initialized Firestore client:
+#   flask --app app compact-history --horizon-days 30 [--user-id default_user] [--archive]
+if __name__ == "__main__":
+    print("Run history compaction with: flask --app app compact-history --help")
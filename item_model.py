@@ -0,0 +1,105 @@
+# item_model.py
+import hashlib
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from firebase_admin import firestore
+
+
+def format_display_name(item_name, quantity='1', unit=''):
+    """
+    Builds the display string for an item: "2 liters milk", "1 kg rice", or just "milk"
+    when the quantity is 1 (or missing) and there is no unit.
+    """
+    quantity = quantity or ''
+    unit = unit or ''
+    if quantity in ('', '1') and not unit:
+        return item_name
+    return " ".join(part for part in (quantity, unit, item_name) if part)
+
+
+def normalize_item_key(value):
+    """Normalizes an item name or unit for identity: case and surrounding/repeated spaces don't matter."""
+    return re.sub(r'\s+', ' ', (value or '').strip().lower())
+
+
+def get_item_id(list_id, item_name, unit=''):
+    """
+    Returns the deterministic document ID of an open list item: a hash of the list, the
+    normalized item name and the unit. A list holds at most one open item per name and unit, so
+    adding one is a single create of this ID, and Firestore itself rejects a concurrent duplicate.
+    """
+    item_key = '\x1f'.join((list_id, normalize_item_key(item_name), normalize_item_key(unit)))
+    return hashlib.sha1(item_key.encode('utf-8')).hexdigest()[:20]
+
+
+@dataclass
+class ListItem:
+    """
+    The user-editable fields of a shopping list item.
+    'display_name' is derived once, when the item is created or edited, and stored in the
+    Firestore document, so read paths can project it directly instead of re-formatting it.
+    """
+    __slots__ = ('item_name', 'quantity', 'unit', 'note', 'display_name')
+
+    item_name: str
+    quantity: str
+    unit: str
+    note: Optional[str]
+
+    def __post_init__(self):
+        self.display_name = format_display_name(self.item_name, self.quantity, self.unit)
+
+    @classmethod
+    def from_document(cls, item_data):
+        """Builds a ListItem from a Firestore document's data."""
+        return cls(item_data.get('item_name', ''), item_data.get('quantity', '1'),
+                   item_data.get('unit', ''), item_data.get('note'))
+
+    def to_document(self):
+        """Returns the item's fields (including the precomputed display name) for a Firestore write."""
+        return {
+            "item_name": self.item_name,
+            "quantity": self.quantity,
+            "unit": self.unit,
+            "note": self.note,
+            "display_name": self.display_name
+        }
+
+
+# Fields fetched (Firestore projection) for the compact payload; 'item_name' covers
+# documents written before 'display_name' was stored.
+COMPACT_ITEM_FIELDS = ['display_name', 'item_name', 'note']
+
+
+def get_display_name(item_data):
+    """Returns the stored display name of an item document (formatting it only for documents that predate it)."""
+    return item_data.get('display_name') or format_display_name(
+        item_data.get('item_name', ''), item_data.get('quantity', '1'), item_data.get('unit', ''))
+
+
+def serialize_item(item_id, item_data, compact=False):
+    """
+    Serializes a list item document for the frontend.
+
+    Args:
+        item_id: The Firestore document ID.
+        item_data: The document's data (possibly a projection, see COMPACT_ITEM_FIELDS).
+        compact: If True, only {"id", "name"[, "note"]} is returned.
+
+    Returns:
+        A JSON-serializable dict in which 'name' is the display name.
+    """
+    if compact:
+        compact_item = {"id": item_id, "name": get_display_name(item_data)}
+        if item_data.get('note'):
+            compact_item['note'] = item_data['note'] # Omit empty notes entirely
+        return compact_item
+
+    display_item = dict(item_data)
+    display_item['id'] = item_id # Add document ID for frontend use
+    display_item['name'] = get_display_name(item_data)
+    if display_item.get('added_timestamp') is firestore.SERVER_TIMESTAMP:
+        display_item['added_timestamp'] = None # Only resolved by Firestore once the write is committed
+    return display_item
@@ -0,0 +1,159 @@
+# legacy_migration.py
+#
+# One-off migration of the data written before lists and history were partitioned per user:
+#
+#   shopping_lists/{list_id}          -> users/{user_id}/shopping_lists/{list_id}
+#   list_items/{id} (open)            -> users/{user_id}/shopping_lists/{list_id}/list_items/{deterministic id}
+#   list_items/{id} (is_bought: True) -> users/{user_id}/shopping_lists/{list_id}/purchases/{id}
+#   user_history/{id}                 -> users/{user_id}/user_history/{id}
+#
+# Everything moves into one household (the default user), which is who the data belonged to.
+# The global collections are only read, never deleted, so the migration can be checked (and the
+# old collections dropped by hand) afterwards. Purchases and history keep their document IDs, so
+# re-running the migration with --force overwrites them instead of duplicating them.
+from firebase_admin import firestore
+
+from item_model import ListItem, get_item_id
+from purchases import to_purchase_document
+from rec_cache import bump_history_version, bump_list_version
+from tenancy import DEFAULT_LIST_NAME, get_history_ref, get_list_items_ref, get_list_ref, get_purchases_ref
+
+# Documents read and written per WriteBatch (each legacy document is one write)
+MIGRATION_PAGE_SIZE = 400
+# Records that the migration ran, so it isn't repeated by accident (it would re-open bought items)
+MIGRATION_MARKER = ('app_meta', 'legacy_migration')
+
+
+def iter_pages(query):
+    """Pages through a query's documents in document ID order."""
+    page_query = query.limit(MIGRATION_PAGE_SIZE)
+    while True:
+        docs = list(page_query.stream())
+        if docs:
+            yield docs
+        if len(docs) < MIGRATION_PAGE_SIZE:
+            break
+        page_query = query.start_after(docs[-1]).limit(MIGRATION_PAGE_SIZE)
+
+
+def get_migration_marker(db_client):
+    """Returns the marker document of an earlier run (its data), or None if the migration never ran."""
+    marker_doc = db_client.collection(MIGRATION_MARKER[0]).document(MIGRATION_MARKER[1]).get()
+    return marker_doc.to_dict() if marker_doc.exists else None
+
+
+def migrate_list_items(db_client, user_id, list_id):
+    """
+    Copies a legacy list's items: open items under their deterministic ID (see item_model.get_item_id),
+    bought items into the list's purchases archive.
+
+    Returns:
+        tuple: ({legacy item ID: new item ID}, stats dict)
+    """
+    items_ref = get_list_items_ref(db_client, user_id, list_id)
+    purchases_ref = get_purchases_ref(db_client, user_id, list_id)
+    legacy_query = db_client.collection('list_items').where('list_id', '==', list_id)
+    item_ids = {}
+    stats = {'open_items': 0, 'purchases': 0, 'merged_items': 0}
+
+    for legacy_docs in iter_pages(legacy_query):
+        open_items = {} # New item ID -> document, for the open items of this page
+        purchases = []
+        for legacy_doc in legacy_docs:
+            legacy_data = legacy_doc.to_dict()
+            list_item = ListItem.from_document(legacy_data)
+            item_id = get_item_id(list_id, list_item.item_name, list_item.unit)
+            item_ids[legacy_doc.id] = item_id
+
+            item_data = list_item.to_document()
+            item_data['added_timestamp'] = legacy_data.get('added_timestamp') or firestore.SERVER_TIMESTAMP
+            if legacy_data.get('is_bought'):
+                purchase_data = to_purchase_document(item_id, item_data)
+                # The original purchase time is unknown; fall back to when the item was added
+                purchase_data['purchased_at'] = item_data['added_timestamp']
+                purchases.append((legacy_doc.id, purchase_data))
+            elif item_id in open_items:
+                stats['merged_items'] += 1 # Same name and unit twice: only one open item per name and unit
+            else:
+                open_items[item_id] = item_data
+
+        # Items added in the new layout since the deploy win over their legacy copy
+        existing_refs = [items_ref.document(item_id) for item_id in open_items]
+        for existing_doc in db_client.get_all(existing_refs):
+            if existing_doc.exists:
+                del open_items[existing_doc.id]
+                stats['merged_items'] += 1
+
+        batch = db_client.batch()
+        for item_id, item_data in open_items.items():
+            batch.set(items_ref.document(item_id), item_data)
+        for legacy_id, purchase_data in purchases:
+            batch.set(purchases_ref.document(legacy_id), purchase_data)
+        batch.commit()
+        stats['open_items'] += len(open_items)
+        stats['purchases'] += len(purchases)
+
+    return item_ids, stats
+
+
+def migrate_history(db_client, user_id, item_ids, default_list_id):
+    """
+    Copies the legacy history events under their original IDs. 'list_item_id' is rewritten to the
+    item's new ID, and events get the 'list_id' the partitioned history events carry.
+
+    Returns:
+        The number of migrated events.
+    """
+    history_ref = get_history_ref(db_client, user_id)
+    migrated_count = 0
+    for legacy_docs in iter_pages(db_client.collection('user_history')):
+        batch = db_client.batch()
+        for legacy_doc in legacy_docs:
+            event_data = legacy_doc.to_dict()
+            if event_data.get('list_item_id') in item_ids:
+                event_data['list_item_id'] = item_ids[event_data['list_item_id']]
+            event_data.setdefault('list_id', default_list_id)
+            batch.set(history_ref.document(legacy_doc.id), event_data)
+        batch.commit()
+        migrated_count += len(legacy_docs)
+    return migrated_count
+
+
+def migrate_legacy_collections(db_client, user_id, default_list_id):
+    """
+    Moves the global 'shopping_lists', 'list_items' and 'user_history' collections into the
+    user's partition and records the run in the migration marker.
+
+    Args:
+        default_list_id: The list that history events without a 'list_id' are attributed to.
+
+    Returns:
+        dict: Migrated lists, open items, purchases, merged (duplicate) items and history events.
+    """
+    stats = {'lists': 0, 'open_items': 0, 'purchases': 0, 'merged_items': 0, 'history_events': 0}
+    item_ids = {}
+
+    legacy_list_ids = {list_ref.id for list_ref in db_client.collection('shopping_lists').list_documents()}
+    legacy_list_ids.add(default_list_id) # Items of the default list exist even if its document was never created
+    for list_id in sorted(legacy_list_ids):
+        legacy_list_doc = db_client.collection('shopping_lists').document(list_id).get()
+        list_ref = get_list_ref(db_client, user_id, list_id)
+        if not list_ref.get().exists:
+            list_name = (legacy_list_doc.to_dict() or {}).get('name') if legacy_list_doc.exists else None
+            list_ref.set({"name": list_name or DEFAULT_LIST_NAME})
+
+        list_item_ids, list_stats = migrate_list_items(db_client, user_id, list_id)
+        item_ids.update(list_item_ids)
+        for key, count in list_stats.items():
+            stats[key] += count
+        stats['lists'] += 1
+        bump_list_version(user_id, list_id)
+        print(f"List '{list_id}': {list_stats['open_items']} open items, {list_stats['purchases']} purchases "
+              f"({list_stats['merged_items']} duplicates merged).")
+
+    stats['history_events'] = migrate_history(db_client, user_id, item_ids, default_list_id)
+    bump_history_version(user_id)
+
+    db_client.collection(MIGRATION_MARKER[0]).document(MIGRATION_MARKER[1]).set(
+        dict(stats, user_id=user_id, migrated_at=firestore.SERVER_TIMESTAMP))
+    return stats
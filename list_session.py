@@ -0,0 +1,327 @@
+# list_session.py
+from firebase_admin import firestore
+from google.api_core.exceptions import Conflict
+
+from item_model import ListItem, get_display_name, get_item_id
+from purchases import to_purchase_document
+from tenancy import get_list_ref, get_list_items_ref, get_purchases_ref, get_history_ref
+from recipe_manager import RECIPES_DATA, get_ingredients_for_dish
+
+# Firestore rejects WriteBatches with more than 500 operations.
+MAX_BATCH_OPS = 500
+
+
+def load_open_items(db_client, user_id, list_id):
+    """Reads a list's open items into a dict of item_id -> item data, newest first."""
+    open_items = {}
+    items_query = get_list_items_ref(db_client, user_id, list_id)\
+                      .order_by('added_timestamp', direction=firestore.Query.DESCENDING).stream()
+    for item_doc in items_query:
+        open_items[item_doc.id] = item_doc.to_dict()
+    return open_items
+
+
+class ListSession:
+    """
+    A unit of work against one shopping list.
+
+    The list's open items are read once into memory. Every change made through the
+    session is applied to that in-memory view (so later commands in the same session
+    see earlier ones) and staged in a WriteBatch, so a whole burst of commands costs
+    a single read and a single commit.
+    """
+
+    def __init__(self, db_client, user_id, list_id, items=None):
+        self.db = db_client
+        self.user_id = user_id
+        self.list_id = list_id
+        self.items_ref = get_list_items_ref(db_client, user_id, list_id)
+        self.purchases_ref = get_purchases_ref(db_client, user_id, list_id)
+        self.history_ref = get_history_ref(db_client, user_id)
+        self.applied_commands_ref = get_list_ref(db_client, user_id, list_id).collection('applied_commands')
+
+        self.batch = db_client.batch()
+        self.pending_ops = 0
+        self.has_changes = False # Whether anything was committed (callers invalidate caches then)
+
+        # item_id -> item data for every open item, newest first ('list_items' holds no bought items).
+        # A snapshot that was already loaded (see speculation.py) can be passed in to skip the read.
+        self.items = dict(items) if items is not None else load_open_items(db_client, user_id, list_id)
+
+    # --- Lookups on the in-memory view ---
+
+    def find_item(self, item_name, quantity=None, unit=None):
+        """Returns the ID of the first open item matching the name (and quantity/unit if given), or None."""
+        for item_id, item_data in self.items.items():
+            if item_data.get('item_name') != item_name:
+                continue
+            if quantity is not None and item_data.get('quantity') != quantity:
+                continue
+            if unit is not None and item_data.get('unit') != unit:
+                continue
+            return item_id
+        return None
+
+    # --- Staged writes ---
+
+    def _stage(self):
+        """Counts one staged operation, committing early if the batch is about to overflow."""
+        if self.pending_ops >= MAX_BATCH_OPS:
+            self.commit()
+        self.pending_ops += 1
+
+    def add_item(self, item, action_type='added'):
+        """
+        Stages a new open item (a ListItem, plus its history event) and returns the stored data,
+        or None if an item with the same name and unit is already on the list.
+
+        The document ID is derived from the list, name and unit (see item_model.get_item_id) and
+        the write is a create, so if another device added the same item after the list was read,
+        the commit fails with a conflict instead of storing a duplicate (see run_list_session).
+        """
+        new_item_id = get_item_id(self.list_id, item.item_name, item.unit)
+        if new_item_id in self.items:
+            return None
+        new_item_data = item.to_document()
+        new_item_data['added_timestamp'] = firestore.SERVER_TIMESTAMP # Use server timestamp
+        self._stage()
+        self.batch.create(self.items_ref.document(new_item_id), new_item_data)
+        self.items = {new_item_id: new_item_data, **self.items} # Newest items come first
+        self.log_history(item.item_name, action_type, new_item_id)
+        return new_item_data
+
+    def remove_item(self, item_id, action_type='removed'):
+        """Stages the deletion of an open item and returns its data."""
+        item_data = self.items.pop(item_id)
+        self._stage()
+        self.batch.delete(self.items_ref.document(item_id))
+        self.log_history(item_data.get('item_name', 'Unknown Item'), action_type, item_id)
+        return item_data
+
+    def mark_bought(self, item_id):
+        """Stages moving an open item into the list's purchases and returns its data."""
+        item_data = self.items.pop(item_id)
+        self._stage()
+        self.batch.set(self.purchases_ref.document(), to_purchase_document(item_id, item_data))
+        self._stage()
+        self.batch.delete(self.items_ref.document(item_id))
+        self.log_history(item_data.get('item_name', 'Unknown Item'), 'bought', item_id)
+        return item_data
+
+    def log_history(self, item_name, action_type, list_item_id):
+        """Stages a user history event."""
+        user_history_data = {
+            "item_name": item_name,
+            "timestamp": firestore.SERVER_TIMESTAMP,
+            "action_type": action_type,
+            "list_item_id": list_item_id
+        }
+        self._stage()
+        self.batch.set(self.history_ref.document(), user_history_data)
+
+    def record_applied_command(self, client_id, status_type, message):
+        """
+        Stages the marker that makes a synced client command idempotent. It is a create, so if
+        another request applied the same command after the markers were read, the commit fails
+        with a conflict (see run_list_session) instead of applying the command twice.
+        """
+        self._stage()
+        self.batch.create(self.applied_commands_ref.document(client_id), {
+            "status": status_type,
+            "message": message,
+            "applied_timestamp": firestore.SERVER_TIMESTAMP
+        })
+
+    def commit(self):
+        """Commits all staged operations (if any) and starts a fresh batch."""
+        if self.pending_ops:
+            self.batch.commit()
+            self.has_changes = True
+        self.batch = self.db.batch()
+        self.pending_ops = 0
+
+
+def run_list_session(db_client, user_id, list_id, apply_changes, items=None):
+    """
+    Runs apply_changes(session) on a ListSession of the list and commits it.
+
+    If the commit conflicts (another device created one of the same items, or applied one of the
+    same synced commands, after the list was read), Firestore rejected the whole batch, so the
+    changes are applied once more to a fresh read of the list, where the concurrently added items
+    now count as duplicates. apply_changes must re-read any other state it depends on (such as
+    the applied-command markers) on the retry, since batches committed early are kept.
+
+    Args:
+        apply_changes: Function staging the changes; it is called again on retry.
+        items: Optional prefetched open items for the first attempt (see ListSession).
+
+    Returns:
+        A (session, apply_changes result) tuple; session.has_changes says whether anything was written.
+    """
+    committed_before_conflict = False
+    for attempt in (1, 2):
+        session = ListSession(db_client, user_id, list_id, items=items if attempt == 1 else None)
+        try:
+            result = apply_changes(session) # May commit early on very large batches
+            session.commit()
+            session.has_changes = session.has_changes or committed_before_conflict
+            return session, result
+        except Conflict:
+            if attempt == 2:
+                raise
+            committed_before_conflict = session.has_changes
+            print(f"Item conflict on list '{list_id}' of user '{user_id}'; retrying on a fresh read.")
+
+
+def execute_command(session, nlp_output):
+    """
+    Applies one parsed voice command (the output of nlp_model.process_command) to a ListSession.
+    Nothing is written until the caller commits the session.
+
+    Returns:
+        A (status_type, response_message) tuple for the frontend.
+    """
+    intent = nlp_output['intent']
+    response_message = "I'm not sure how to handle that. Can you try rephrasing?"
+    status_type = "info"
+
+    # --- Handle Different Intents ---
+    if intent == 'add_item':
+        added_item_names = [] # To store names of actually added items for the response message
+
+        # nlp_output['items'] is a list of dictionaries: [{'name': 'milk', 'quantity': '2', 'unit': 'liters'}]
+        for item_obj in nlp_output['items']:
+            item_name = item_obj['name']
+            quantity = item_obj.get('quantity', '1') # Default to '1' if not provided by NLP
+            unit = item_obj.get('unit', '')           # Default to '' if not provided by NLP
+
+            # A list holds one open item per name and unit (items added before IDs were derived
+            # from them are matched by find_item; newer ones by add_item's ID check)
+            if session.find_item(item_name, unit=unit) is None:
+                new_item = ListItem(item_name, quantity, unit, nlp_output['note'])
+                if session.add_item(new_item) is not None:
+                    added_item_names.append(new_item.display_name)
+
+        if added_item_names:
+            response_message = f"Added {', '.join(added_item_names)} to your list."
+            status_type = "success"
+        else:
+            response_message = "Those items are already on your list or no new items detected."
+            status_type = "info"
+
+    elif intent == 'remove_item':
+        items_to_delete_ids = [] # Collect IDs of the open items to delete
+
+        if nlp_output['dish_name']: # If a dish name is provided (e.g., "delete biryani items")
+            dish_name_lower = nlp_output['dish_name'].lower()
+            recipe_ingredients = set(RECIPES_DATA.get(dish_name_lower, []))
+
+            # Find items with a note referring to the dish, or that are ingredients of the dish
+            for item_id, item_data in session.items.items():
+                note_matches = item_data.get('note') and dish_name_lower in item_data['note'].lower()
+                if note_matches or item_data.get('item_name') in recipe_ingredients:
+                    items_to_delete_ids.append(item_id)
+
+            if not items_to_delete_ids:
+                response_message = f"No items related to '{nlp_output['dish_name']}' found on your list to remove."
+
+        else: # Regular item removal (e.g., "remove bread" - items array populated by NLP)
+            for item_obj in nlp_output['items']:
+                quantity_nlp = item_obj.get('quantity', '1')
+                unit_nlp = item_obj.get('unit', '')
+
+                # Match a specific item, matching quantity and unit if provided by NLP
+                item_id = session.find_item(item_obj['name'],
+                                            quantity_nlp if quantity_nlp and quantity_nlp != '1' else None,
+                                            unit_nlp or None)
+                if item_id is not None and item_id not in items_to_delete_ids:
+                    items_to_delete_ids.append(item_id)
+
+            if not items_to_delete_ids:
+                response_message = "Could not find those items on your list to remove."
+
+        deleted_item_names = []
+        for item_id in items_to_delete_ids:
+            item_data = session.remove_item(item_id)
+            deleted_item_names.append(get_display_name(item_data))
+
+        if deleted_item_names:
+            response_message = f"Removed {', '.join(deleted_item_names)} from your list."
+            status_type = "success"
+
+    elif intent == 'mark_bought':
+        bought_item_names = [] # To collect names of items actually marked
+
+        for item_obj in nlp_output['items']:
+            quantity_nlp = item_obj.get('quantity', '1')
+            unit_nlp = item_obj.get('unit', '')
+
+            # When searching to mark bought, match by name, quantity, and unit if provided by NLP
+            item_id = session.find_item(item_obj['name'],
+                                        quantity_nlp if quantity_nlp and quantity_nlp != '1' else None,
+                                        unit_nlp or None)
+            if item_id is not None:
+                item_data = session.mark_bought(item_id)
+                bought_item_names.append(get_display_name(item_data))
+
+        if bought_item_names:
+            response_message = f"Marked {', '.join(bought_item_names)} as bought."
+            status_type = "success"
+        else:
+            response_message = "Could not find those items on your list to mark as bought."
+            status_type = "info"
+
+    elif intent == 'get_recipe_ingredients':
+        dish_name = nlp_output.get('dish_name')
+        if dish_name:
+            ingredients = get_ingredients_for_dish(dish_name)
+            if ingredients:
+                added_recipe_items = []
+                for ingredient_name in ingredients:
+                    # For recipe ingredients, we assume quantity '1' and no unit
+                    if session.find_item(ingredient_name) is None:
+                        item_note_text = f"for {dish_name}"
+                        if nlp_output['note']:
+                            item_note_text += f" ({nlp_output['note']})"
+
+                        recipe_item = ListItem(ingredient_name, "1", "", item_note_text)
+                        if session.add_item(recipe_item, action_type=f'added_for_recipe_{dish_name}') is not None:
+                            added_recipe_items.append(ingredient_name)
+
+                if added_recipe_items:
+                    response_message = f"Added ingredients for {dish_name}: {', '.join(added_recipe_items)}."
+                    status_type = "success"
+                else:
+                    response_message = f"All ingredients for {dish_name} are already on your list."
+                    status_type = "info"
+            else:
+                response_message = f"Sorry, I don't have ingredients for '{dish_name}' in my recipe book."
+                status_type = "warning"
+        else:
+            response_message = "Please tell me which dish you want ingredients for."
+            status_type = "warning"
+
+    return status_type, response_message
+
+
+def execute_commands(session, nlp_outputs):
+    """
+    Applies the clauses of a compound voice command (the output of
+    nlp_model.process_compound_command) to a ListSession, in spoken order. Later clauses see
+    the changes of earlier ones, and everything is written by the caller's single commit.
+
+    Returns:
+        A (status_type, response_message) tuple combining the results of all clauses.
+    """
+    results = [execute_command(session, nlp_output) for nlp_output in nlp_outputs]
+    if len(results) == 1:
+        return results[0]
+
+    statuses = [status_type for status_type, _ in results]
+    if "success" in statuses:
+        status_type = "success" # Something was done; the message says what, clause by clause
+    elif "warning" in statuses:
+        status_type = "warning"
+    else:
+        status_type = "info"
+    return status_type, " ".join(response_message for _, response_message in results)
@@ -245,6 +245,43 @@ def process_command(text):
         "note": note
     }
 
+# --- Compound (multi-intent) commands ---
+# Words that start a new command; "and"/"then" followed by one of them begins a new clause,
+# while "and" between item names ("add milk and eggs") stays inside the clause.
+CLAUSE_START_WORDS = ["add", "put", "get", "need", "remove", "delete", "mark", "check", "make", "cook", "prepare"]
+_CLAUSE_START = r'(?=(?:i\s+(?:want\s+to\s+)?)?(?:' + '|'.join(CLAUSE_START_WORDS) + r')\b)' # "... and I want to make pasta"
+CLAUSE_SPLIT_PATTERN = re.compile(
+    r'\s*(?:,\s*)?\b(?:and then|and also|and|then|also)\s+' + _CLAUSE_START + r'|\s*[,;]\s*' + _CLAUSE_START,
+    re.IGNORECASE
+)
+
+
+def split_clauses(text):
+    """
+    Splits an utterance into its command clauses, in the order they were spoken.
+    e.g. "add milk and eggs and remove bread" -> ["add milk and eggs", "remove bread"]
+    """
+    clauses = [clause.strip(" ,;") for clause in CLAUSE_SPLIT_PATTERN.split(text.strip())]
+    return [clause for clause in clauses if clause]
+
+
+def process_compound_command(text):
+    """
+    Processes an utterance that may hold several commands ("mark eggs bought and add butter").
+    Each clause is parsed with process_command.
+
+    Returns:
+        list: One process_command output per recognized clause, in spoken order. Clauses that
+              weren't understood are dropped, unless nothing was understood at all.
+    """
+    clauses = split_clauses(text)
+    if len(clauses) <= 1:
+        return [process_command(text)]
+
+    nlp_outputs = [process_command(clause) for clause in clauses]
+    recognized = [nlp_output for nlp_output in nlp_outputs if nlp_output["intent"] != "unknown"]
+    return recognized or [process_command(text)]
+
 # Example Usage (for testing in VS Code terminal)
 if __name__ == "__main__":
     print("--- Testing NLP Model ---")
@@ -254,7 +291,7 @@ if __name__ == "__main__":
     print(f"'Next Friday I want to make biryani': {process_command('Next Friday I want to make biryani.')}")
     print(f"'Can you add ingredients for pasta for dinner tonight?': {process_command('Can you add ingredients for pasta for dinner tonight?')}")
     print(f"'I need large milk': {process_command('I need large milk')}")
-    print(f"'What's on my list?': {process_command('What\'s on my list?')}")
+    print("'What's on my list?':", process_command("What's on my list?"))
     print(f"'Help me with chili recipe': {process_command('Help me with chili recipe')}")
     print(f"'Add some small bananas': {process_command('Add some small bananas')}")
     print(f"'Delete biryani items from list.': {process_command('Delete biryani items from list.')}")
@@ -277,3 +314,8 @@ if __name__ == "__main__":
     print(f"'I thought of doing puliyogare': {process_command('I thought of doing puliyogare')}")
     print(f"'I thought of doing veg kurma': {process_command('I thought of doing veg kurma')}")
     print(f"'Add ingredients for obbattu holige': {process_command('Add ingredients for obbattu holige')}") # Test corrected name
+    # --- Compound Command Tests ---
+    print(f"\n--- Compound Command Tests ---")
+    print(f"'Add milk and remove bread': {process_compound_command('Add milk and remove bread')}")
+    print(f"'Mark eggs bought and add butter': {process_compound_command('Mark eggs bought and add butter')}")
+    print(f"'Add milk and eggs then make pasta': {process_compound_command('Add milk and eggs then make pasta')}")
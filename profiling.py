@@ -0,0 +1,189 @@
+# profiling.py
+import cProfile
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import g, request
+
+# Requests are profiled when they carry a valid signed X-Profile-Token header (see make_profile_token)...
+PROFILE_SECRET = os.environ.get('PROFILE_SECRET', '')
+PROFILE_TOKEN_HEADER = 'X-Profile-Token'
+# ...or at random with this probability (0 disables sampling)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+# Where profiles are saved (one .prof file for pstats/snakeviz plus a .json with its tags)
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+# Oldest profiles are deleted beyond this many
+MAX_SAVED_PROFILES = 200
+# Tokens minted by the 'profile-token' command are valid this long by default
+DEFAULT_TOKEN_TTL_SECONDS = 15 * 60
+# Never profiled: static files, and the endpoints that list and download the saved profiles (their
+# callers carry the token too, and would otherwise push real captures out of the store)
+UNPROFILED_PATH_PREFIXES = ('/static/', '/admin/profiles')
+
+# Only one profiler runs per process at a time: cProfile slows the request it profiles
+# considerably, and concurrent profiles would compete for the same CPU anyway.
+_profiler_lock = threading.Lock()
+
+
+def make_profile_token(ttl_seconds=DEFAULT_TOKEN_TTL_SECONDS, secret=None):
+    """
+    Returns a value for the X-Profile-Token header: '<expiry unix time>.<HMAC-SHA256 of the expiry>'.
+    Anyone holding PROFILE_SECRET can mint one; it expires on its own, so it is safe to paste into curl.
+    """
+    secret = secret or PROFILE_SECRET
+    if not secret:
+        raise ValueError("PROFILE_SECRET is not set.")
+    expires_at = str(int(time.time()) + ttl_seconds)
+    signature = hmac.new(secret.encode('utf-8'), expires_at.encode('utf-8'), hashlib.sha256).hexdigest()
+    return f"{expires_at}.{signature}"
+
+
+def is_valid_profile_token(token):
+    """Returns True if the token was signed with PROFILE_SECRET and hasn't expired."""
+    if not PROFILE_SECRET or not token or '.' not in token:
+        return False
+    expires_at, signature = token.split('.', 1)
+    if not expires_at.isdigit() or int(expires_at) < time.time():
+        return False
+    expected = hmac.new(PROFILE_SECRET.encode('utf-8'), expires_at.encode('utf-8'), hashlib.sha256).hexdigest()
+    # Compared as bytes: compare_digest raises TypeError for non-ASCII str arguments, and this
+    # runs in before_request for every route
+    return hmac.compare_digest(expected.encode('utf-8'), signature.encode('utf-8'))
+
+
+def should_profile_request():
+    """Decides whether the current request is profiled: signed header, else the sampling rate."""
+    if is_valid_profile_token(request.headers.get(PROFILE_TOKEN_HEADER)):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def start_request_profile():
+    """before_request hook: starts cProfile for the request if it was selected for profiling."""
+    if request.path.startswith(UNPROFILED_PATH_PREFIXES) or not should_profile_request():
+        return
+    if not _profiler_lock.acquire(blocking=False):
+        return # Another request is being profiled in this process
+    g.profiler = cProfile.Profile()
+    g.profile_tags = {}
+    g.profile_started_at = time.perf_counter()
+    g.profiler.enable()
+
+
+def tag_profile(**tags):
+    """
+    Attaches tags (e.g. intents=['add_item']) to the current request's profile, if it has one,
+    so saved profiles can be told apart by what the request did.
+    """
+    if getattr(g, 'profiler', None) is not None:
+        g.profile_tags.update(tags)
+
+
+def finish_request_profile(response):
+    """
+    after_request hook: stops the request's profiler and saves the profile.
+
+    A streamed response (e.g. NDJSON) is only generated after this hook, so its profiler keeps
+    running until the response is closed, and the profile is saved then. Its X-Profile-Id is
+    assigned up front, since the headers are already sent by the time the profile is written.
+    """
+    profiler = getattr(g, 'profiler', None)
+    if profiler is None:
+        return response
+    g.profiler = None # From here on this hook owns the profiler (abandon_request_profile leaves it alone)
+    route = request.url_rule.rule if request.url_rule else request.path
+    profile_id = make_profile_id(route, g.profile_tags)
+    started_at, tags, method, status_code = g.profile_started_at, g.profile_tags, request.method, response.status_code
+
+    def save():
+        profiler.disable()
+        try:
+            duration_ms = (time.perf_counter() - started_at) * 1000
+            save_profile(profiler, profile_id, route, method, status_code, duration_ms, tags)
+        except OSError as e:
+            print(f"Error saving request profile: {e}")
+        finally:
+            _profiler_lock.release()
+
+    response.headers['X-Profile-Id'] = profile_id
+    if response.is_streamed:
+        response.call_on_close(save)
+    else:
+        save()
+    return response
+
+
+def abandon_request_profile(error=None):
+    """teardown_request hook: releases the profiler if the request failed before after_request ran."""
+    profiler = getattr(g, 'profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        g.profiler = None
+        _profiler_lock.release()
+
+
+def make_profile_id(route, tags):
+    """Returns the ID (file name without extension) of a new profile: the time, route and intents."""
+    created_at = datetime.now(timezone.utc)
+    label = route.strip('/').replace('<', '').replace('>', '') or 'index'
+    if tags.get('intents'):
+        label += '-' + '+'.join(tags['intents'])
+    label = re.sub(r'[^A-Za-z0-9_+-]+', '_', label)[:80]
+    return f"{created_at.strftime('%Y%m%dT%H%M%S%fZ')}_{os.getpid()}_{label}"
+
+
+def save_profile(profiler, profile_id, route, method, status_code, duration_ms, tags):
+    """Writes the profile to PROFILE_DIR, with a .json sidecar holding its tags."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    created_at = datetime.now(timezone.utc)
+    profiler.dump_stats(os.path.join(PROFILE_DIR, f"{profile_id}.prof"))
+    metadata = {"id": profile_id, "route": route, "method": method, "status_code": status_code,
+                "duration_ms": round(duration_ms, 1), "created_at": created_at.isoformat(),
+                "pid": os.getpid(), **tags}
+    with open(os.path.join(PROFILE_DIR, f"{profile_id}.json"), 'w') as metadata_file:
+        json.dump(metadata, metadata_file)
+    print(f"Saved request profile '{profile_id}' ({duration_ms:.0f} ms).")
+
+    prune_profiles()
+
+
+def prune_profiles():
+    """Deletes the oldest profiles beyond MAX_SAVED_PROFILES."""
+    profile_ids = sorted(name[:-len('.prof')] for name in os.listdir(PROFILE_DIR) if name.endswith('.prof'))
+    for profile_id in profile_ids[:-MAX_SAVED_PROFILES]:
+        for extension in ('.prof', '.json'):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, profile_id + extension))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles():
+    """Returns the metadata of the saved profiles, newest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True): # IDs start with the timestamp
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, name)) as metadata_file:
+                profiles.append(json.load(metadata_file))
+        except (OSError, ValueError):
+            continue # Being written or pruned concurrently
+    return profiles
+
+
+def get_profile_path(profile_id):
+    """Returns the .prof file of a saved profile, or None for unknown (or malformed) IDs."""
+    if not re.fullmatch(r'[A-Za-z0-9_+-]+', profile_id or ''):
+        return None
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.prof")
+    return path if os.path.exists(path) else None
@@ -0,0 +1,79 @@
+# purchases.py
+from firebase_admin import firestore
+
+from tenancy import get_list_items_ref, get_purchases_ref
+
+# Bought items are moved out of 'list_items' into the list's 'purchases' collection, so
+# 'list_items' only ever holds the open items and hot queries need no 'is_bought' filter.
+# A purchase keeps all fields of the item plus the fields below.
+PURCHASE_FIELDS = ('list_item_id', 'purchased_at', 'is_bought')
+
+# Legacy bought items moved per WriteBatch by migrate_bought_items (2 operations each)
+MIGRATION_PAGE_SIZE = 200
+
+
+def to_purchase_document(item_id, item_data):
+    """Builds the purchase record for an open item that was just bought."""
+    purchase_data = {key: value for key, value in item_data.items() if key != 'is_bought'}
+    purchase_data['list_item_id'] = item_id # Lets the purchase be restored under its original ID
+    purchase_data['purchased_at'] = firestore.SERVER_TIMESTAMP
+    return purchase_data
+
+
+def to_item_document(purchase_data):
+    """Builds the open item document restored from a purchase record."""
+    return {key: value for key, value in purchase_data.items() if key not in PURCHASE_FIELDS}
+
+
+def find_latest_purchase(db_client, user_id, list_id, item_id):
+    """
+    Finds the most recent purchase of a list item (if the same item was bought several times).
+    Sorting happens in Python so no composite index on (list_item_id, purchased_at) is needed.
+
+    Returns:
+        The purchase's DocumentSnapshot, or None.
+    """
+    purchase_docs = get_purchases_ref(db_client, user_id, list_id).where('list_item_id', '==', item_id).stream()
+    latest_purchase = None
+    latest_purchased_at = None
+    for purchase_doc in purchase_docs:
+        purchased_at = purchase_doc.to_dict().get('purchased_at')
+        if latest_purchase is None or (purchased_at and (latest_purchased_at is None or purchased_at > latest_purchased_at)):
+            latest_purchase = purchase_doc
+            latest_purchased_at = purchased_at
+    return latest_purchase
+
+
+def migrate_bought_items(db_client, user_id, list_id):
+    """
+    Moves items still stored in 'list_items' with 'is_bought: True' (written before purchases
+    were archived) into the list's 'purchases' collection.
+
+    Returns:
+        The number of migrated items.
+    """
+    items_ref = get_list_items_ref(db_client, user_id, list_id)
+    purchases_ref = get_purchases_ref(db_client, user_id, list_id)
+    # Migrated items leave 'list_items', so the same query always returns the next page
+    page_query = items_ref.where('is_bought', '==', True).limit(MIGRATION_PAGE_SIZE)
+    migrated_count = 0
+
+    while True:
+        item_docs = list(page_query.stream())
+        if not item_docs:
+            break
+
+        batch = db_client.batch()
+        for item_doc in item_docs:
+            purchase_data = to_purchase_document(item_doc.id, item_doc.to_dict())
+            # The original purchase time is unknown; fall back to when the item was added
+            purchase_data['purchased_at'] = item_doc.to_dict().get('added_timestamp') or firestore.SERVER_TIMESTAMP
+            batch.set(purchases_ref.document(), purchase_data)
+            batch.delete(item_doc.reference)
+        batch.commit()
+
+        migrated_count += len(item_docs)
+        if len(item_docs) < MIGRATION_PAGE_SIZE:
+            break
+
+    return migrated_count
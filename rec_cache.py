@@ -0,0 +1,168 @@
+# rec_cache.py
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from recommender import get_smart_recommendations
+
+# Optional shared backend: with REDIS_URL set (and the redis package installed), cached results
+# and version counters are shared by all workers. Otherwise each worker keeps its own LRU cache.
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Upper bound on entries in a worker's local cache (least recently used entries are evicted)
+LOCAL_CACHE_MAX_ENTRIES = 1024
+# Each worker only sees its own version bumps, so local entries also expire after this long;
+# this bounds how stale another worker's cached recommendations can get without a shared backend.
+LOCAL_CACHE_TTL_SECONDS = 60
+# Shared entries are always invalidated by version bumps; the TTL only garbage-collects them
+SHARED_CACHE_TTL_SECONDS = 3600
+CACHE_KEY_PREFIX = 'auralist:'
+
+
+class LocalCacheBackend:
+    """Bounded, thread-safe in-process LRU cache with per-name version counters."""
+
+    is_shared = False # Other workers neither see these entries nor this worker's version bumps
+
+    def __init__(self, max_entries=LOCAL_CACHE_MAX_ENTRIES, ttl_seconds=LOCAL_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict() # key -> (expires_at, value), least recently used first
+        self.versions = {} # Tiny (one int per active list/user), so never evicted
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl_seconds=None):
+        expires_at = time.monotonic() + min(ttl_seconds or self.ttl_seconds, self.ttl_seconds)
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False) # Evict the least recently used entry
+
+    def get_versions(self, names):
+        with self.lock:
+            return [self.versions.get(name, 0) for name in names]
+
+    def bump_versions(self, names):
+        with self.lock:
+            for name in names:
+                self.versions[name] = self.versions.get(name, 0) + 1
+
+
+class RedisCacheBackend:
+    """Cache and version counters shared by every worker through Redis."""
+
+    is_shared = True
+
+    def __init__(self, redis_url):
+        self.client = redis.Redis.from_url(redis_url)
+
+    def get(self, key):
+        value = self.client.get(CACHE_KEY_PREFIX + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl_seconds=SHARED_CACHE_TTL_SECONDS):
+        self.client.set(CACHE_KEY_PREFIX + key, json.dumps(value), ex=ttl_seconds)
+
+    def get_versions(self, names):
+        values = self.client.mget([CACHE_KEY_PREFIX + 'version:' + name for name in names])
+        return [int(value) if value is not None else 0 for value in values]
+
+    def bump_versions(self, names):
+        pipeline = self.client.pipeline()
+        for name in names:
+            pipeline.incr(CACHE_KEY_PREFIX + 'version:' + name)
+        pipeline.execute()
+
+
+_cache_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_cache_backend():
+    """Returns the process-wide cache backend, creating it on first use."""
+    global _cache_backend
+    if _cache_backend is None:
+        with _backend_lock:
+            if _cache_backend is None:
+                redis_url = os.environ.get('REDIS_URL')
+                if redis_url and redis is not None:
+                    _cache_backend = RedisCacheBackend(redis_url)
+                    print("Recommendation cache: using the shared Redis backend.")
+                else:
+                    if redis_url:
+                        print("Warning: REDIS_URL is set but the 'redis' package is not installed; using a local cache.")
+                    _cache_backend = LocalCacheBackend()
+    return _cache_backend
+
+
+def get_version_names(user_id, list_id):
+    """
+    Returns the version counters a list's recommendations depend on: the list's own items,
+    and the user's history (shared by all of the user's lists).
+    """
+    return [f"list:{user_id}:{list_id}", f"history:{user_id}"]
+
+
+def get_list_versions(user_id, list_id):
+    """Returns the current (list version, history version) pair of a list."""
+    return tuple(get_cache_backend().get_versions(get_version_names(user_id, list_id)))
+
+
+def bump_list_version(user_id, list_id):
+    """
+    Invalidates everything cached for the list (and the user's history) after a write.
+    Must be called by every path that changes a list's items or logs history.
+    """
+    try:
+        get_cache_backend().bump_versions(get_version_names(user_id, list_id))
+    except Exception as e:
+        print(f"Error bumping cache version for list '{list_id}' of user '{user_id}': {e}")
+
+
+def bump_history_version(user_id):
+    """Invalidates the cached recommendations of all the user's lists after history was written."""
+    try:
+        get_cache_backend().bump_versions([f"history:{user_id}"])
+    except Exception as e:
+        print(f"Error bumping history cache version of user '{user_id}': {e}")
+
+
+def get_cached_recommendations(db_client, user_id, list_id, num_recommendations=5):
+    """
+    Returns get_smart_recommendations for the list, served from the cache while neither the
+    list nor the user's history has changed since the result was computed.
+    Cache errors (e.g. Redis being unreachable) fall back to computing the result.
+    """
+    backend = get_cache_backend()
+    try:
+        list_version, history_version = get_list_versions(user_id, list_id)
+        cache_key = f"recs:{user_id}:{list_id}:{num_recommendations}:{list_version}:{history_version}"
+        recommendations = backend.get(cache_key)
+    except Exception as e:
+        print(f"Recommendation cache unavailable, computing directly: {e}")
+        return get_smart_recommendations(db_client, user_id, list_id, num_recommendations)
+
+    if recommendations is None:
+        recommendations = get_smart_recommendations(db_client, user_id, list_id, num_recommendations)
+        try:
+            backend.set(cache_key, recommendations)
+        except Exception as e:
+            print(f"Error storing recommendations in the cache: {e}")
+    return recommendations
@@ -2,14 +2,76 @@
 import pandas as pd
 from firebase_admin import firestore
 from datetime import datetime, timedelta, timezone # Import timezone
+from tenancy import get_history_ref, get_history_rollups_ref, get_list_items_ref
 
-def get_smart_recommendations(db_client, current_list_id, num_recommendations=5):
+# Recommendations are based on the items bought or added within this many days
+RECOMMENDATION_HORIZON_DAYS = 90
+RECOMMENDATION_ACTION_TYPES = ('bought', 'added')
+
+
+def rank_items_by_frequency(history_df, since):
+    """
+    Sums the event counts per item name over the history on or after 'since', most frequent first.
+    Shared by the live recommender and offline experiments on exported history (see load_exported_history).
+
+    Args:
+        history_df: DataFrame with 'item_name', 'timestamp' (UTC) and 'count' columns.
+        since: Timezone-aware datetime; older events are ignored.
+
+    Returns:
+        A pandas Series of item name -> summed count.
+    """
+    recent_history_df = history_df[history_df['timestamp'] >= since]
+    # observed=True: exported item names are categorical, and unseen categories shouldn't be ranked
+    return recent_history_df.groupby('item_name', observed=True)['count'].sum().sort_values(ascending=False, kind='stable')
+
+
+def load_exported_history(export_dir=None, user_id=None, action_types=('bought', 'added')):
+    """
+    Loads history exported by columnar_export.py (memory-mapped) into the DataFrame shape used
+    by get_smart_recommendations, for offline training and benchmarks without Firestore.
+    Item names stay dictionary-encoded (a pandas Categorical), so large exports stay small in memory.
+
+    Args:
+        export_dir: The export directory (default: columnar_export.EXPORT_DIR).
+        user_id: Only this user's events (default: every user, with a 'user_id' column to group by).
+        action_types: The action types to keep, like the live recommender.
+
+    Returns:
+        A DataFrame with 'user_id', 'item_name', 'timestamp' and 'count' columns (empty if nothing was exported).
+    """
+    # Imported here so the web workers, which never read exports, don't load pyarrow
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from columnar_export import EXPORT_DIR, read_export_table
+
+    table = read_export_table('user_history', export_dir or EXPORT_DIR,
+                              columns=['user_id', 'action_type', 'item_name', 'timestamp'])
+    if table is None:
+        return pd.DataFrame(columns=['user_id', 'item_name', 'timestamp', 'count'])
+
+    # Filter in Arrow before converting, so only the matching rows are materialized
+    row_filter = pc.is_in(table['action_type'].cast('string'), value_set=pa.array(list(action_types), type=pa.string()))
+    if user_id is not None:
+        row_filter = pc.and_(row_filter, pc.equal(table['user_id'].cast('string'), user_id))
+    table = table.filter(row_filter)
+
+    history_df = table.select(['user_id', 'item_name', 'timestamp']).to_pandas()
+    history_df['timestamp'] = pd.to_datetime(history_df['timestamp'], unit='us', utc=True)
+    history_df['count'] = 1
+    return history_df
+
+
+def get_smart_recommendations(db_client, user_id, current_list_id, num_recommendations=5):
     """
     Provides smart recommendations for shopping list items based on user history in Firestore.
     It identifies frequently bought/added items that are not currently on the active list.
+    Only the given user's history partition is scanned, so the cost scales with that
+    household's data rather than with every user's.
     
     Args:
         db_client: The Firestore client instance.
+        user_id: The ID of the user (tenant) whose history should be analysed.
         current_list_id: The ID of the current shopping list to check against.
         num_recommendations: The maximum number of recommendations to return.
     
@@ -18,33 +80,43 @@ def get_smart_recommendations(db_client, current_list_id, num_recommendations=5)
     """
     
     # 1. Fetch user history (recently bought/added items)
-    # Get all 'bought' and 'added' history items for frequency analysis.
-    # In Firestore, direct range queries on timestamps can require composite indexes.
-    # For a simpler approach here, we fetch all relevant history and filter by date in Python.
-    
+    # Only the last RECOMMENDATION_HORIZON_DAYS are used for "fresh" recommendations, so only those
+    # are read: the cost stays bounded however long the user's history grows.
+    # FIX: Make the cutoff timezone-aware (UTC) to match Firestore timestamps
+    since = datetime.utcnow().replace(tzinfo=timezone.utc) - timedelta(days=RECOMMENDATION_HORIZON_DAYS)
+
     history_items_data = []
-    # Fetch all user history documents with 'bought' or 'added' action types
-    history_query = db_client.collection('user_history').where('action_type', 'in', ['bought', 'added']).stream()
+    # The range filter uses the automatic single-field index; combining it with an 'in' filter on
+    # 'action_type' would need a composite index, so the action type is checked in Python instead.
+    history_query = get_history_ref(db_client, user_id).where('timestamp', '>=', since).stream()
 
     for doc in history_query:
         history_data = doc.to_dict()
+        if history_data.get('action_type') not in RECOMMENDATION_ACTION_TYPES:
+            continue
         # Firestore SERVER_TIMESTAMP fields become Python datetime objects when retrieved.
         # If timestamp is missing or not a datetime, skip.
         if isinstance(history_data.get('timestamp'), datetime):
-             history_items_data.append(history_data)
+             history_items_data.append({"item_name": history_data.get('item_name'),
+                                        "timestamp": history_data['timestamp'], "count": 1})
+
+    # Older events have been compacted into per-item daily rollups (see history_compaction.py).
+    # A rollup stands for 'count' raw events on its day, so raw and compacted history add up the same.
+    rollups_query = get_history_rollups_ref(db_client, user_id).where('day', '>=', since).stream()
+    for doc in rollups_query:
+        rollup_data = doc.to_dict()
+        if rollup_data.get('action_type') not in RECOMMENDATION_ACTION_TYPES:
+            continue
+        if isinstance(rollup_data.get('day'), datetime):
+            history_items_data.append({"item_name": rollup_data.get('item_name'),
+                                       "timestamp": rollup_data['day'], "count": rollup_data.get('count', 0)})
 
     # Convert to DataFrame for easier aggregation and filtering
     history_df = pd.DataFrame(history_items_data)
 
     frequently_interacted_items = []
     if not history_df.empty:
-        # Filter for items within a recent period (e.g., last 90 days) for "fresh" recommendations
-        # FIX: Make ninety_days_ago timezone-aware (UTC) to match Firestore timestamps
-        ninety_days_ago = datetime.utcnow().replace(tzinfo=timezone.utc) - timedelta(days=90)
-        recent_history_df = history_df[history_df['timestamp'] >= ninety_days_ago]
-        
-        # Count frequencies of item names from recent history
-        item_frequency = recent_history_df['item_name'].value_counts()
+        item_frequency = rank_items_by_frequency(history_df, since)
         
         # Get top N frequently interacted items
         # Fetch more candidates initially to ensure enough after filtering out current list items
@@ -52,7 +124,7 @@ def get_smart_recommendations(db_client, current_list_id, num_recommendations=5)
 
     # 2. Fetch current list items to avoid recommending already existing items
     current_list_items = set()
-    list_items_query = db_client.collection('list_items').where('list_id', '==', current_list_id).where('is_bought', '==', False).stream()
+    list_items_query = get_list_items_ref(db_client, user_id, current_list_id).select(['item_name']).stream()
     for doc in list_items_query:
         current_list_items.add(doc.to_dict()['item_name'].lower())
 
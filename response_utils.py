@@ -0,0 +1,121 @@
+# response_utils.py
+import gzip
+import json
+
+from flask import Response, request
+
+# Optional speed-ups: orjson serializes several times faster than the standard library,
+# and Brotli compresses JSON/HTML noticeably better than gzip. Both are used when installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this are sent as-is; compressing them costs more than it saves.
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSIBLE_MIMETYPES = {
+    'application/json', 'application/x-ndjson', 'application/javascript',
+    'text/html', 'text/css', 'text/javascript', 'text/plain'
+}
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def dumps_compact(payload):
+    """Serializes a payload to compact JSON bytes, using orjson if it is available."""
+    if orjson is not None:
+        return orjson.dumps(payload, default=str)
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False, default=str).encode('utf-8')
+
+
+def json_response(payload, status=200):
+    """Builds a compact (no whitespace) JSON response without going through Flask's jsonify."""
+    return Response(dumps_compact(payload), status=status, mimetype='application/json')
+
+
+def parse_accept_encoding(accept_encoding):
+    """Parses an Accept-Encoding header into {coding: q-value}; a malformed q-value counts as refused."""
+    qualities = {}
+    for token in accept_encoding.split(','):
+        coding, *params = [part.strip() for part in token.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    return qualities
+
+
+def get_encoding_quality(qualities, coding):
+    """Returns the q-value the client gives a coding: its own entry, else '*', else 0 ('identity' defaults to 1)."""
+    if coding in qualities:
+        return qualities[coding]
+    if '*' in qualities:
+        return qualities['*']
+    return 1.0 if coding == 'identity' else 0.0
+
+
+def choose_encoding(accept_encoding):
+    """
+    Picks the best content encoding supported by both the client and this server, or None.
+    Codings with q=0 (directly or through '*;q=0') are refused; among the others the highest
+    q-value wins, and Brotli is preferred over gzip on a tie.
+    """
+    qualities = parse_accept_encoding(accept_encoding)
+    candidates = (['br'] if brotli is not None else []) + ['gzip']
+    best_encoding, best_quality = None, 0.0
+    for coding in candidates:
+        quality = get_encoding_quality(qualities, coding)
+        if quality > best_quality:
+            best_encoding, best_quality = coding, quality
+    return best_encoding
+
+
+def is_identity_refused(accept_encoding):
+    """True if the client refuses uncompressed responses ('identity;q=0', or '*;q=0' without identity)."""
+    return get_encoding_quality(parse_accept_encoding(accept_encoding), 'identity') <= 0
+
+
+def compress_response(response):
+    """
+    after_request hook: compresses compressible responses above COMPRESSION_MIN_SIZE
+    with Brotli or gzip, depending on what the client's Accept-Encoding allows.
+    Streamed responses and static files are passed through untouched.
+    """
+    if response.direct_passthrough or response.is_streamed:
+        return response
+    if response.status_code < 200 or response.status_code >= 300 or 'Content-Encoding' in response.headers:
+        return response
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    accept_encoding = request.headers.get('Accept-Encoding', '')
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return response
+
+    body = response.get_data()
+    # Small bodies are sent uncompressed, unless the client refused that
+    if len(body) < COMPRESSION_MIN_SIZE and not is_identity_refused(accept_encoding):
+        return response
+
+    if encoding == 'br':
+        compressed_body = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        compressed_body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+    response.set_data(compressed_body) # Also updates Content-Length
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,133 @@
+# speculation.py
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from list_session import load_open_items
+
+# A speculation lives for about one utterance; after this long it is thrown away unused
+SPECULATION_TTL_SECONDS = 10
+# Upper bound on concurrent speech sessions kept per worker (least recently used are evicted)
+MAX_SPECULATION_SESSIONS = 512
+# Interim transcripts parsed per session; the final transcript usually equals one of the last few
+MAX_PARSES_PER_SESSION = 4
+# Longer interim transcripts are not speculated on (a spoken command is a short sentence)
+MAX_TRANSCRIPT_LENGTH = 300
+
+
+def normalize_transcript(transcript):
+    """
+    Normalizes a transcript for comparing interim and final results: the recognizer often
+    changes only capitalization, spacing or trailing punctuation when it finalizes.
+    """
+    transcript = re.sub(r'\s+', ' ', transcript.strip().lower())
+    return transcript.rstrip('.!?,')
+
+
+class Speculation:
+    """What has been prepared for one speech session: parsed transcripts and a list snapshot."""
+
+    def __init__(self):
+        self.expires_at = time.monotonic() + SPECULATION_TTL_SECONDS
+        self.parses = OrderedDict() # normalized transcript -> parse (list of clause outputs), oldest first
+        self.items = None # Open items of the list, as ListSession would read them
+        self.list_version = None # rec_cache list version the snapshot was read at
+        self.items_loaded_at = None
+
+    def get_parse(self, transcript):
+        """Returns the parse already computed for this transcript, or None."""
+        return self.parses.get(normalize_transcript(transcript))
+
+    def get_items(self, user_id, list_id):
+        """
+        Returns the prefetched open items if they are recent and the list hasn't changed since
+        they were read (by the rec_cache version that every write path bumps), otherwise None.
+        """
+        if self.items is None or self.items_loaded_at + SPECULATION_TTL_SECONDS < time.monotonic():
+            return None
+        # Imported here: rec_cache pulls in the recommender and pandas, which app.py loads (and
+        # times) in its own startup phase, after this module is imported
+        from rec_cache import get_list_versions
+        try:
+            list_version, _ = get_list_versions(user_id, list_id)
+        except Exception as e:
+            print(f"Cannot validate speculative list snapshot, reading the list again: {e}")
+            return None
+        return self.items if list_version == self.list_version else None
+
+
+class SpeculationCache:
+    """
+    Short-lived, per-speech-session cache of work done on interim speech results.
+
+    While the user is still speaking, the client posts interim transcripts; each one is parsed
+    and, the first time, the list's open items are read. When the final command arrives with the
+    same session id, the handler reuses the parse (if the transcript matches) and the snapshot
+    (if the list version is unchanged) instead of starting from scratch.
+
+    Entries are per worker process, so a final command served by another worker just takes the
+    normal path. The version check only sees this worker's writes without a shared rec_cache
+    backend; the TTL bounds how old a snapshot can be in that case.
+    """
+
+    def __init__(self, max_sessions=MAX_SPECULATION_SESSIONS):
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict() # (user_id, list_id, session_id) -> Speculation
+        self.lock = threading.Lock()
+
+    def get_or_create(self, key):
+        with self.lock:
+            speculation = self.sessions.get(key)
+            if speculation is None or speculation.expires_at < time.monotonic():
+                speculation = Speculation()
+            speculation.expires_at = time.monotonic() + SPECULATION_TTL_SECONDS # Still speaking
+            self.sessions[key] = speculation
+            self.sessions.move_to_end(key)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+            return speculation
+
+    def speculate(self, db_client, user_id, list_id, session_id, transcript, parse_command):
+        """
+        Parses an interim transcript and prefetches the list snapshot for the session.
+
+        Args:
+            parse_command: The NLP function (nlp_model.process_compound_command).
+
+        Returns:
+            list: The parse of the transcript, one nlp_output per command clause.
+        """
+        speculation = self.get_or_create((user_id, list_id, session_id))
+        normalized = normalize_transcript(transcript)
+
+        nlp_outputs = speculation.parses.get(normalized)
+        if nlp_outputs is None:
+            nlp_outputs = parse_command(transcript)
+            with self.lock:
+                speculation.parses[normalized] = nlp_outputs
+                while len(speculation.parses) > MAX_PARSES_PER_SESSION:
+                    speculation.parses.popitem(last=False)
+
+        # Read the list once per session (again only if it changed in the meantime). The version
+        # is read before the items, so a write racing with the read makes the snapshot look stale.
+        if speculation.get_items(user_id, list_id) is None:
+            from rec_cache import get_list_versions # See Speculation.get_items
+            list_version, _ = get_list_versions(user_id, list_id)
+            items = load_open_items(db_client, user_id, list_id)
+            with self.lock:
+                speculation.items, speculation.list_version = items, list_version
+                speculation.items_loaded_at = time.monotonic()
+        return nlp_outputs
+
+    def take(self, user_id, list_id, session_id):
+        """Removes and returns the session's speculation (None if missing or expired); it is single-use."""
+        with self.lock:
+            speculation = self.sessions.pop((user_id, list_id, session_id), None)
+        if speculation is None or speculation.expires_at < time.monotonic():
+            return None
+        return speculation
+
+
+# Shared by all request handlers of a worker process
+speculation_cache = SpeculationCache()
@@ -0,0 +1,55 @@
+# startup.py
+import os
+import time
+from contextlib import contextmanager
+
+# Imported first by app.py, so this is (roughly) when the worker process started loading the app
+PROCESS_START = time.perf_counter()
+
+
+class StartupReport:
+    """
+    Times the phases a worker goes through before it can serve traffic (imports, model load,
+    Firestore client init, recipe sync) and tracks whether the worker is ready.
+    """
+
+    def __init__(self):
+        self.phases = [] # (phase name, seconds, pid) in the order they ran
+        self.ready = False
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager timing one startup phase."""
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - phase_start
+            self.phases.append((name, elapsed, os.getpid()))
+            print(f"Startup phase '{name}' took {elapsed * 1000:.0f} ms.")
+
+    def mark_ready(self):
+        """Marks the worker ready to accept traffic and logs the timing report."""
+        self.ready = True
+        self.log_report()
+
+    def as_dict(self):
+        """Returns the report as a JSON-serializable dict (used by the readiness endpoint)."""
+        return {
+            "ready": self.ready,
+            "pid": os.getpid(),
+            "phases": [{"name": name, "ms": round(elapsed * 1000, 1), "pid": pid} for name, elapsed, pid in self.phases]
+        }
+
+    def log_report(self):
+        """Prints every phase's duration and the total time since the process started loading the app."""
+        print(f"--- Startup timing report (pid {os.getpid()}) ---")
+        for name, elapsed, pid in self.phases:
+            # Phases with another pid ran in the gunicorn master before the fork (preload_app)
+            origin = "" if pid == os.getpid() else " (preloaded)"
+            print(f"  {name:<24} {elapsed * 1000:>8.0f} ms{origin}")
+        print(f"  {'total':<24} {(time.perf_counter() - PROCESS_START) * 1000:>8.0f} ms")
+
+
+# One report per process; phases timed before a fork stay in the copy each worker inherits
+startup_report = StartupReport()
@@ -8,9 +8,31 @@ document.addEventListener('DOMContentLoaded', () => {
     const refreshListBtn = document.getElementById('refreshListBtn');
     const loadingSpinner = document.getElementById('loadingSpinner'); // Reference to the loading spinner
     const clearListBtn = document.getElementById('clearListBtn'); // NEW: Reference to the clear list button
+    const loadMoreBtn = document.getElementById('loadMoreBtn');
+
+    const EMPTY_LIST_HTML = '<li class="empty-placeholder py-3 text-gray-500 text-center italic">Your list is currently empty. Start adding items!</li>';
+    const EMPTY_RECOMMENDATIONS_HTML = '<li class="empty-placeholder py-3 text-gray-500 text-center italic">No current suggestions. Add more items and use AuraList frequently for personalized recommendations!</li>';
+
+    // --- Keyed Rendering State ---
+    // Rows are keyed by item id (recommendations by their text) and reused across renders, so a
+    // refresh only touches the rows that actually changed and scroll position is preserved.
+    const itemRows = new Map(); // item id -> { row, item }
+    const recommendationRows = new Map(); // recommendation text -> <li>
+    const pendingRemovals = new Set(); // ids hidden optimistically while their request is in flight
 
     let recognition; // Variable to hold the Web Speech API recognition object
 
+    // --- Tenant (user + list) Routing ---
+    // The server renders which user and list this page belongs to; every API call is routed to
+    // that list. The user is identified by the signed token cookie the server set for this page.
+    const userId = document.body.dataset.userId || 'default_user';
+    const listId = document.body.dataset.listId || 'my_shopping_list';
+    const listApiBase = `/api/lists/${encodeURIComponent(listId)}`;
+
+    function apiFetch(path, options = {}) {
+        return fetch(`${listApiBase}${path}`, Object.assign({ credentials: 'same-origin' }, options));
+    }
+
     // --- Text-to-Speech (TTS) Functionality ---
     const synth = window.speechSynthesis; // Get the SpeechSynthesis object from the browser
 
@@ -33,16 +55,52 @@ document.addEventListener('DOMContentLoaded', () => {
     }
     // --- End TTS Functionality ---
 
+    // --- Speculative Parsing (opt-in, see speculation.py) ---
+    // While the user is still speaking, interim transcripts are posted to the server, which parses
+    // them and reads the list ahead of time; the final command then only has to commit.
+    const speculativeParsing = document.body.dataset.speculativeParsing === 'enabled';
+    const SPECULATE_INTERVAL_MS = 250; // At most one interim transcript is posted per interval
+    let speechSessionId = null; // Ties the interim transcripts of one utterance to its final command
+    let lastSpeculatedTranscript = '';
+    let pendingInterimTranscript = '';
+    let speculateTimer = null;
+
+    function speculateOnInterim(transcript) {
+        pendingInterimTranscript = transcript.trim();
+        if (speculateTimer) {
+            return; // The scheduled post will pick up the latest transcript
+        }
+        speculateTimer = setTimeout(() => {
+            speculateTimer = null;
+            if (!pendingInterimTranscript || pendingInterimTranscript === lastSpeculatedTranscript || !navigator.onLine) {
+                return;
+            }
+            lastSpeculatedTranscript = pendingInterimTranscript;
+            apiFetch('/speculate', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ session_id: speechSessionId, transcript: pendingInterimTranscript }),
+            }).catch(() => {}); // Best effort: the final command works without it
+        }, SPECULATE_INTERVAL_MS);
+    }
+
+    function cancelSpeculation() {
+        clearTimeout(speculateTimer);
+        speculateTimer = null;
+    }
+
 
     // Initialize Web Speech API (Speech-to-Text - STT)
     if ('webkitSpeechRecognition' in window) {
         recognition = new webkitSpeechRecognition();
         recognition.continuous = false;
-        recognition.interimResults = false;
+        recognition.interimResults = speculativeParsing; // Interim results are only needed to speculate
         recognition.lang = 'en-US';
 
         // Event handler for when speech recognition starts
         recognition.onstart = () => {
+            speechSessionId = generateClientId(); // A new utterance starts a new speculation session
+            lastSpeculatedTranscript = '';
             transcriptOutput.textContent = 'Listening... Speak now.';
             statusMessage.textContent = 'Recording audio...';
             startRecognitionBtn.disabled = true;
@@ -52,11 +110,19 @@ document.addEventListener('DOMContentLoaded', () => {
 
         // Event handler when a speech result is obtained
         recognition.onresult = (event) => {
-            const transcript = event.results[0][0].transcript;
+            const result = event.results[event.results.length - 1];
+            const transcript = result[0].transcript;
+            if (!result.isFinal) {
+                // Interim result (speculative parsing mode): show it and let the server get ready
+                transcriptOutput.textContent = `Hearing: "${transcript}"`;
+                speculateOnInterim(transcript);
+                return;
+            }
+            cancelSpeculation();
             transcriptOutput.textContent = `You said: "${transcript}"`;
             statusMessage.textContent = 'Processing command...';
             loadingSpinner.classList.remove('hidden'); // Show spinner during processing
-            sendVoiceCommandToBackend(transcript); // Send transcribed text to Flask backend
+            sendVoiceCommandToBackend(transcript, speculativeParsing ? speechSessionId : null); // Send transcribed text to Flask backend
         };
 
         // Event handler for errors during speech recognition
@@ -92,18 +158,27 @@ document.addEventListener('DOMContentLoaded', () => {
         statusMessage.textContent = 'Please use a Chrome-based browser (e.g., Chrome, Edge) for voice input.';
     }
 
-    async function sendVoiceCommandToBackend(commandText) {
+    async function sendVoiceCommandToBackend(commandText, sessionId = null) {
         statusMessage.textContent = 'Processing command...';
         statusMessage.className = 'status-message text-center text-sm mt-2 text-gray-600';
         loadingSpinner.classList.remove('hidden'); // Show spinner
 
+        // While offline (or while older commands are still waiting) queue the command,
+        // so commands are always applied in the order they were spoken
+        if (offlineQueueSupported && (!navigator.onLine || (await getQueuedCommands()).length > 0)) {
+            await queueCommandForSync(commandText);
+            loadingSpinner.classList.add('hidden');
+            return;
+        }
+
         try {
-            const response = await fetch('/api/process_voice_command', { // This endpoint handles all NLP
+            const response = await apiFetch('/process_voice_command', { // This endpoint handles all NLP
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ command: commandText }),
+                // session_id lets the server reuse what it prepared from the interim transcripts
+                body: JSON.stringify(sessionId ? { command: commandText, session_id: sessionId } : { command: commandText }),
             });
             const data = await response.json();
 
@@ -116,6 +191,11 @@ document.addEventListener('DOMContentLoaded', () => {
 
         } catch (error) {
             console.error('Error sending command to backend:', error);
+            if (error instanceof TypeError && offlineQueueSupported) {
+                // The request never reached the server (e.g. poor signal in the store): keep the command for later
+                await queueCommandForSync(commandText);
+                return;
+            }
             statusMessage.className = 'status-message text-center text-sm mt-2 text-red-600';
             statusMessage.textContent = 'Error communicating with server. Please check the browser console for details.';
             speak('Error communicating with the server. Please check your internet connection.');
@@ -124,75 +204,128 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    // Function to fetch and render both the shopping list and recommendations
-    async function fetchAndRenderLists() {
+    // --- Offline Command Queue (IndexedDB) ---
+    // Commands that can't be sent right away are persisted in IndexedDB and replayed in order
+    // through the bulk /sync endpoint once the browser is back online, one request per batch.
+    const QUEUE_DB_NAME = 'auralist-offline';
+    const QUEUE_STORE_NAME = 'queued_commands';
+    const MAX_SYNC_BATCH = 50; // Must not exceed MAX_SYNC_COMMANDS in app.py
+    const offlineQueueSupported = 'indexedDB' in window;
+    let syncInProgress = false;
+
+    function openQueueDb() {
+        return new Promise((resolve, reject) => {
+            const request = indexedDB.open(QUEUE_DB_NAME, 1);
+            request.onupgradeneeded = () => {
+                // The auto-incremented 'seq' key preserves the order in which commands were spoken
+                request.result.createObjectStore(QUEUE_STORE_NAME, { keyPath: 'seq', autoIncrement: true });
+            };
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    }
+
+    async function runQueueTransaction(mode, callback) {
+        const queueDb = await openQueueDb();
+        return new Promise((resolve, reject) => {
+            const tx = queueDb.transaction(QUEUE_STORE_NAME, mode);
+            const request = callback(tx.objectStore(QUEUE_STORE_NAME));
+            tx.oncomplete = () => { queueDb.close(); resolve(request ? request.result : undefined); };
+            tx.onerror = () => { queueDb.close(); reject(tx.error); };
+        });
+    }
+
+    function generateClientId() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+    }
+
+    async function getQueuedCommands() {
         try {
-            // --- Fetch and Render Shopping List ---
-            const listResponse = await fetch('/api/get_list_items');
-            const items = await listResponse.json();
-            shoppingListUl.innerHTML = ''; // Clear current list content
-
-            if (items.length > 0) {
-                items.forEach(item => {
-                    const li = document.createElement('li');
-                    li.dataset.id = item.id;
-                    li.className = 'flex items-center justify-between py-3 px-2 hover:bg-gray-100 transition duration-150 rounded-md';
-                    
-                    // Create the content span that will be editable
-                    const itemContentSpan = document.createElement('span');
-                    itemContentSpan.className = 'item-content text-lg text-gray-700 font-medium cursor-pointer flex-grow';
-                    itemContentSpan.textContent = item.name; // item.name now includes quantity/unit for display
-                    if (item.note) {
-                        const noteSpan = document.createElement('span');
-                        noteSpan.className = 'text-sm text-gray-500 italic';
-                        noteSpan.textContent = ` (${item.note})`;
-                        itemContentSpan.appendChild(noteSpan);
-                    }
-                    itemContentSpan.onclick = () => enableInlineEdit(li, item); // Enable editing on click
-
-                    // Create action buttons (mark bought, delete)
-                    const itemActionsDiv = document.createElement('div');
-                    itemActionsDiv.className = 'item-actions flex space-x-2 flex-shrink-0';
-
-                    const markBoughtBtn = document.createElement('button');
-                    markBoughtBtn.className = 'mark-bought-btn bg-green-200 hover:bg-green-300 text-green-800 font-semibold py-1.5 px-3 rounded-full text-sm transition duration-200 focus:outline-none focus:ring-2 focus:ring-green-400';
-                    markBoughtBtn.dataset.id = item.id;
-                    markBoughtBtn.textContent = '✔️';
-                    markBoughtBtn.onclick = (event) => toggleItemBought(event.target.dataset.id);
-
-                    const deleteItemBtn = document.createElement('button');
-                    deleteItemBtn.className = 'delete-item-btn bg-red-200 hover:bg-red-300 text-red-800 font-semibold py-1.5 px-3 rounded-full text-sm transition duration-200 focus:outline-none focus:ring-2 focus:ring-red-400';
-                    deleteItemBtn.dataset.id = item.id;
-                    deleteItemBtn.textContent = '🗑️';
-                    deleteItemBtn.onclick = (event) => deleteItem(event.target.dataset.id);
-                    
-                    itemActionsDiv.appendChild(markBoughtBtn);
-                    itemActionsDiv.appendChild(deleteItemBtn);
-
-                    li.appendChild(itemContentSpan);
-                    li.appendChild(itemActionsDiv);
-                    shoppingListUl.appendChild(li);
-                });
-            } else {
-                shoppingListUl.innerHTML = '<li class="py-3 text-gray-500 text-center italic">Your list is currently empty. Start adding items!</li>';
-            }
+            const queued = await runQueueTransaction('readonly', store => store.getAll());
+            return (queued || []).filter(entry => entry.user_id === userId && entry.list_id === listId);
+        } catch (error) {
+            console.error('Could not read the offline command queue:', error);
+            return [];
+        }
+    }
 
-            // --- Fetch and Render Recommendations ---
-            const recResponse = await fetch('/api/get_recommendations');
-            const recommendations = await recResponse.json();
-            recommendationsListUl.innerHTML = ''; // Clear current recommendations content
-
-            if (recommendations.length > 0) {
-                recommendations.forEach(rec => {
-                    const li = document.createElement('li');
-                    li.className = 'py-3 text-lg text-gray-700 font-medium hover:bg-gray-100 transition duration-150 rounded-md px-2';
-                    li.textContent = rec;
-                    recommendationsListUl.appendChild(li);
+    async function queueCommandForSync(commandText) {
+        await runQueueTransaction('readwrite', store => store.add({
+            client_id: generateClientId(), // Lets the server skip commands it has already applied
+            user_id: userId,
+            list_id: listId,
+            command: commandText,
+            queued_at: Date.now()
+        }));
+        statusMessage.className = 'status-message text-center text-sm mt-2 text-yellow-600';
+        statusMessage.textContent = `Saved "${commandText}". It will be applied as soon as you're back online.`;
+        speak('You seem to be offline. I saved that and will update your list once you are back online.');
+        syncQueuedCommands();
+    }
+
+    async function syncQueuedCommands() {
+        if (!offlineQueueSupported || syncInProgress || !navigator.onLine) {
+            return;
+        }
+        syncInProgress = true;
+        try {
+            let queued = await getQueuedCommands();
+            let syncedCount = 0;
+            while (queued.length > 0) {
+                const chunk = queued.slice(0, MAX_SYNC_BATCH);
+                const response = await apiFetch('/sync', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ commands: chunk.map(entry => ({ client_id: entry.client_id, command: entry.command })) })
                 });
-            } else {
-                recommendationsListUl.innerHTML = '<li class="py-3 text-gray-500 text-center italic">No current suggestions. Add more items and use AuraList frequently for personalized recommendations!</li>';
+                if (response.status >= 500 || response.status === 429) {
+                    // Server overloaded (or down): retry when it asks us to, or on the next 'online' event
+                    const retryAfterSeconds = parseInt(response.headers.get('Retry-After'), 10);
+                    if (retryAfterSeconds > 0) {
+                        setTimeout(syncQueuedCommands, retryAfterSeconds * 1000);
+                    }
+                    throw new Error(`Sync failed with status ${response.status}`);
+                }
+                if (response.ok) {
+                    const data = await response.json();
+                    renderShoppingList(data.items); // The server returns the merged list state
+                    syncedCount += chunk.length;
+                } else {
+                    console.error('Dropping offline commands rejected by the server:', chunk);
+                }
+                await runQueueTransaction('readwrite', store => { chunk.forEach(entry => store.delete(entry.seq)); });
+                queued = queued.slice(MAX_SYNC_BATCH);
+            }
+            if (syncedCount > 0) {
+                statusMessage.className = 'status-message text-center text-sm mt-2 text-green-600';
+                statusMessage.textContent = `Synced ${syncedCount} offline command${syncedCount === 1 ? '' : 's'}.`;
+                await fetchAndRenderRecommendations();
             }
+        } catch (error) {
+            console.error('Error syncing offline commands:', error);
+        } finally {
+            syncInProgress = false;
+        }
+    }
+
+    window.addEventListener('online', syncQueuedCommands);
 
+    // Function to fetch and render both the shopping list and recommendations
+    async function fetchAndRenderLists() {
+        try {
+            // --- Fetch and Render Shopping List (streamed, only id, name and note are sent) ---
+            // Rows are patched into place as items arrive; rows of items that are gone are only
+            // removed once the whole stream was read, so a failed load leaves the list intact
+            const patcher = createShoppingListPatcher();
+            await streamListItems(items => patcher.place(items));
+            patcher.finish();
+            setNextCursor(null); // The stream always contains every item
+
+            // --- Fetch and Render Recommendations ---
+            await fetchAndRenderRecommendations();
         } catch (error) {
             console.error('Error fetching lists:', error);
             statusMessage.textContent = 'Could not load lists. Please check the browser console.';
@@ -201,6 +334,251 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    async function fetchAndRenderRecommendations() {
+        const recResponse = await apiFetch('/get_recommendations');
+        renderRecommendations(await recResponse.json());
+    }
+
+    // Streams the whole list as NDJSON and renders rows as they arrive,
+    // so long lists start showing up before the server has sent everything
+    async function streamListItems(onItems) {
+        const response = await apiFetch('/get_list_items?compact=1&stream=1');
+        if (!response.ok) {
+            throw new Error(`Loading the list failed with status ${response.status}`);
+        }
+        await readNdjson(response, onItems);
+    }
+
+    // Reads an NDJSON response incrementally, handing each batch of parsed lines to the callback
+    async function readNdjson(response, onObjects) {
+        const parseLines = lines => lines.filter(line => line.trim()).map(line => JSON.parse(line));
+
+        if (!response.body || !response.body.getReader) { // Older browsers: no streaming, parse at the end
+            onObjects(parseLines((await response.text()).split('\n')));
+            return;
+        }
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffered += decoder.decode(value, { stream: true });
+            const lines = buffered.split('\n');
+            buffered = lines.pop(); // Keep a possibly incomplete last line for the next chunk
+            onObjects(parseLines(lines));
+        }
+        onObjects(parseLines([buffered]));
+    }
+
+    // Keyed reconciliation: places rows one by one at a moving cursor, moving only rows that are
+    // out of order; finish() removes every row that wasn't placed (plus any placeholder)
+    function createKeyedPatcher(container, onRemove) {
+        let cursor = container.firstChild;
+        return {
+            place(row) {
+                while (cursor && cursor.nodeType !== Node.ELEMENT_NODE) { // Drop whitespace left by the template
+                    const next = cursor.nextSibling;
+                    container.removeChild(cursor);
+                    cursor = next;
+                }
+                if (row === cursor) {
+                    cursor = cursor.nextSibling;
+                } else {
+                    container.insertBefore(row, cursor);
+                }
+            },
+            finish() {
+                while (cursor) {
+                    const next = cursor.nextSibling;
+                    container.removeChild(cursor);
+                    if (onRemove && cursor.nodeType === Node.ELEMENT_NODE) {
+                        onRemove(cursor);
+                    }
+                    cursor = next;
+                }
+            }
+        };
+    }
+
+    function createShoppingListPatcher() {
+        const patcher = createKeyedPatcher(shoppingListUl, row => {
+            const entry = row.dataset.id && itemRows.get(row.dataset.id);
+            if (entry && entry.row === row) {
+                itemRows.delete(row.dataset.id);
+            }
+        });
+        return {
+            place(items) {
+                items.filter(item => !pendingRemovals.has(item.id))
+                    .forEach(item => patcher.place(getOrUpdateItemRow(item)));
+            },
+            finish() {
+                patcher.finish();
+                updateEmptyPlaceholder();
+            }
+        };
+    }
+
+    function renderShoppingList(items) {
+        const patcher = createShoppingListPatcher();
+        patcher.place(items);
+        patcher.finish();
+        setNextCursor(null); // A full render always contains every item
+    }
+
+    // Shows the "empty list" row when no item rows are left, and removes it otherwise
+    function updateEmptyPlaceholder() {
+        const placeholder = shoppingListUl.querySelector('.empty-placeholder');
+        if (itemRows.size === 0 && !placeholder) {
+            shoppingListUl.insertAdjacentHTML('beforeend', EMPTY_LIST_HTML);
+        } else if (itemRows.size > 0 && placeholder) {
+            placeholder.remove();
+        }
+    }
+
+    // Returns the row for an item: the existing one (its text updated only if the item changed), or a new one
+    function getOrUpdateItemRow(item) {
+        const entry = itemRows.get(item.id);
+        if (!entry) {
+            const row = createItemRow(item);
+            itemRows.set(item.id, { row, item });
+            return row;
+        }
+        const changed = entry.item.name !== item.name || (entry.item.note || '') !== (item.note || '');
+        if (changed && entry.row.dataset.editing !== 'true') { // Never clobber an open inline editor
+            renderItemContent(entry.row.querySelector('.item-content'), item);
+            entry.row.dataset.name = item.name;
+            entry.row.dataset.note = item.note || '';
+        }
+        entry.item = item;
+        return entry.row;
+    }
+
+    // Fills an item's content span with its display name and (optional) note
+    function renderItemContent(itemContentSpan, item) {
+        itemContentSpan.textContent = item.name; // item.name now includes quantity/unit for display
+        if (item.note) {
+            const noteSpan = document.createElement('span');
+            noteSpan.className = 'text-sm text-gray-500 italic';
+            noteSpan.textContent = ` (${item.note})`;
+            itemContentSpan.appendChild(noteSpan);
+        }
+    }
+
+    // Creates the <li> (with its edit, mark bought and delete handlers) for one list item.
+    // Handlers look the item up by the row's id, so they keep working when the row is reused.
+    function createItemRow(item) {
+        const li = document.createElement('li');
+        li.dataset.id = item.id;
+        li.dataset.name = item.name;
+        li.dataset.note = item.note || '';
+        li.className = 'flex items-center justify-between py-3 px-2 hover:bg-gray-100 transition duration-150 rounded-md';
+        
+        // Create the content span that will be editable
+        const itemContentSpan = document.createElement('span');
+        itemContentSpan.className = 'item-content text-lg text-gray-700 font-medium cursor-pointer flex-grow';
+        renderItemContent(itemContentSpan, item);
+        itemContentSpan.onclick = () => {
+            if (li.dataset.editing !== 'true') {
+                enableInlineEdit(li, itemRows.get(li.dataset.id).item); // Enable editing on click
+            }
+        };
+
+        // Create action buttons (mark bought, delete)
+        const itemActionsDiv = document.createElement('div');
+        itemActionsDiv.className = 'item-actions flex space-x-2 flex-shrink-0';
+
+        const markBoughtBtn = document.createElement('button');
+        markBoughtBtn.className = 'mark-bought-btn bg-green-200 hover:bg-green-300 text-green-800 font-semibold py-1.5 px-3 rounded-full text-sm transition duration-200 focus:outline-none focus:ring-2 focus:ring-green-400';
+        markBoughtBtn.textContent = '✔️';
+        markBoughtBtn.onclick = () => toggleItemBought(li.dataset.id);
+
+        const deleteItemBtn = document.createElement('button');
+        deleteItemBtn.className = 'delete-item-btn bg-red-200 hover:bg-red-300 text-red-800 font-semibold py-1.5 px-3 rounded-full text-sm transition duration-200 focus:outline-none focus:ring-2 focus:ring-red-400';
+        deleteItemBtn.textContent = '🗑️';
+        deleteItemBtn.onclick = () => deleteItem(li.dataset.id);
+        
+        itemActionsDiv.appendChild(markBoughtBtn);
+        itemActionsDiv.appendChild(deleteItemBtn);
+
+        li.appendChild(itemContentSpan);
+        li.appendChild(itemActionsDiv);
+        return li;
+    }
+
+    // --- Cursor Pagination ("Load more") ---
+    function setNextCursor(cursor) {
+        shoppingListUl.dataset.nextCursor = cursor || '';
+        loadMoreBtn.classList.toggle('hidden', !cursor);
+    }
+
+    async function loadMoreItems() {
+        const cursor = shoppingListUl.dataset.nextCursor;
+        if (!cursor) {
+            return;
+        }
+        loadMoreBtn.disabled = true;
+        try {
+            const pageSize = shoppingListUl.dataset.pageSize || 50;
+            const response = await apiFetch(`/get_list_items?compact=1&limit=${pageSize}&start_after=${encodeURIComponent(cursor)}`);
+            if (!response.ok) {
+                await fetchAndRenderLists(); // The cursor item is gone (e.g. deleted elsewhere): reload everything
+                return;
+            }
+            const page = await response.json();
+            page.items.filter(item => !itemRows.has(item.id) && !pendingRemovals.has(item.id))
+                .forEach(item => shoppingListUl.appendChild(getOrUpdateItemRow(item)));
+            updateEmptyPlaceholder();
+            setNextCursor(page.next_cursor);
+        } catch (error) {
+            console.error('Error loading more items:', error);
+        } finally {
+            loadMoreBtn.disabled = false;
+        }
+    }
+
+    loadMoreBtn.addEventListener('click', loadMoreItems);
+
+    // The server renders the first page of items without event handlers; rebuild those rows
+    // from their data attributes instead of fetching the same items again, and register the
+    // server-rendered recommendation rows so later renders can reuse them
+    function hydrateServerRenderedList() {
+        const rows = Array.from(shoppingListUl.querySelectorAll('li[data-id]'));
+        const cursor = shoppingListUl.dataset.nextCursor;
+        rows.forEach(row => {
+            const item = { id: row.dataset.id, name: row.dataset.name, note: row.dataset.note || undefined };
+            shoppingListUl.replaceChild(getOrUpdateItemRow(item), row);
+        });
+        setNextCursor(cursor);
+
+        recommendationsListUl.querySelectorAll('li:not(.empty-placeholder)').forEach(row => {
+            recommendationRows.set(row.textContent.trim(), row);
+        });
+    }
+
+    function renderRecommendations(recommendations) {
+        // Same keyed patching as the shopping list: unchanged suggestions keep their <li>
+        const patcher = createKeyedPatcher(recommendationsListUl, row => recommendationRows.delete(row.textContent));
+        recommendations.forEach(rec => {
+            let li = recommendationRows.get(rec);
+            if (!li) {
+                li = document.createElement('li');
+                li.className = 'py-3 text-lg text-gray-700 font-medium hover:bg-gray-100 transition duration-150 rounded-md px-2';
+                li.textContent = rec;
+                recommendationRows.set(rec, li);
+            }
+            patcher.place(li);
+        });
+        patcher.finish();
+
+        if (recommendations.length === 0) {
+            recommendationsListUl.innerHTML = EMPTY_RECOMMENDATIONS_HTML;
+        }
+    }
+
     // --- Inline Editing Functions ---
     function enableInlineEdit(listItem, itemData) {
         const itemContentSpan = listItem.querySelector('.item-content');
@@ -234,7 +612,7 @@ document.addEventListener('DOMContentLoaded', () => {
         cancelBtn.className = 'bg-gray-400 hover:bg-gray-500 text-white font-bold py-1 px-2 rounded-md text-sm';
         cancelBtn.textContent = 'Cancel';
         // On cancel, revert to original display and restore old buttons
-        cancelBtn.onclick = () => cancelInlineEdit(listItem, originalDisplayName, originalNote);
+        cancelBtn.onclick = () => cancelInlineEdit(listItem, itemData);
 
         // Clear existing content and append inputs/buttons
         itemContentSpan.innerHTML = '';
@@ -256,6 +634,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         // Hide original action buttons while editing
         listItem.querySelector('.item-actions').classList.add('hidden');
+        listItem.dataset.editing = 'true'; // Keyed renders leave the row's content alone meanwhile
     }
 
     async function saveInlineEdit(listItem, itemId, newNameDisplay, newNote) {
@@ -288,7 +667,7 @@ document.addEventListener('DOMContentLoaded', () => {
         }
         
         try {
-            const response = await fetch('/api/edit_item', {
+            const response = await apiFetch('/edit_item', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
@@ -303,7 +682,9 @@ document.addEventListener('DOMContentLoaded', () => {
             statusMessage.textContent = data.message;
             statusMessage.className = `status-message text-center text-sm mt-2 ${data.status === 'success' ? 'text-green-600' : 'text-red-600'}`;
             speak(data.message);
-            await fetchAndRenderLists(); // Refresh lists after successful edit
+            const entry = itemRows.get(itemId);
+            cancelInlineEdit(listItem, entry ? entry.item : { name: newNameDisplay, note: newNote });
+            await fetchAndRenderLists(); // Refresh lists after the edit (a renamed item has a new ID, so its row is replaced)
         } catch (error) {
             console.error('Error saving item:', error);
             statusMessage.textContent = 'Error saving item.';
@@ -312,10 +693,11 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    function cancelInlineEdit(listItem, originalDisplayName, originalNote) {
+    function cancelInlineEdit(listItem, itemData) {
         const itemContentSpan = listItem.querySelector('.item-content');
         // Reconstruct original display content
-        itemContentSpan.innerHTML = `${originalDisplayName} ${originalNote ? `<span class="text-sm text-gray-500 italic">(${originalNote})</span>` : ''}`;
+        renderItemContent(itemContentSpan, itemData);
+        delete listItem.dataset.editing;
         itemContentSpan.classList.add('cursor-pointer');
         itemContentSpan.classList.remove('flex', 'flex-col'); // Remove flex styling
         listItem.querySelector('.item-actions').classList.remove('hidden'); // Show original buttons
@@ -323,29 +705,41 @@ document.addEventListener('DOMContentLoaded', () => {
 
 
     // --- Event listener for "Mark Bought" and "Delete Item" buttons ---
-    async function toggleItemBought(itemId) {
-        try {
-            const response = await fetch('/api/toggle_item_bought', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ item_id: itemId })
-            });
-            const data = await response.json();
-            statusMessage.textContent = data.message;
-            statusMessage.className = `status-message text-center text-sm mt-2 ${data.status === 'success' ? 'text-green-600' : 'text-red-600'}`;
-            speak(data.message);
-            await fetchAndRenderLists(); // Refresh lists
-        } catch (error) {
-            console.error('Error toggling item status:', error);
-            statusMessage.textContent = 'Error toggling item status.';
-            statusMessage.className = 'status-message text-center text-sm mt-2 text-red-600';
-            speak('Error toggling item status.');
+    // Both are optimistic: the row disappears immediately and is put back if the server disagrees.
+
+    // Hides an item's row while its request is in flight; returns a function that puts it back
+    function removeRowOptimistically(itemId) {
+        const entry = itemRows.get(itemId);
+        if (!entry) {
+            return () => {};
         }
+        const nextSibling = entry.row.nextSibling;
+        pendingRemovals.add(itemId);
+        itemRows.delete(itemId);
+        entry.row.remove();
+        updateEmptyPlaceholder();
+
+        return () => {
+            pendingRemovals.delete(itemId);
+            if (itemRows.has(itemId)) {
+                return; // A refresh already brought the item back
+            }
+            itemRows.set(itemId, entry);
+            if (nextSibling && nextSibling.parentNode === shoppingListUl) {
+                shoppingListUl.insertBefore(entry.row, nextSibling);
+            } else {
+                shoppingListUl.appendChild(entry.row);
+            }
+            updateEmptyPlaceholder();
+        };
     }
 
-    async function deleteItem(itemId) {
+    // Sends a toggle/delete request for a row that was already removed optimistically, and
+    // reconciles: confirmed removals stay, anything else restores the row or reloads the list
+    async function applyOptimisticRemoval(itemId, path, errorMessage) {
+        const restoreRow = removeRowOptimistically(itemId);
         try {
-            const response = await fetch('/api/delete_item', {
+            const response = await apiFetch(path, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ item_id: itemId })
@@ -354,15 +748,35 @@ document.addEventListener('DOMContentLoaded', () => {
             statusMessage.textContent = data.message;
             statusMessage.className = `status-message text-center text-sm mt-2 ${data.status === 'success' ? 'text-green-600' : 'text-red-600'}`;
             speak(data.message);
-            await fetchAndRenderLists(); // Refresh lists
+
+            if (data.status !== 'success') {
+                restoreRow();
+                await fetchAndRenderLists(); // Our view was out of date (e.g. changed on another device)
+                return;
+            }
+            pendingRemovals.delete(itemId);
+            if (data.is_bought === false) {
+                await fetchAndRenderLists(); // The item was restored from its purchase: show it again
+            } else {
+                await fetchAndRenderRecommendations(); // The list itself is already up to date
+            }
         } catch (error) {
-            console.error('Error deleting item:', error);
-            statusMessage.textContent = 'Error deleting item.';
+            console.error(`${errorMessage}:`, error);
+            restoreRow();
+            statusMessage.textContent = `${errorMessage}.`;
             statusMessage.className = 'status-message text-center text-sm mt-2 text-red-600';
-            speak('Error deleting item.');
+            speak(`${errorMessage}.`);
         }
     }
 
+    async function toggleItemBought(itemId) {
+        await applyOptimisticRemoval(itemId, '/toggle_item_bought', 'Error toggling item status');
+    }
+
+    async function deleteItem(itemId) {
+        await applyOptimisticRemoval(itemId, '/delete_item', 'Error deleting item');
+    }
+
 
     // Event listener for the manual "Refresh List" button
     refreshListBtn.addEventListener('click', async () => {
@@ -380,11 +794,23 @@ document.addEventListener('DOMContentLoaded', () => {
             loadingSpinner.classList.remove('hidden'); // Show spinner
 
             try {
-                const response = await fetch('/api/clear_list', {
+                // Large lists are cleared in several batches; the server streams progress after each one
+                const response = await apiFetch('/clear_list?stream=1', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' }
                 });
-                const data = await response.json();
+                let data = { status: 'error', message: 'Error clearing list.' };
+                if (response.ok) {
+                    await readNdjson(response, updates => updates.forEach(update => {
+                        if (update.status === 'progress') {
+                            statusMessage.textContent = `Clearing shopping list... ${update.deleted} items removed so far.`;
+                        } else {
+                            data = update;
+                        }
+                    }));
+                } else {
+                    data = await response.json();
+                }
                 statusMessage.textContent = data.message;
                 statusMessage.className = `status-message text-center text-sm mt-2 ${data.status === 'success' ? 'text-green-600' : 'text-red-600'}`;
                 speak(data.message);
@@ -400,6 +826,41 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
-    // Initial call to fetch and render lists when the page first loads
-    fetchAndRenderLists();
+    // The service worker served a saved copy of this page (slow network or offline, see sw.js),
+    // so its rows may be out of date: reload the list now, or as soon as the browser is back online
+    function refreshCachedPage() {
+        if (navigator.onLine) {
+            fetchAndRenderLists();
+            return;
+        }
+        statusMessage.textContent = "You're offline, so this is a saved copy of your list. It will update once you're back online.";
+        statusMessage.className = 'status-message text-center text-sm mt-2 text-yellow-600';
+        window.addEventListener('online', () => {
+            statusMessage.textContent = '';
+            fetchAndRenderLists();
+        }, { once: true });
+    }
+
+    // The first page of the list and the recommendations are usually rendered by the server:
+    // attach handlers to those rows, then replay anything queued during a previous offline session.
+    // With async hydration (ASYNC_LIST_HYDRATION) the server may send the page without them
+    // (data-hydrate="async"); they are loaded here instead, once.
+    hydrateServerRenderedList();
+    if (document.body.dataset.servedFromCache === 'true') {
+        refreshCachedPage();
+    } else if (shoppingListUl.dataset.hydrate === 'async') {
+        fetchAndRenderLists(); // The list and the recommendations
+    } else if (recommendationsListUl.dataset.hydrate === 'async') {
+        fetchAndRenderRecommendations().catch(error => console.error('Error fetching recommendations:', error));
+    }
+    syncQueuedCommands();
+
+    // --- App-Shell Service Worker ---
+    // Only registered when the assets were built (build_assets.py): it precaches the fingerprinted
+    // CSS/JS so repeat visits load them from cache, and serves the last copy of the page offline.
+    if ('serviceWorker' in navigator && document.body.dataset.serviceWorker === 'enabled') {
+        navigator.serviceWorker.register('/sw.js').catch(error => {
+            console.error('Service worker registration failed:', error);
+        });
+    }
 });
@@ -0,0 +1,97 @@
+// sw.js - App-shell service worker, served at '/sw.js' so it controls the whole site.
+// build_assets.py writes static/dist/sw.js from this file with the two values below filled in.
+const CACHE_VERSION = 'dev';
+const PRECACHE_URLS = [];
+
+const SHELL_CACHE = `auralist-shell-${CACHE_VERSION}`; // Fingerprinted CSS/JS of this build
+const PAGE_CACHE = 'auralist-pages'; // Last good copy of each visited page, for offline loads
+const NAVIGATION_TIMEOUT_MS = 3000; // After this long on a slow network, the cached page is shown
+
+// Install: download the app shell of this build up front
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(SHELL_CACHE)
+            .then(cache => cache.addAll(PRECACHE_URLS))
+            .then(() => self.skipWaiting())
+    );
+});
+
+// Activate: drop the shells of previous builds and take control of open pages right away
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(cacheNames => Promise.all(cacheNames
+                .filter(cacheName => cacheName.startsWith('auralist-shell-') && cacheName !== SHELL_CACHE)
+                .map(cacheName => caches.delete(cacheName))))
+            .then(() => self.clients.claim())
+    );
+});
+
+// Fingerprinted assets never change, so the cached copy is always correct
+async function cacheFirst(request) {
+    const cached = await caches.match(request);
+    if (cached) {
+        return cached;
+    }
+    const response = await fetch(request);
+    if (response.ok) {
+        const cache = await caches.open(SHELL_CACHE);
+        cache.put(request, response.clone());
+    }
+    return response;
+}
+
+// A cached page may be days old. It is marked (a header, and an attribute on <body> that app.js
+// reads), so the page refreshes its list from the API instead of trusting the rendered rows.
+async function markServedFromCache(cached) {
+    const html = (await cached.text()).replace('<body', '<body data-served-from-cache="true"');
+    const headers = new Headers(cached.headers);
+    headers.set('X-Served-From', 'service-worker-cache');
+    return new Response(html, { status: cached.status, statusText: cached.statusText, headers });
+}
+
+// Pages hold the current list, so the network wins; the cached copy is only a fallback
+async function networkFirst(request) {
+    const cache = await caches.open(PAGE_CACHE);
+    const networkResponse = fetch(request).then(response => {
+        if (response.ok) {
+            cache.put(request, response.clone());
+        }
+        return response;
+    });
+    networkResponse.catch(() => {}); // A late failure after a cached fallback was served is expected
+    const timeout = new Promise(resolve => setTimeout(resolve, NAVIGATION_TIMEOUT_MS));
+
+    try {
+        const response = await Promise.race([networkResponse, timeout]);
+        if (response) {
+            return response;
+        }
+        // Slow network: show the cached page if there is one, otherwise keep waiting
+        const cached = await cache.match(request);
+        return cached ? markServedFromCache(cached) : networkResponse;
+    } catch (error) {
+        // Offline: fall back to this page's last copy, or to the main list page
+        const cached = (await cache.match(request)) || (await cache.match('/'));
+        if (cached) {
+            return markServedFromCache(cached);
+        }
+        throw error;
+    }
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+
+    // API calls always go to the network; app.js queues voice commands itself while offline
+    if (request.method !== 'GET' || url.origin !== self.location.origin || url.pathname.startsWith('/api/')) {
+        return;
+    }
+
+    if (url.pathname.startsWith('/static/dist/')) {
+        event.respondWith(cacheFirst(request));
+    } else if (request.mode === 'navigate') {
+        event.respondWith(networkFirst(request));
+    }
+});
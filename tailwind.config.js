@@ -0,0 +1,14 @@
+// tailwind.config.js
+// Used by build_assets.py: Tailwind only generates the classes found in these files.
+module.exports = {
+    content: ['./templates/**/*.html', './static/js/**/*.js'],
+    theme: {
+        extend: {
+            fontFamily: {
+                // Inter when the device has it, otherwise the platform UI font (no web font download)
+                inter: ['Inter', 'system-ui', '-apple-system', 'Segoe UI', 'Roboto', 'sans-serif'],
+            },
+        },
+    },
+    plugins: [],
+};
@@ -0,0 +1,168 @@
+# tenancy.py
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import threading
+from collections import OrderedDict
+
+from firebase_admin import firestore
+
+# Every household (user) owns its own partition in Firestore:
+#
+#   users/{user_id}                                   -> user document
+#   users/{user_id}/shopping_lists/{list_id}          -> list document
+#   users/{user_id}/shopping_lists/{list_id}/list_items/{item_id}    (open items only)
+#   users/{user_id}/shopping_lists/{list_id}/purchases/{purchase_id} (bought items, see purchases.py)
+#   users/{user_id}/user_history/{event_id}
+#   users/{user_id}/history_rollups/{day}__{action_type}__{item_key}   (see history_compaction.py)
+#   users/{user_id}/user_history_archive/{event_id}                    (optional, see history_compaction.py)
+#
+# Queries therefore only ever touch one tenant's data, and no 'list_id' filter
+# (or composite index on it) is needed for list items.
+#
+# Requests without a user token belong to the default user (the single household the app
+# started with). Every other user ID is issued by the server ('flask user-token') and only
+# accepted as a signed token: '<user_id>.<HMAC-SHA256 of the user ID>'.
+
+DEFAULT_USER_ID = 'default_user'
+DEFAULT_LIST_ID = 'my_shopping_list'
+DEFAULT_LIST_NAME = 'My Shopping List'
+
+# Firestore document IDs may not contain '/', and we keep them short and URL-safe.
+TENANT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# Secret signing the user tokens; without it, only the default user can be served
+USER_TOKEN_SECRET = os.environ.get('USER_TOKEN_SECRET', '')
+
+# Per-tenant cache of lists that are known to exist, so hot endpoints don't
+# have to re-read the list document on every request. Bounded: least recently used lists are forgotten.
+MAX_KNOWN_LISTS = 10000
+_known_lists = OrderedDict() # (user_id, list_id) -> True
+_known_lists_lock = threading.Lock()
+
+
+def is_valid_tenant_id(value):
+    """Returns True if the value can safely be used as a user or list document ID."""
+    return isinstance(value, str) and bool(TENANT_ID_PATTERN.match(value))
+
+
+def sign_user_id(user_id, secret):
+    return hmac.new(secret.encode('utf-8'), user_id.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def make_user_token(user_id):
+    """Returns the token that identifies a (server-issued) user in requests."""
+    if not USER_TOKEN_SECRET:
+        raise ValueError("USER_TOKEN_SECRET is not set.")
+    return f"{user_id}.{sign_user_id(user_id, USER_TOKEN_SECRET)}"
+
+
+def get_user_id_from_token(token):
+    """Returns the user ID of a validly signed user token, or None."""
+    if not USER_TOKEN_SECRET or not token or '.' not in token:
+        return None
+    user_id, signature = token.rsplit('.', 1)
+    if not is_valid_tenant_id(user_id):
+        return None
+    # Compared as bytes: compare_digest rejects non-ASCII str arguments with a TypeError
+    expected = sign_user_id(user_id, USER_TOKEN_SECRET)
+    return user_id if hmac.compare_digest(expected.encode('utf-8'), signature.encode('utf-8')) else None
+
+
+def remember_list(user_id, list_id):
+    with _known_lists_lock:
+        _known_lists[(user_id, list_id)] = True
+        _known_lists.move_to_end((user_id, list_id))
+        while len(_known_lists) > MAX_KNOWN_LISTS:
+            _known_lists.popitem(last=False)
+
+
+def is_known_list(user_id, list_id):
+    with _known_lists_lock:
+        if (user_id, list_id) not in _known_lists:
+            return False
+        _known_lists.move_to_end((user_id, list_id))
+        return True
+
+
+def get_user_ref(db_client, user_id):
+    """Returns the document reference for a user's partition."""
+    return db_client.collection('users').document(user_id)
+
+
+def get_lists_ref(db_client, user_id):
+    """Returns the collection reference holding all shopping lists of a user."""
+    return get_user_ref(db_client, user_id).collection('shopping_lists')
+
+
+def get_list_ref(db_client, user_id, list_id):
+    """Returns the document reference for one of a user's shopping lists."""
+    return get_lists_ref(db_client, user_id).document(list_id)
+
+
+def get_list_items_ref(db_client, user_id, list_id):
+    """Returns the collection reference holding the items of one shopping list."""
+    return get_list_ref(db_client, user_id, list_id).collection('list_items')
+
+
+def get_purchases_ref(db_client, user_id, list_id):
+    """Returns the collection reference holding the archived (bought) items of one shopping list."""
+    return get_list_ref(db_client, user_id, list_id).collection('purchases')
+
+
+def get_history_ref(db_client, user_id):
+    """Returns the collection reference holding a user's history events."""
+    return get_user_ref(db_client, user_id).collection('user_history')
+
+
+def get_history_rollups_ref(db_client, user_id):
+    """Returns the collection reference holding a user's compacted daily history rollups."""
+    return get_user_ref(db_client, user_id).collection('history_rollups')
+
+
+def get_history_archive_ref(db_client, user_id):
+    """Returns the collection reference holding a user's archived raw history events."""
+    return get_user_ref(db_client, user_id).collection('user_history_archive')
+
+
+def ensure_list_exists(db_client, user_id, list_id):
+    """
+    Checks that a shopping list exists for the user. Only the default user's default list is
+    created on first use; issued users get theirs in create_user, so unknown IDs never create
+    documents. Results are cached per tenant so the list document is rarely re-read.
+
+    Returns:
+        True if the list exists (or was just created), False otherwise.
+    """
+    if is_known_list(user_id, list_id):
+        return True
+
+    list_ref = get_list_ref(db_client, user_id, list_id)
+    if not list_ref.get().exists:
+        if user_id != DEFAULT_USER_ID or list_id != DEFAULT_LIST_ID:
+            return False
+        list_ref.set({"name": DEFAULT_LIST_NAME})
+        print(f"Created default shopping list for user '{user_id}'.")
+
+    remember_list(user_id, list_id)
+    return True
+
+
+def create_user(db_client):
+    """Creates a new user (household) with its default list and returns the user ID."""
+    user_id = secrets.token_hex(10)
+    get_user_ref(db_client, user_id).set({"created_at": firestore.SERVER_TIMESTAMP})
+    get_list_ref(db_client, user_id, DEFAULT_LIST_ID).set({"name": DEFAULT_LIST_NAME})
+    remember_list(user_id, DEFAULT_LIST_ID)
+    return user_id
+
+
+def create_list(db_client, user_id, list_name):
+    """Creates a new shopping list for the user and returns its document ID."""
+    list_ref = get_lists_ref(db_client, user_id).document()
+    list_ref.set({"name": list_name})
+    remember_list(user_id, list_ref.id)
+    return list_ref.id
+